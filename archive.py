@@ -0,0 +1,219 @@
+import argparse
+import glob
+import json
+import os
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.FileHandler("ib_api.log")]
+)
+
+try:
+    import pyarrow  # noqa: F401
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+COLUMNS = ['Date', 'Open', 'High', 'Low', 'Close', 'Volume', 'Ticker']
+VALUE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+EXTENSIONS = ('parquet', 'npz')
+
+
+def month_start(timestamp):
+    return pd.Timestamp(timestamp).normalize().replace(day=1)
+
+
+class BarArchive:
+    """
+    Cold bars kept outside the database as one compressed file per ticker and month:
+    <root>/<table>/<TICKER>/<YYYY-MM>.parquet (zstd, when pyarrow is installed) or .npz.
+    Every bar older than the cutoff in manifest.json lives in the archive, everything newer in the
+    database, so readers can stitch the two without overlaps.
+    """
+
+    def __init__(self, root=None, table_name='minute_data', file_format=None):
+        self.root = root or os.getenv('STOCKDATADB_ARCHIVE', 'archive')
+        self.table_name = table_name
+        self.directory = os.path.join(self.root, table_name)
+        self.file_format = file_format or ('parquet' if PARQUET_AVAILABLE else 'npz')
+        self.manifest_path = os.path.join(self.directory, 'manifest.json')
+        self.cutoff = None
+        self.load_manifest()
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            self.cutoff = None
+            return
+        with open(self.manifest_path) as manifest:
+            self.cutoff = pd.Timestamp(json.load(manifest)['archived_before'])
+        logger.info(f"Archive for {self.table_name} holds bars before {self.cutoff}")
+
+    def set_cutoff(self, cutoff):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as manifest:
+            json.dump({'archived_before': pd.Timestamp(cutoff).isoformat(), 'updated': datetime.now().isoformat()},
+                      manifest)
+        os.replace(tmp_path, self.manifest_path)
+        self.cutoff = pd.Timestamp(cutoff)
+
+    def _path(self, ticker, month, file_format):
+        return os.path.join(self.directory, ticker, f"{month:%Y-%m}.{file_format}")
+
+    def tickers(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if os.path.isdir(os.path.join(self.directory, name)))
+
+    def month_files(self, ticker):
+        files = {}
+        for path in glob.glob(os.path.join(self.directory, ticker, '*.*')):
+            stem, extension = os.path.splitext(os.path.basename(path))
+            if extension[1:] in EXTENSIONS:
+                files[pd.Timestamp(f"{stem}-01")] = path
+        return dict(sorted(files.items()))
+
+    def write_month(self, ticker, month, df):
+        # Merges with what is already archived for the month, so a rerun after a crash is harmless
+        month = month_start(month)
+        existing = [self.read_file(self._path(ticker, month, ext), ticker) for ext in EXTENSIONS
+                    if os.path.exists(self._path(ticker, month, ext))]
+        frame = pd.concat(existing + [df[COLUMNS]], ignore_index=True) if existing else df[COLUMNS].copy()
+        frame['Date'] = pd.to_datetime(frame['Date'])
+        frame = frame.drop_duplicates('Date', keep='last').sort_values('Date').reset_index(drop=True)
+
+        path = self._path(ticker, month, self.file_format)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp.{self.file_format}"
+        if self.file_format == 'parquet':
+            frame[['Date'] + VALUE_COLUMNS].to_parquet(tmp_path, compression='zstd', index=False)
+        else:
+            np.savez_compressed(tmp_path, date=frame['Date'].to_numpy(dtype='datetime64[ns]').view('int64'),
+                                **{col.lower(): frame[col].to_numpy(dtype='float64') for col in VALUE_COLUMNS})
+        os.replace(tmp_path, path)
+        for ext in EXTENSIONS:
+            if ext != self.file_format and os.path.exists(self._path(ticker, month, ext)):
+                os.remove(self._path(ticker, month, ext))
+        return len(frame)
+
+    @staticmethod
+    def read_file(path, ticker):
+        if path.endswith('.parquet'):
+            frame = pd.read_parquet(path)
+        else:
+            with np.load(path) as data:
+                frame = pd.DataFrame({'Date': data['date'].view('datetime64[ns]'),
+                                      **{col: data[col.lower()] for col in VALUE_COLUMNS}})
+        frame['Ticker'] = ticker
+        return frame[COLUMNS]
+
+    def covers(self, start_date=None, newer_than=None):
+        # False when the requested range starts at or after the cutoff, the common live-strategy case
+        if self.cutoff is None:
+            return False
+        lower = newer_than if newer_than is not None else start_date
+        return lower is None or pd.Timestamp(lower) < self.cutoff
+
+    def read(self, ticker=None, start_date=None, end_date=None, newer_than=None):
+        """
+        Archived bars in the same shape as Database.fetch_data_from_db, with the same inclusive
+        start/end and exclusive newer_than semantics.
+        """
+        if not self.covers(start_date, newer_than):
+            return pd.DataFrame(columns=COLUMNS)
+        lower = pd.Timestamp(start_date) if start_date is not None else None
+        if newer_than is not None:
+            lower = pd.Timestamp(newer_than)
+        upper = pd.Timestamp(end_date) if end_date is not None else None
+
+        frames = []
+        for archived_ticker in ([ticker] if ticker else self.tickers()):
+            for month, path in self.month_files(archived_ticker).items():
+                if lower is not None and month_start(lower) > month:
+                    continue
+                if upper is not None and month > upper:
+                    continue
+                frame = self.read_file(path, archived_ticker)
+                mask = frame['Date'] < self.cutoff
+                if lower is not None:
+                    mask &= frame['Date'] > lower if newer_than is not None else frame['Date'] >= lower
+                if upper is not None:
+                    mask &= frame['Date'] <= upper
+                frames.append(frame[mask])
+        frames = [frame for frame in frames if not frame.empty]
+        if not frames:
+            return pd.DataFrame(columns=COLUMNS)
+        return pd.concat(frames, ignore_index=True)
+
+
+def archive_old_bars(db, days=30, archive=None, chunksize=50000):
+    """
+    Moves whole months older than `days` from minute_data into the archive, together with any
+    rows older than the previous cutoff that were loaded after it moved. Files are written first,
+    then the cutoff is advanced, and each ticker's month is removed from the database only when
+    the rows deleted are exactly the ones archived. Returns the rows moved.
+    """
+    archive = archive or db.archive
+    cutoff = month_start(datetime.now() - timedelta(days=days))
+    if archive.cutoff is not None:
+        cutoff = max(cutoff, archive.cutoff)
+
+    start_date = '1970-01-01 00:00:00'
+    end_date = (cutoff - pd.Timedelta(seconds=1)).strftime('%Y-%m-%d %H:%M:%S')
+    expected = db.count_rows(archive.table_name, start_date, end_date)
+    if not expected:
+        logger.info(f"Nothing to archive, the database holds no bars before {cutoff}")
+        return 0
+
+    archived = {}
+    key, chunks = None, []
+    for ticker, day, chunk in db.iter_data_from_db(archive.table_name, start_date, end_date, chunksize=chunksize):
+        month = month_start(day)
+        if key is not None and key != (ticker, month):
+            archive.write_month(key[0], key[1], pd.concat(chunks, ignore_index=True))
+            chunks = []
+        key = (ticker, month)
+        chunks.append(chunk)
+        archived[key] = archived.get(key, 0) + len(chunk)
+    if chunks:
+        archive.write_month(key[0], key[1], pd.concat(chunks, ignore_index=True))
+
+    total = sum(archived.values())
+    if total != expected:
+        logger.error(f"Archived {total} bars but the database holds {expected} before {cutoff}, "
+                     f"keeping them in the database")
+        print(f"Archived {total} bars but the database holds {expected} before {cutoff}, "
+              f"keeping them in the database")
+        return 0
+
+    if archive.cutoff != cutoff:
+        archive.set_cutoff(cutoff)
+    deleted = 0
+    for (ticker, month), count in archived.items():
+        deleted += db.delete_archived_range(archive.table_name, ticker, f"{month:%Y-%m-%d %H:%M:%S}",
+                                            f"{month_start(month + pd.DateOffset(months=1)):%Y-%m-%d %H:%M:%S}",
+                                            count)
+    db.drop_archived_partitions(archive.table_name, cutoff.to_pydatetime())
+    logger.info(f"Archived {total} bars before {cutoff} to {archive.directory}, removed {deleted} from the database")
+    print(f"Archived {total} bars before {cutoff} to {archive.directory}, removed {deleted} from the database")
+    return total
+
+
+if __name__ == "__main__":
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Move minute bars older than N days into the file archive")
+    parser.add_argument('--days', type=int, default=30)
+    args = parser.parse_args()
+
+    database = Database()
+    try:
+        archive_old_bars(database, days=args.days)
+    finally:
+        database.db_close_connection()
@@ -0,0 +1,336 @@
+import math
+import threading
+from collections import deque
+from datetime import time
+from time import monotonic
+import pandas as pd
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.FileHandler("ib_api.log")]
+)
+logger.handlers = [h for h in logger.handlers if not isinstance(h, logging.StreamHandler)]
+
+# IB historical data pacing: 60 requests per 10 minutes, no identical request within 15 seconds,
+# at most 6 requests for the same contract within 2 seconds
+REQUESTS_PER_WINDOW = 60
+WINDOW_SECONDS = 600
+IDENTICAL_COOLDOWN = 15
+CONTRACT_BURST = 6
+CONTRACT_BURST_SECONDS = 2
+PACING_ERROR = 162
+NO_DATA_MESSAGE = 'HMDS query returned no data'
+
+# useRTH=0 bars cover the extended session, holes are only looked for in regular hours, where
+# every listed ticker trades each minute; before and after that missing minutes are normal
+EXTENDED_HOURS = (time(4, 0), time(20, 0))
+REGULAR_HOURS = (time(9, 30), time(16, 0))
+MAX_SECONDS_DURATION = 86400
+MINUTE = pd.Timedelta(minutes=1)
+
+
+def session_minutes(start, end, hours=EXTENDED_HOURS):
+    # Weekday minute starts in [start, end] within hours, exchange time; holidays are not known here
+    minutes = pd.date_range(pd.Timestamp(start).ceil('1min'), pd.Timestamp(end).floor('1min'), freq='1min')
+    clock = minutes.hour * 60 + minutes.minute
+    opens, closes = (hours[0].hour * 60 + hours[0].minute, hours[1].hour * 60 + hours[1].minute)
+    return minutes[(minutes.dayofweek < 5) & (clock >= opens) & (clock < closes)]
+
+
+def missing_ranges(stored, expected, min_minutes=1, merge_minutes=0):
+    """
+    Runs of `expected` minutes absent from `stored`, as [(first, last)], keeping runs of at least
+    min_minutes and joining runs less than merge_minutes apart into one.
+    """
+    missing = expected.difference(stored)
+    if missing.empty:
+        return []
+    breaks = (missing[1:] - missing[:-1]) > MINUTE
+    starts = [missing[0]] + list(missing[1:][breaks])
+    ends = list(missing[:-1][breaks]) + [missing[-1]]
+    ranges = []
+    for first, last in zip(starts, ends):
+        if ranges and (first - ranges[-1][1]) <= pd.Timedelta(minutes=merge_minutes):
+            ranges[-1] = (ranges[-1][0], last)
+        else:
+            ranges.append((first, last))
+    return [(first, last) for first, last in ranges if (last - first) // MINUTE + 1 >= min_minutes]
+
+
+def duration_for(start, end):
+    # Smallest IB duration string covering [start, end), seconds up to a day and whole days above
+    seconds = math.ceil((end - start).total_seconds())
+    if seconds <= MAX_SECONDS_DURATION:
+        return f"{max(seconds, 60)} S"
+    return f"{math.ceil(seconds / MAX_SECONDS_DURATION)} D"
+
+
+def plan_backfills(db, tickers, now=None, lookback_days=5, min_hole_minutes=3, merge_minutes=30):
+    """
+    The (endDateTime, durationStr) requests that fill what minute_data lacks for each ticker over the
+    last lookback_days, as {ticker: requests}: the tail after its last bar, ending now (endDateTime ''),
+    plus one request per hole in regular hours. A ticker with no bars in the window gets a single
+    lookback_days request. Last bars come from the database's cache (one GROUP BY for the tickers not
+    cached yet) and regular-hours bar counts per ticker and day from one query; only the days short of
+    at least min_hole_minutes bars have their bar dates read to find the holes.
+    """
+    now = pd.Timestamp(now) if now is not None else pd.Timestamp.now(tz='America/New_York').tz_localize(None)
+    window_start = now - pd.Timedelta(days=lookback_days)
+    last_dates = db.get_last_dates_for_symbols(tickers)
+    counts = db.count_bars_per_day('minute_data', tickers, window_start.strftime('%Y-%m-%d %H:%M:%S'),
+                                   now.strftime('%Y-%m-%d %H:%M:%S'), REGULAR_HOURS)
+    if counts is None:
+        counts = {}
+
+    plans = {}
+    for ticker in tickers:
+        last_date = last_dates.get(ticker)
+        last_date = pd.Timestamp(last_date) if last_date is not None else None
+        if last_date is None or last_date < window_start:
+            plans[ticker] = [("", f"{lookback_days} D")]
+            continue
+
+        requests = []
+        tail_start = last_date + MINUTE
+        if not session_minutes(tail_start, now).empty:
+            requests.append(("", duration_for(tail_start, now + MINUTE)))
+
+        holes = []
+        expected = session_minutes(window_start, last_date, REGULAR_HOURS)
+        for day, day_minutes in expected.groupby(expected.normalize()).items():
+            if len(day_minutes) - counts.get((ticker, day), 0) < min_hole_minutes:
+                continue
+            stored = db.fetch_bar_dates('minute_data', ticker, day_minutes[0].strftime('%Y-%m-%d %H:%M:%S'),
+                                        day_minutes[-1].strftime('%Y-%m-%d %H:%M:%S'))
+            if stored is not None:
+                holes += missing_ranges(stored, pd.DatetimeIndex(day_minutes), min_hole_minutes, merge_minutes)
+        for first, last in reversed(holes):
+            end = last + MINUTE
+            requests.append((f"{end:%Y%m%d %H:%M:%S} US/Eastern", duration_for(first, end)))
+        logger.info(f"Backfill plan for {ticker}: {len(requests)} requests, {len(holes)} holes, last bar {last_date}")
+        plans[ticker] = requests
+    return plans
+
+
+def plan_backfill(db, ticker, now=None, lookback_days=5, min_hole_minutes=3, merge_minutes=30):
+    return plan_backfills(db, [ticker], now, lookback_days, min_hole_minutes, merge_minutes)[ticker]
+
+
+class BackfillScheduler:
+    """
+    Keeps up to max_in_flight historical data requests outstanding at once, tracking each one by
+    reqId. A request is only sent while fewer than 60 were sent in the last 10 minutes, and held
+    back while an identical request is cooling down or their contract already had a burst of
+    requests. IBApi reports completion (bars stored) and errors back by reqId.
+    """
+
+    def __init__(self, app, max_in_flight=6, requests_per_window=REQUESTS_PER_WINDOW, window_seconds=WINDOW_SECONDS,
+                 identical_cooldown=IDENTICAL_COOLDOWN, request_timeout=300, pacing_backoff=60, max_attempts=3,
+                 progress_interval=10):
+        self.app = app
+        self.max_in_flight = max_in_flight
+        self.requests_per_window = requests_per_window
+        self.window_seconds = window_seconds
+        # Send times within the last window_seconds, oldest first
+        self.window = deque()
+        self.paused_until = 0.0
+        self.identical_cooldown = identical_cooldown
+        self.request_timeout = request_timeout
+        self.pacing_backoff = pacing_backoff
+        self.max_attempts = max_attempts
+        self.progress_interval = progress_interval
+        self.condition = threading.Condition()
+        self.pending = deque()
+        self.in_flight = {}
+        self.last_sent = {}
+        self.contract_sends = {}
+        self.completed = []
+        self.failed = {}
+        self.submitted = 0
+        self.sent = 0
+        self.changes = 0
+        self.started = None
+
+    def submit(self, reqId, params):
+        # params are the keyword arguments of EClient.reqHistoricalData, reqId and contract included
+        with self.condition:
+            self.pending.append({'reqId': reqId, 'params': params, 'attempts': 0, 'not_before': 0.0})
+            self.submitted += 1
+            self._changed()
+
+    def _changed(self):
+        # Caller holds the condition; run() only sleeps when nothing changed since it last looked
+        self.changes += 1
+        self.condition.notify_all()
+
+    @staticmethod
+    def _identity(params):
+        return (params['contract'].symbol, params['contract'].secType, params['endDateTime'], params['durationStr'],
+                params['barSizeSetting'], params['whatToShow'], params['useRTH'])
+
+    def _window_open_at(self, now):
+        # Earliest time another request fits in the window, now if it already does
+        while self.window and self.window[0] <= now - self.window_seconds:
+            self.window.popleft()
+        ready = self.paused_until
+        if len(self.window) >= self.requests_per_window:
+            ready = max(ready, self.window[-self.requests_per_window] + self.window_seconds)
+        return ready
+
+    def _ready_at(self, job, now):
+        # Earliest time the job may be sent as far as its own pacing rules go
+        params = job['params']
+        ready = job['not_before']
+        last = self.last_sent.get(self._identity(params))
+        if last is not None:
+            ready = max(ready, last + self.identical_cooldown)
+        sends = self.contract_sends.get(params['contract'].symbol)
+        if sends:
+            while sends and sends[0] <= now - CONTRACT_BURST_SECONDS:
+                sends.popleft()
+            if len(sends) >= CONTRACT_BURST:
+                ready = max(ready, sends[0] + CONTRACT_BURST_SECONDS)
+        return ready
+
+    def _next_jobs(self, now):
+        # Picks the jobs to send now and reserves their slot in flight and in the window, returns them and the
+        # next wake-up
+        ready_jobs = []
+        wake = now + self.progress_interval
+        for job in list(self.pending):
+            if len(self.in_flight) >= self.max_in_flight:
+                break
+            window_open = self._window_open_at(now)
+            if window_open > now:
+                wake = min(wake, window_open)
+                break
+            ready = self._ready_at(job, now)
+            if ready > now:
+                wake = min(wake, ready)
+                continue
+            self.pending.remove(job)
+            self.window.append(now)
+            job['attempts'] += 1
+            job['sent_at'] = now
+            self.in_flight[job['reqId']] = job
+            self.last_sent[self._identity(job['params'])] = now
+            self.contract_sends.setdefault(job['params']['contract'].symbol, deque()).append(now)
+            ready_jobs.append(job)
+        for job in self.in_flight.values():
+            wake = min(wake, job['sent_at'] + self.request_timeout)
+        return ready_jobs, wake
+
+    def _send(self, job):
+        params = job['params']
+        self.sent += 1
+        logger.info(f"Backfill request {job['reqId']} for {params['contract'].symbol}: {params['durationStr']} "
+                    f"ending {params['endDateTime'] or 'now'} (attempt {job['attempts']})")
+        try:
+            self.app.reqHistoricalData(**params)
+        except Exception as e:
+            self.fail(job['reqId'], f"request failed: {e}")
+
+    def complete(self, reqId):
+        with self.condition:
+            job = self.in_flight.pop(reqId, None)
+            if job is None:
+                return False
+            self.completed.append(reqId)
+            self._changed()
+        return True
+
+    def fail(self, reqId, reason, retry_after=None):
+        with self.condition:
+            job = self.in_flight.pop(reqId, None)
+            if job is None:
+                return False
+            if retry_after is not None and job['attempts'] < self.max_attempts:
+                job['not_before'] = monotonic() + retry_after
+                self.pending.appendleft(job)
+                logger.warning(f"Backfill request {reqId} will be retried in {retry_after}s: {reason}")
+            else:
+                self.failed[reqId] = reason
+                logger.error(f"Backfill request {reqId} failed: {reason}")
+                print(f"Backfill request {reqId} failed: {reason}")
+            self._changed()
+        return True
+
+    def on_error(self, reqId, errorCode, errorString):
+        # Called from IBApi.error, only errors of requests still in flight are ours
+        if reqId not in self.in_flight:
+            return False
+        if errorCode == PACING_ERROR and NO_DATA_MESSAGE in errorString:
+            return self.complete(reqId)
+        if errorCode == PACING_ERROR and 'pacing' in errorString.lower():
+            # IB has seen more requests than this scheduler knows of, nothing is sent until the backoff is over
+            with self.condition:
+                self.paused_until = monotonic() + self.pacing_backoff
+            return self.fail(reqId, errorString, retry_after=self.pacing_backoff)
+        return self.fail(reqId, f"{errorCode} {errorString}")
+
+    def _expire(self, now):
+        expired = [reqId for reqId, job in self.in_flight.items() if now - job['sent_at'] >= self.request_timeout]
+        for reqId in expired:
+            self.app.cancelHistoricalData(reqId)
+        return expired
+
+    def progress(self):
+        with self.condition:
+            elapsed = monotonic() - self.started if self.started else 0.0
+            self._window_open_at(monotonic())
+            done = len(self.completed)
+            return {
+                'submitted': self.submitted,
+                'completed': done,
+                'failed': len(self.failed),
+                'in_flight': len(self.in_flight),
+                'pending': len(self.pending),
+                'sent': self.sent,
+                'window_sent': len(self.window),
+                'elapsed_s': round(elapsed, 1),
+                'per_minute': round(done / elapsed * 60, 1) if elapsed else 0.0,
+            }
+
+    def report(self):
+        progress = self.progress()
+        logger.info(f"Backfill progress: {progress}")
+        print(f"Backfill: {progress['completed']}/{progress['submitted']} done, {progress['in_flight']} in flight, "
+              f"{progress['pending']} waiting, {progress['failed']} failed ({progress['elapsed_s']}s)")
+        return progress
+
+    def run(self, timeout=None):
+        """
+        Sends the submitted requests as pacing allows and blocks until each one has completed or
+        failed, or timeout seconds passed. Returns the final progress.
+        """
+        self.started = self.started or monotonic()
+        deadline = self.started + timeout if timeout else None
+        next_report = monotonic() + self.progress_interval
+        while True:
+            with self.condition:
+                if not self.pending and not self.in_flight:
+                    break
+                now = monotonic()
+                if deadline and now >= deadline:
+                    logger.warning(f"Backfill timed out with {len(self.pending) + len(self.in_flight)} requests open")
+                    break
+                ready_jobs, wake = self._next_jobs(now)
+                expired = self._expire(now)
+                seen = self.changes
+            for job in ready_jobs:
+                self._send(job)
+            for reqId in expired:
+                self.fail(reqId, f"no answer within {self.request_timeout}s", retry_after=0)
+            if monotonic() >= next_report:
+                self.report()
+                next_report = monotonic() + self.progress_interval
+            with self.condition:
+                if ready_jobs or expired or self.changes != seen:
+                    continue
+                wait = min(wake, next_report, deadline or wake) - monotonic()
+                if wait > 0:
+                    self.condition.wait(wait)
+        return self.report()
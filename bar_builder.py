@@ -0,0 +1,155 @@
+import threading
+from time import time_ns
+import pandas as pd
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.FileHandler("ib_api.log")]
+)
+logger.handlers = [h for h in logger.handlers if not isinstance(h, logging.StreamHandler)]
+
+NANOS_PER_SECOND = 1_000_000_000
+
+
+class BarBuilder:
+    """
+    Rolls real-time ticks into 1-minute OHLCV bars per ticker. Volume is the change of IB's
+    cumulative day volume within the bar. A bar is closed, and on_bar called once with it, when
+    the first tick of a later minute arrives or when the clock passes the end of the minute plus
+    `grace` seconds, whichever comes first. Ticks that arrive for a minute already closed count
+    towards the next bar.
+    """
+
+    def __init__(self, on_bar, interval_seconds=60, grace=2.0, timezone='America/New_York', clock=time_ns):
+        self.on_bar = on_bar
+        self.step = interval_seconds * NANOS_PER_SECOND
+        self.grace = int(grace * NANOS_PER_SECOND)
+        self.timezone = timezone
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.bars = {}
+        self.closed_until = {}
+        self.last_close = {}
+        self.cumulative_volume = {}
+        self.bars_emitted = 0
+        self.stop_event = threading.Event()
+        self.clock_thread = None
+
+    def _bar_for(self, ticker, ts, closed):
+        # The ticker's open bar for ts, closing the previous one into `closed` when ts is past it
+        ts = max(ts, self.closed_until.get(ticker, ts))
+        start = ts - ts % self.step
+        bar = self.bars.get(ticker)
+        if bar is not None and bar['start'] != start:
+            closed.append(self._close(ticker))
+            bar = None
+        if bar is None:
+            bar = self.bars[ticker] = {'start': start, 'open': None, 'high': None, 'low': None, 'close': None,
+                                       'volume': 0.0}
+        return bar
+
+    def _close(self, ticker):
+        # A bar with volume but no trade price is flat at the previous close
+        bar = self.bars.pop(ticker)
+        if bar['open'] is None and ticker in self.last_close:
+            bar['open'] = bar['high'] = bar['low'] = bar['close'] = self.last_close[ticker]
+        self.closed_until[ticker] = bar['start'] + self.step
+        return ticker, bar
+
+    def add_price(self, ticker, ts, price):
+        closed = []
+        with self.lock:
+            bar = self._bar_for(ticker, ts, closed)
+            if bar['open'] is None:
+                bar['open'] = bar['high'] = bar['low'] = price
+            else:
+                bar['high'] = max(bar['high'], price)
+                bar['low'] = min(bar['low'], price)
+            bar['close'] = price
+            self.last_close[ticker] = price
+        self._emit(closed)
+
+    def add_volume(self, ticker, ts, cumulative):
+        # The first reading only sets the baseline, a drop means IB started a new day's count
+        closed = []
+        with self.lock:
+            previous = self.cumulative_volume.get(ticker)
+            self.cumulative_volume[ticker] = cumulative
+            if previous is None:
+                return
+            delta = cumulative - previous if cumulative >= previous else cumulative
+            if delta:
+                self._bar_for(ticker, ts, closed)['volume'] += delta
+        self._emit(closed)
+
+    def add_bar(self, ticker, ts, open_, high, low, close, volume, duration_seconds=5):
+        # Folds a sub-minute bar (reqRealTimeBars sends 5-second ones) in, closing the minute with its last bar
+        closed = []
+        with self.lock:
+            bar = self._bar_for(ticker, ts, closed)
+            if bar['open'] is None:
+                bar['open'], bar['high'], bar['low'] = open_, high, low
+            else:
+                bar['high'] = max(bar['high'], high)
+                bar['low'] = min(bar['low'], low)
+            bar['close'] = close
+            bar['volume'] += volume
+            self.last_close[ticker] = close
+            if ts + duration_seconds * NANOS_PER_SECOND >= bar['start'] + self.step:
+                closed.append(self._close(ticker))
+        self._emit(closed)
+
+    def current_bar(self, ticker):
+        with self.lock:
+            bar = self.bars.get(ticker)
+            return dict(bar) if bar else None
+
+    def close_due(self, now=None):
+        # Closes every bar whose minute ended more than `grace` ago, returns how many were emitted
+        now = now or self.clock()
+        with self.lock:
+            closed = [self._close(ticker) for ticker, bar in list(self.bars.items())
+                      if now >= bar['start'] + self.step + self.grace]
+        self._emit(closed)
+        return len(closed)
+
+    def _emit(self, closed):
+        for ticker, bar in closed:
+            if bar['open'] is None:
+                logger.warning(f"Dropping {ticker} bar at {bar['start']} with volume {bar['volume']} but no trade price")
+                continue
+            date = pd.Timestamp(bar['start'], tz='UTC').tz_convert(self.timezone).tz_localize(None)
+            self.bars_emitted += 1
+            self.on_bar({
+                'Date': date,
+                'Open': bar['open'],
+                'High': bar['high'],
+                'Low': bar['low'],
+                'Close': bar['close'],
+                'Volume': float(bar['volume']),
+                'Ticker': ticker,
+            })
+
+    def start_clock(self):
+        # Closes bars of tickers that went quiet, woken just after each minute boundary
+        def run():
+            while True:
+                now = self.clock()
+                wait = (self.step - now % self.step + self.grace) / NANOS_PER_SECOND
+                if self.stop_event.wait(wait):
+                    break
+                try:
+                    self.close_due()
+                except Exception as e:
+                    logger.error(f"Error closing real-time bars: {e}")
+        self.clock_thread = threading.Thread(target=run, name="bar-clock", daemon=True)
+        self.clock_thread.start()
+        return self
+
+    def stop_clock(self):
+        self.stop_event.set()
+        if self.clock_thread:
+            self.clock_thread.join()
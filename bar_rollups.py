@@ -0,0 +1,179 @@
+from bisect import bisect_left, insort
+import pandas as pd
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.FileHandler("ib_api.log")]
+)
+logger.handlers = [h for h in logger.handlers if not isinstance(h, logging.StreamHandler)]
+
+BASE_INTERVAL = '1min'
+DEFAULT_INTERVALS = ['1min', '5min', '15min', '1h', '1D']
+COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+
+class _Rollup:
+    """
+    OHLCV buckets of one ticker at one interval. A row that lands after the last one of its bucket
+    updates the bucket in place; a row that replaces or precedes one already held rebuilds only
+    that bucket from its members.
+    """
+
+    def __init__(self, ticker, interval):
+        self.ticker = ticker
+        self.interval = interval
+        self.step = pd.Timedelta(interval).value
+        self.members = {}
+        self.values = {}
+        self.last_member = {}
+        self.starts = []
+        self.dirty_from = None
+        self.frame = None
+
+    def add(self, ts, row):
+        start = ts - ts % self.step
+        members = self.members.get(start)
+        if members is None:
+            members = self.members[start] = {}
+            if not self.starts or start > self.starts[-1]:
+                self.starts.append(start)
+            else:
+                insort(self.starts, start)
+
+        replaced = ts in members
+        members[ts] = row
+        values = self.values.get(start)
+        if values is None:
+            self.values[start] = list(row)
+            self.last_member[start] = ts
+        elif not replaced and ts > self.last_member[start]:
+            open_, high, low, close, volume = row
+            values[1] = max(values[1], high)
+            values[2] = min(values[2], low)
+            values[3] = close
+            values[4] += volume
+            self.last_member[start] = ts
+        else:
+            self._rebuild(start)
+
+        if self.dirty_from is None or start < self.dirty_from:
+            self.dirty_from = start
+
+    def _rebuild(self, start):
+        rows = [self.members[start][ts] for ts in sorted(self.members[start])]
+        self.values[start] = [rows[0][0], max(r[1] for r in rows), min(r[2] for r in rows), rows[-1][3],
+                              sum(r[4] for r in rows)]
+        self.last_member[start] = max(self.members[start])
+
+    def trim(self, cutoff):
+        cut = bisect_left(self.starts, cutoff - cutoff % self.step)
+        if not cut:
+            return
+        for start in self.starts[:cut]:
+            del self.members[start], self.values[start], self.last_member[start]
+        self.starts = self.starts[cut:]
+        self.frame = None
+        self.dirty_from = None
+
+    def to_frame(self):
+        # Only the buckets from the first one touched since the last call are turned into rows again
+        if self.frame is None:
+            self.frame = self._build(0)
+        elif self.dirty_from is not None:
+            kept = self.frame.iloc[:self.frame.index.searchsorted(pd.Timestamp(self.dirty_from))]
+            tail = self._build(bisect_left(self.starts, self.dirty_from))
+            self.frame = pd.concat([kept, tail]) if not kept.empty else tail
+        self.dirty_from = None
+        return self.frame
+
+    def _build(self, first):
+        starts = self.starts[first:]
+        return pd.DataFrame([self.values[start] for start in starts], columns=COLUMNS,
+                            index=pd.DatetimeIndex(pd.to_datetime(starts), name='Date'), dtype=float)
+
+
+class RollupStore:
+    """
+    Pre-aggregated bars per ticker for a fixed set of intervals, kept up to date as 1-minute bars
+    and real-time rows come in, so the strategy loop reads them instead of resampling every pass.
+    """
+
+    def __init__(self, intervals=None, lookback_days=7):
+        self.intervals = list(intervals or DEFAULT_INTERVALS)
+        if BASE_INTERVAL not in self.intervals:
+            self.intervals.insert(0, BASE_INTERVAL)
+        self.lookback = pd.Timedelta(days=lookback_days)
+        self.rollups = {}
+
+    def _rollups_for(self, ticker):
+        if ticker not in self.rollups:
+            self.rollups[ticker] = {interval: _Rollup(ticker, interval) for interval in self.intervals}
+        return self.rollups[ticker]
+
+    def add_interval(self, interval):
+        # Intervals asked for later are built from the 1-minute rollup, which holds every row seen
+        if interval in self.intervals:
+            return
+        self.intervals.append(interval)
+        for ticker, rollups in self.rollups.items():
+            rollup = rollups[interval] = _Rollup(ticker, interval)
+            for members in rollups[BASE_INTERVAL].members.values():
+                for ts, row in members.items():
+                    rollup.add(ts, row)
+        logger.info(f"Added {interval} rollup")
+
+    def add_bar(self, ticker, date, open_, high, low, close, volume):
+        ts = pd.Timestamp(date)
+        if pd.isna(ts):
+            return
+        if ts.tzinfo is not None:
+            ts = ts.tz_localize(None)
+        row = (float(open_), float(high), float(low), float(close), float(volume))
+        for rollup in self._rollups_for(ticker).values():
+            rollup.add(ts.value, row)
+
+    def add_frame(self, ticker, df):
+        # df is indexed by Date (as BarWindow keeps it) or has a Date column
+        if df is None or df.empty:
+            return 0
+        dates = df.index if 'Date' not in df.columns else df['Date']
+        dates = pd.to_datetime(dates, errors='coerce')
+        for date, open_, high, low, close, volume in zip(dates, df['Open'], df['High'], df['Low'], df['Close'],
+                                                         df['Volume']):
+            if not pd.isna(date):
+                self.add_bar(ticker, date, open_, high, low, close, volume)
+        return len(df)
+
+    def trim(self, ticker, now=None):
+        cutoff = pd.Timestamp(now or pd.Timestamp.now()) - self.lookback
+        for rollup in self._rollups_for(ticker).values():
+            rollup.trim(cutoff.value)
+
+    def reset(self, ticker=None):
+        for rollup_ticker in list(self.rollups):
+            if ticker is None or rollup_ticker == ticker:
+                del self.rollups[rollup_ticker]
+
+    def has_data(self, ticker):
+        return ticker in self.rollups and bool(self.rollups[ticker][BASE_INTERVAL].starts)
+
+    def to_frame(self, ticker, interval):
+        """
+        Same shape as DataProcessor.resample_data: one row per interval between the first and last
+        bucket, empty intervals forward filled with zero volume, Date as a column. Returns a copy the caller
+        may modify.
+        """
+        if interval not in self.intervals:
+            self.add_interval(interval)
+        frame = self._rollups_for(ticker)[interval].to_frame()
+        if frame.empty:
+            return pd.DataFrame(columns=['Date'] + COLUMNS + ['Ticker'])
+        full_range = pd.date_range(frame.index[0], frame.index[-1], freq=pd.Timedelta(interval), name='Date')
+        frame = frame.reindex(full_range)
+        frame['Volume'] = frame['Volume'].fillna(0.0)
+        frame = frame.ffill()
+        frame['Ticker'] = ticker
+        return frame.reset_index()
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+import pandas as pd
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.FileHandler("ib_api.log")]
+)
+logger.handlers = [h for h in logger.handlers if not isinstance(h, logging.StreamHandler)]
+
+
+class BarWindow:
+    """
+    In-memory window of minute bars for one ticker. It is seeded once from the database,
+    after that only bars newer than the last one held are read and old bars are trimmed.
+    """
+
+    def __init__(self, db, ticker, lookback_days=7, table_name='minute_data'):
+        self.db = db
+        self.ticker = ticker
+        self.lookback = timedelta(days=lookback_days)
+        self.table_name = table_name
+        self.frame = pd.DataFrame(columns=['Open', 'High', 'Low', 'Close', 'Volume', 'Ticker'],
+                                  index=pd.DatetimeIndex([], name='Date'))
+        self.last_timestamp = None
+        self.seeded = False
+
+    def reset(self):
+        # Forces a full reseed on the next refresh, e.g. after a backfill filled holes behind last_timestamp
+        self.seeded = False
+        self.last_timestamp = None
+
+    def refresh(self, now=None):
+        now = now or datetime.now()
+        if not self.seeded or self.last_timestamp is None:
+            start_date = now - self.lookback
+            df = self.db.fetch_data_from_db(self.table_name, start_date.strftime('%Y-%m-%d %H:%M:%S'),
+                                            now.strftime('%Y-%m-%d %H:%M:%S'), ticker=self.ticker)
+        else:
+            df = self.db.fetch_data_from_db(self.table_name, ticker=self.ticker,
+                                            newer_than=self.last_timestamp.to_pydatetime())
+        if not df.empty:
+            df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
+            df = df.dropna(subset=['Date']).set_index('Date').sort_index()
+
+        if not self.seeded:
+            self.frame = df if not df.empty else self.frame
+            new_rows = self.frame
+            self.seeded = True
+            logger.info(f"Bar window for {self.ticker} seeded with {len(self.frame)} bars")
+        else:
+            new_rows = df[df.index > self.last_timestamp] if not df.empty else df
+            if not new_rows.empty:
+                self.frame = pd.concat([self.frame, new_rows]) if not self.frame.empty else new_rows
+            logger.debug(f"Bar window for {self.ticker} appended {len(new_rows)} new bars")
+
+        if not self.frame.empty:
+            self.last_timestamp = self.frame.index[-1]
+            cutoff = self.frame.index.searchsorted(pd.Timestamp(now - self.lookback))
+            if cutoff:
+                self.frame = self.frame.iloc[cutoff:]
+        return new_rows
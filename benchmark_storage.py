@@ -0,0 +1,71 @@
+import argparse
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from database import Database
+from storage_backends import get_backend
+from write_behind import WriteBehindQueue
+
+
+def synthetic_bars(tickers, bars_per_ticker, start=datetime(2024, 8, 26, 4, 0)):
+    for ticker in tickers:
+        price = 100.0
+        for i in range(bars_per_ticker):
+            price += ((i * 7919) % 13 - 6) * 0.01
+            yield {
+                'ticker': ticker,
+                'date_time': start + timedelta(minutes=i),
+                'open': price,
+                'high': price + 0.05,
+                'low': price - 0.05,
+                'close': price + 0.01,
+                'volume': 100 + i % 50,
+            }
+
+
+def run_benchmark(backend_name, path=None, tickers=10, bars=5000, batch_size=500, write_mode='upsert',
+                  use_queue=False):
+    backend = get_backend(backend_name, path=path) if backend_name == 'sqlite' else get_backend(backend_name)
+    db = Database(write_mode=write_mode, backend=backend)
+    db.create_schema()
+    if write_mode == 'upsert':
+        db.ensure_unique_keys()
+
+    symbols = [f"BM{i:03d}" for i in range(tickers)]
+    rows = list(synthetic_bars(symbols, bars))
+
+    start = perf_counter()
+    if use_queue:
+        write_queue = WriteBehindQueue(db, batch_size=batch_size, put_timeout=None).start()
+        for i in range(0, len(rows), batch_size):
+            write_queue.submit_many('minute_data', rows[i:i + batch_size])
+        write_queue.flush()
+        write_queue.close()
+    else:
+        for i in range(0, len(rows), batch_size):
+            db.insert_bars('minute_data', rows[i:i + batch_size])
+    write_elapsed = perf_counter() - start
+
+    start = perf_counter()
+    for symbol in symbols:
+        db.fetch_data_from_db('minute_data', '2024-08-26 00:00:00', '2024-09-30 00:00:00', ticker=symbol)
+    read_elapsed = perf_counter() - start
+
+    db.db_close_connection()
+    print(f"{backend_name} ({write_mode}, {'queue' if use_queue else 'direct'}): "
+          f"wrote {len(rows)} rows in {write_elapsed:.2f}s ({len(rows) / write_elapsed:.0f} rows/s), "
+          f"read {len(symbols)} tickers in {read_elapsed:.2f}s ({read_elapsed / len(symbols) * 1000:.1f} ms/ticker)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare minute_data write/read throughput between storage backends")
+    parser.add_argument('--backend', default='sqlite', choices=['sqlite', 'mysql'])
+    parser.add_argument('--path', default='benchmark.sqlite', help="SQLite file (sqlite backend only)")
+    parser.add_argument('--tickers', type=int, default=10)
+    parser.add_argument('--bars', type=int, default=5000, help="Bars per ticker")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--write-mode', default='upsert', choices=['check', 'upsert'])
+    parser.add_argument('--queue', action='store_true', help="Write through the write-behind queue")
+    args = parser.parse_args()
+
+    run_benchmark(args.backend, args.path, args.tickers, args.bars, args.batch_size, args.write_mode, args.queue)
@@ -2,6 +2,8 @@ import queue
 from datetime import datetime, timedelta
 import pandas as pd
 
+from bar_rollups import RollupStore
+from bar_window import BarWindow
 from order_manager import OrderManager
 import logging
 
@@ -37,7 +39,6 @@ class DataProcessor:
     def __init__(self, db, api_helper):
         self.db = db
         self.api_helper = api_helper
-        self.real_time_data = pd.DataFrame(columns=['Date', 'Open', 'High', 'Low', 'Close', 'Volume', 'Ticker'])
         self.interval = None
         self.data_ready_queue = queue.Queue()
         self.data_in_long_position = False
@@ -45,11 +46,18 @@ class DataProcessor:
         self.place_orders_outside_rth = False
         self.order_manager = OrderManager(api_helper)
         self.export_buffer = {}
+        self.lookback_days = 7
+        self.bar_windows = {}
+        self.rollups = RollupStore(lookback_days=self.lookback_days)
+        # Naive now for the bar windows and rollup trimming, FakeGateway swaps in its simulated clock
+        self.clock = datetime.now
         # self.cached_df = None
 
         # self.excel_lock = threading.Lock()
 
     def process_queue_data(self):
+        # Closed bars go straight into the rollups, returns how many were added
+        added = 0
         while not self.data_ready_queue.empty():
             data = self.data_ready_queue.get()
             # logger.info(f"Data fetched from queue: {data}")
@@ -69,14 +77,26 @@ class DataProcessor:
                     logger.warning(f"Missing columns in data for {ticker}: {missing_columns}")
                     continue
 
-                new_row = pd.DataFrame([data], columns=required_columns)
-                self.real_time_data = pd.concat([self.real_time_data, new_row], ignore_index=True)
-                # logger.debug(f"Updated DataFrame with new data: {self.real_time_data.tail()}")
-        return self.real_time_data
+                self.rollups.add_bar(ticker, data['Date'], data['Open'], data['High'], data['Low'], data['Close'],
+                                     data['Volume'])
+                added += 1
+        return added
 
     def fetch_data_from_db(self, table_name, start_date=None, end_date=None, ticker=None):
         return self.db.fetch_data_from_db(table_name, start_date, end_date, ticker)
 
+    def get_bar_window(self, ticker, days=None):
+        if ticker not in self.bar_windows:
+            self.bar_windows[ticker] = BarWindow(self.db, ticker, lookback_days=days or self.lookback_days)
+        return self.bar_windows[ticker]
+
+    def reset_bar_windows(self, ticker=None):
+        # The windows only look forward from their last bar, reseed them when older rows were written
+        for window_ticker, window in self.bar_windows.items():
+            if ticker is None or window_ticker == ticker:
+                window.reset()
+        self.rollups.reset(ticker)
+
     @staticmethod
     def calculate_indicators(df):
         if len(df) < 200:
@@ -287,7 +307,9 @@ class DataProcessor:
         return df
 
     def validate_interval(self, user_input):
-        valid_intervals = ['1min', '2min', '3min', '4min', '5min', '10min', '15min', '30min', '1H']
+        valid_intervals = ['1min', '2min', '3min', '4min', '5min', '10min', '15min', '30min', '1h']
+        if user_input == '1H':  # pandas no longer accepts the upper case hour alias
+            user_input = '1h'
         if user_input in valid_intervals:
             return user_input
         elif not user_input:  # if user_input is empty or None
@@ -336,16 +358,19 @@ class DataProcessor:
         #     combined_data = combined_data.iloc[-250:]
         #
         # self.cached_df = combined_data  # Ενημέρωση cache
-        real_time_data = self.process_queue_data()
+        ticker = contract.symbol
+        # Closed real-time bars are added to the rollups as they are taken off the queue
+        self.process_queue_data()
         # logger.debug(f"Real-time Data List: {self.real_time_data}")
         # print("Real-time Data List:")
         # print(self.real_time_data)
 
-        end_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
-
-        df_minute = self.fetch_data_from_db('minute_data', start_date, end_date, ticker=contract.symbol)
-        df_minute.set_index('Date', inplace=True)
+        bar_window = self.get_bar_window(ticker, days)
+        now = self.clock()
+        new_bars = bar_window.refresh(now)
+        self.rollups.add_frame(ticker, new_bars)
+        self.rollups.trim(ticker, now)
+        df_minute = bar_window.frame
         #
         # logger.info("Minute data from DB:")
         # logger.info(df_minute.tail())
@@ -356,68 +381,12 @@ class DataProcessor:
         # print("Minute data DataFrame with datetime check:")
         # print(df_minute.dtypes)
 
-        ticker = contract.symbol
-        real_time_df = pd.DataFrame(real_time_data,
-                                    columns=['Date', 'Open', 'High', 'Low', 'Close', 'Volume', 'Ticker'])
-        real_time_df['Date'] = pd.to_datetime(real_time_df['Date'], errors='coerce')
-
-        # logger.debug(f"Real-time DataFrame for {ticker}:")
-        # logger.debug(real_time_df)
-
-        # print("Real time df: ")
-        # print(real_time_df)
-
-        # print("Real-time DataFrame with datetime check:")
-        # print(real_time_df.dtypes)
-
-        # print("Real-time DataFrame")
-        # print(real_time_df)
-
-        if 'Date' in real_time_df.columns:
-            real_time_df['Date'] = pd.to_datetime(real_time_df['Date'], errors='coerce')
-            real_time_df.set_index('Date', inplace=True)
-            logger.debug(f"Valid real-time data found, DataFrame created for {ticker}")
-            # print("Valid real-time data found, DataFrame created:")
-            # print(real_time_df)
-        else:
-            logger.error(f"Column 'Date' is missing for {ticker}, cannot set as index")
-            logger.error(real_time_df.columns)
-            # print("Column 'Date' is missing, cannot set as index")
-            # print(real_time_df.columns)
-
         logger.info(f"Processing real-time data for ticker: {ticker}")
-        # print("Valid real-time data found, DataFrame created:")
-        # print(real_time_df)
-
-        # Εκτύπωση των real-time δεδομένων για έλεγχο
-        # print("Real-time DataFrame before combining:")
-        # print(real_time_df.tail())
-
-        # filtered with ticker
-        # print("Filtered with ticker")
-        real_time_df_filtered = real_time_df[real_time_df['Ticker'] == ticker]
-        logger.debug(f"Filtered real-time data for {ticker}:")
-        logger.debug(real_time_df_filtered.tail())
-        # print(real_time_df_filtered.tail())
-
-        dataframes_to_concat = [df for df in [df_minute, real_time_df_filtered] if not df.empty]
-        combined_data = pd.concat(dataframes_to_concat)
-        # print('Combined Data right after combination')
-        # print(combined_data.tail())
-
-        if not combined_data.empty:
-            if 'Date' in combined_data.columns:
-                combined_data['Date'] = pd.to_datetime(combined_data['Date'], errors='coerce')
-                combined_data.set_index('Date', inplace=True)
-                combined_data.sort_values(by='Date', inplace=True)
-                logger.info(f"Combined Data for {ticker}:")
-                # logger.info(combined_data.tail())
-                # print('Combined Data')
-                # print(combined_data.tail())
-
-            # Resample and process for entry signals
-            print("Df_entry resampling")
-            df_entry = self.resample_data(combined_data, interval_entry)
+
+        if self.rollups.has_data(ticker):
+            # Entry and exit bars are read pre-aggregated instead of resampling the combined data
+            print("Df_entry rollup")
+            df_entry = self.rollups.to_frame(ticker, interval_entry)
             print(df_entry.tail())
 
             # print("Df_entry indicators")
@@ -432,9 +401,8 @@ class DataProcessor:
             logger_5min.info("5-minute Entry Signals")
             logger_5min.info("\n" + df_entry.tail(20).to_string())
 
-            # Resample and process for exit signals
-            print("Df_exit resampling")
-            df_exit = self.resample_data(combined_data, interval_exit)
+            print("Df_exit rollup")
+            df_exit = self.rollups.to_frame(ticker, interval_exit)
             print(df_exit.tail())
 
             # print("Df_exit indicators")
@@ -0,0 +1,185 @@
+from bisect import bisect_left
+import functools
+import math
+import re
+import threading
+from time import perf_counter
+from sqlalchemy import event
+import pandas as pd
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.FileHandler("ib_api.log")]
+)
+logger.handlers = [h for h in logger.handlers if not isinstance(h, logging.StreamHandler)]
+
+# Bucket upper bounds grow by 25% from 10us to ~100s, so percentiles are within 25% of the true value
+BUCKET_BOUNDS = [1e-5 * 1.25 ** i for i in range(int(math.log(1e7) / math.log(1.25)) + 2)]
+
+_operation = threading.local()
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, seconds, rows=None, error=False):
+        self.counts[bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.errors += int(error)
+        self.rows += rows or 0
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def percentile(self, q):
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                bound = BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else self.max_seconds
+                return min(bound, self.max_seconds)
+        return self.max_seconds
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'rows': self.rows,
+            'mean_ms': round(self.total_seconds / self.count * 1000, 3) if self.count else 0.0,
+            'p50_ms': round(self.percentile(0.5) * 1000, 3),
+            'p99_ms': round(self.percentile(0.99) * 1000, 3),
+            'max_ms': round(self.max_seconds * 1000, 3),
+            'total_s': round(self.total_seconds, 3),
+        }
+
+
+class QueryMetrics:
+    """
+    In-process latency histograms keyed by code path: 'db.<method>' for Database methods and
+    '<method>: <VERB> <table>' for each SQL statement (or COMMIT) issued while that method runs.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def record(self, name, seconds, rows=None, error=False):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.record(seconds, rows, error)
+
+    def snapshot(self):
+        with self.lock:
+            return {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+
+    def dump(self, title="Database query metrics"):
+        snapshot = self.snapshot()
+        if not snapshot:
+            return snapshot
+        table = pd.DataFrame.from_dict(snapshot, orient='index').sort_values('total_s', ascending=False)
+        logger.info(f"{title}:\n{table.to_string()}")
+        print(f"{title}:\n{table.to_string()}")
+        return snapshot
+
+
+def current_operation():
+    return getattr(_operation, 'name', None) or 'other'
+
+
+def _result_rows(result):
+    if isinstance(result, bool) or result is None:
+        return None
+    if isinstance(result, int):
+        return result
+    if isinstance(result, (pd.DataFrame, dict, list, set)):
+        return len(result)
+    return None
+
+
+def timed(method):
+    """
+    Records the duration, rows returned (DataFrame/list/dict length or an int row count) and
+    exceptions of a Database method in self.metrics, and tags the SQL it issues with its name.
+    """
+    name = method.__name__.lstrip('_')
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        outer = getattr(_operation, 'name', None)
+        if outer is None:
+            _operation.name = name
+        start = perf_counter()
+        error = False
+        result = None
+        try:
+            result = method(self, *args, **kwargs)
+            return result
+        except Exception:
+            error = True
+            raise
+        finally:
+            if outer is None:
+                _operation.name = None
+            self.metrics.record(f"db.{name}", perf_counter() - start, _result_rows(result), error)
+    return wrapper
+
+
+@functools.lru_cache(maxsize=1024)
+def classify(statement):
+    words = statement.split(None, 1)
+    verb = words[0].upper() if words else '?'
+    match = re.search(r'\b(?:FROM|INTO|UPDATE|TABLE)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?`?(\w+)', statement, re.IGNORECASE)
+    return f"{verb} {match.group(1)}" if match else verb
+
+
+def instrument_engine(engine, metrics):
+    # Times every cursor execution and every COMMIT on the engine, whoever issues them
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = perf_counter() - conn.info['query_start'].pop()
+        rows = cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else None
+        metrics.record(f"{current_operation()}: {classify(statement)}", elapsed, rows)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        starts = context.connection.info.get('query_start') if context.connection is not None else None
+        elapsed = perf_counter() - starts.pop() if starts else 0.0
+        statement = classify(context.statement) if context.statement else 'CONNECT'
+        metrics.record(f"{current_operation()}: {statement}", elapsed, error=True)
+
+    do_commit = engine.dialect.do_commit
+
+    def timed_commit(dbapi_connection):
+        start = perf_counter()
+        error = False
+        try:
+            do_commit(dbapi_connection)
+        except Exception:
+            error = True
+            raise
+        finally:
+            metrics.record(f"{current_operation()}: COMMIT", perf_counter() - start, error=error)
+
+    engine.dialect.do_commit = timed_commit
+    return engine
@@ -0,0 +1,602 @@
+import queue
+import threading
+from time import monotonic_ns, sleep
+import numpy as np
+import pandas as pd
+from ibapi.common import BarData, TickAttrib
+from ibapi.execution import Execution
+from ibapi.order_state import OrderState
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.FileHandler("ib_api.log")]
+)
+logger.handlers = [h for h in logger.handlers if not isinstance(h, logging.StreamHandler)]
+
+DURATION_UNITS = {'S': 'seconds', 'D': 'days', 'W': 'weeks', 'M': 'days', 'Y': 'days'}
+DURATION_DAYS = {'M': 30, 'Y': 365}
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close']
+TICK_COLUMNS = ['ts_ns', 'ticker', 'tickType', 'price', 'size']
+PRICE_TICK_TYPES = {1, 2, 4, 6, 7, 9, 14}
+LAST_PRICE = 4
+REQUEST_METHODS = ('connect', 'disconnect', 'isConnected', 'run', 'reqIds', 'reqPositions', 'reqHistoricalData',
+                   'cancelHistoricalData', 'reqRealTimeBars', 'cancelRealTimeBars', 'reqMktData', 'cancelMktData',
+                   'placeOrder', 'cancelOrder', 'reqOpenOrders')
+WORKING = ('PreSubmitted', 'Submitted')
+MINUTE_NS = 60_000_000_000
+NANOS_PER_MILLISECOND = 1_000_000
+
+
+def parse_duration(duration_str):
+    value, unit = duration_str.split()
+    value = int(value) * DURATION_DAYS.get(unit, 1)
+    return pd.Timedelta(**{DURATION_UNITS[unit]: value})
+
+
+def synthetic_minute_bars(ticker, start, end):
+    # Deterministic random walk per ticker, one bar per minute in [start, end)
+    dates = pd.date_range(start, end, freq='1min', inclusive='left', name='Date')
+    rng = np.random.default_rng(sum(map(ord, ticker)))
+    close = 100.0 + np.cumsum(rng.normal(0, 0.05, len(dates)))
+    open_ = np.r_[close[:1], close[:-1]]
+    spread = np.abs(rng.normal(0, 0.03, len(dates)))
+    return pd.DataFrame({
+        'Open': open_,
+        'High': np.maximum(open_, close) + spread,
+        'Low': np.minimum(open_, close) - spread,
+        'Close': close,
+        'Volume': rng.integers(100, 5000, len(dates)).astype(float),
+    }, index=dates)
+
+
+class FakeGateway:
+    """
+    In-process stand-in for TWS / IB Gateway. attach() swaps the request methods of an IBApi (or any
+    EClient + EWrapper) for these, and answers come back through the same wrapper callbacks, queued and
+    delivered by run() just like the EReader thread does. Time only moves when advance() or play() is
+    called, and each callback is delivered with the simulated clock (clock_ns) set to its event time.
+
+    Bars come from `bars` (a DataFrame shaped like Database.fetch_data_from_db) or are generated per
+    ticker. Market data replays `ticks` (recorded ticks with TICK_COLUMNS) for the minutes that have
+    some and is made from the bars otherwise. Supports 1-minute reqHistoricalData with keepUpToDate,
+    reqRealTimeBars, reqMktData, and MKT/LMT/STP orders, brackets included, filled against the
+    simulated prices, with positions and open orders reported back.
+    """
+
+    def __init__(self, bars=None, ticks=None, now=None, tws_timezone='Europe/Athens', timezone='America/New_York',
+                 account='DUFAKE'):
+        self.frames = {}
+        if bars is not None and not bars.empty:
+            bars = bars.assign(Date=pd.to_datetime(bars['Date']))
+            for ticker, frame in bars.groupby('Ticker'):
+                self.frames[ticker] = frame.set_index('Date').sort_index()[['Open', 'High', 'Low', 'Close', 'Volume']]
+        self.ticks = {}
+        if ticks is not None and len(ticks):
+            for ticker, frame in ticks[TICK_COLUMNS].groupby('ticker'):
+                self.ticks[ticker] = frame.sort_values('ts_ns', kind='stable')
+        self.tws_timezone = tws_timezone
+        self.timezone = timezone
+        self.data_end = self._data_end()
+        if now is None:
+            now = self.data_end - pd.Timedelta(minutes=1) if self.data_end is not None else pd.Timestamp.now()
+        self.now = pd.Timestamp(now).floor('1min')
+        self.event_ns = self._epoch_ns(self.now)
+        self.account = account
+        self.wrapper = None
+        self.connected = False
+        self.messages = queue.Queue()
+        self.subscriptions = {}
+        self.day_volume = {}
+        self.format_dates = {}
+        self.next_order_id = 1
+        self.requests = []
+        self.lock = threading.Lock()
+        self.orders = {}
+        self.positions = {}
+        self.last_prices = {}
+        self.last_market_data = {}
+        self.reaction_latencies = []
+        self.delivered = 0
+        self.fills = 0
+        self.played_since = None
+
+    @classmethod
+    def from_database(cls, db, tickers=None, start=None, end=None, **kwargs):
+        # Replays the minute_data bars stored between start and end
+        bars = db.fetch_data_from_db('minute_data', start, end)
+        if bars is None:
+            bars = pd.DataFrame()
+        if tickers and not bars.empty:
+            bars = bars[bars['Ticker'].isin(tickers)]
+        return cls(bars=bars, **kwargs)
+
+    def _data_end(self):
+        # End of the minute of the last real bar or recorded tick
+        ends = [frame.index[-1] + pd.Timedelta(minutes=1) for frame in self.frames.values()]
+        ends += [self._from_epoch_ns(frame['ts_ns'].iloc[-1]).floor('1min') + pd.Timedelta(minutes=1)
+                 for frame in self.ticks.values()]
+        return max(ends) if ends else None
+
+    def data_start(self):
+        starts = [frame.index[0] for frame in self.frames.values()]
+        starts += [self._from_epoch_ns(frame['ts_ns'].iloc[0]).floor('1min') for frame in self.ticks.values()]
+        return min(starts) if starts else None
+
+    def _epoch_ns(self, date):
+        return date.tz_localize(self.timezone).value
+
+    def _from_epoch_ns(self, ts):
+        return pd.Timestamp(int(ts), tz='UTC').tz_convert(self.timezone).tz_localize(None)
+
+    def clock_ns(self):
+        # Simulated epoch ns of the callback being delivered, stands in for time_ns() in the app
+        return self.event_ns
+
+    def clock_datetime(self):
+        # Simulated naive exchange time, stands in for datetime.now() in the app
+        return self._from_epoch_ns(self.event_ns).to_pydatetime()
+
+    def attach(self, app):
+        self.wrapper = app
+        for name in REQUEST_METHODS:
+            setattr(app, name, getattr(self, name))
+        app.clock = self.clock_ns
+        if getattr(app, 'bar_builder', None):
+            # Quiet tickers' bars are closed by _run_minute in simulated time, not by the wall-clock thread
+            app.bar_builder.stop_clock()
+            app.bar_builder.clock = self.clock_ns
+        if getattr(app, 'data_processor', None):
+            app.data_processor.clock = self.clock_datetime
+        for owner in (app, getattr(app, 'data_processor', None)):
+            if getattr(owner, 'order_manager', None):
+                owner.order_manager.clock = self.clock_datetime
+        return app
+
+    def _send(self, callback, *args, at=None):
+        # Answers to requests are stamped with the time of the callback the app is handling
+        self.messages.put((callback, args, self.event_ns if at is None else at))
+
+    def _deliver(self, message):
+        callback, args, at = message
+        self.event_ns = at
+        if callable(callback):
+            # Gateway-side work that has to run in order with the callbacks, like closing the minute's bars
+            callback(*args)
+            return
+        if callback in ('tickPrice', 'realtimeBar', 'historicalDataUpdate'):
+            self.last_market_data[args[0]] = monotonic_ns()
+        getattr(self.wrapper, callback)(*args)
+        self.delivered += 1
+
+    def _close_bars(self, boundary_ns):
+        # What the bar builder's clock thread does live, once the minute's ticks have all been delivered
+        bar_builder = getattr(self.wrapper, 'bar_builder', None)
+        if bar_builder:
+            bar_builder.close_due(boundary_ns + bar_builder.grace)
+
+    def process_pending(self):
+        # Delivers the queued callbacks on the calling thread, returns how many were delivered
+        delivered = 0
+        while True:
+            try:
+                message = self.messages.get_nowait()
+            except queue.Empty:
+                return delivered
+            self._deliver(message)
+            delivered += 1
+
+    def bars_for(self, ticker, start, end):
+        # Real bars where the frame has them, a synthetic walk joined onto its ends where it does not
+        frame = self.frames.get(ticker)
+        if frame is None:
+            frame = synthetic_minute_bars(ticker, start, end + pd.Timedelta(days=1))
+        if frame.index[0] > start:
+            before = synthetic_minute_bars(ticker, start, frame.index[0])
+            before[PRICE_COLUMNS] += frame['Open'].iloc[0] - before['Close'].iloc[-1]
+            frame = pd.concat([before, frame])
+        if frame.index[-1] < end - pd.Timedelta(minutes=1):
+            after = synthetic_minute_bars(ticker, frame.index[-1] + pd.Timedelta(minutes=1), end + pd.Timedelta(days=1))
+            after[PRICE_COLUMNS] += frame['Close'].iloc[-1] - after['Open'].iloc[0]
+            frame = pd.concat([frame, after])
+        self.frames[ticker] = frame
+        return frame[(frame.index >= start) & (frame.index < end)]
+
+    def ticks_for(self, ticker, start_ns, end_ns):
+        # Recorded ticks of ticker in [start_ns, end_ns), None when there are none
+        frame = self.ticks.get(ticker)
+        if frame is None:
+            return None
+        ts = frame['ts_ns'].values
+        ticks = frame.iloc[np.searchsorted(ts, start_ns):np.searchsorted(ts, end_ns)]
+        return ticks if len(ticks) else None
+
+    def _bar_date(self, date, format_date=1):
+        # formatDate=1 is 'yyyymmdd hh:mm:ss zone' in the TWS time zone, formatDate=2 is epoch seconds
+        if format_date == 2:
+            return str(int(date.tz_localize(self.timezone).timestamp()))
+        local = date.tz_localize(self.timezone).tz_convert(self.tws_timezone)
+        return f"{local:%Y%m%d %H:%M:%S} {self.tws_timezone}"
+
+    def parse_end(self, end_date_time):
+        # '' is now, 'yyyymmdd-hh:mm:ss' is UTC, 'yyyymmdd hh:mm:ss [zone]' is taken as exchange time
+        if not end_date_time:
+            return self.now
+        if '-' in end_date_time:
+            utc = pd.Timestamp(end_date_time.replace('-', ' '), tz='UTC')
+            return utc.tz_convert(self.timezone).tz_localize(None)
+        return pd.Timestamp(' '.join(end_date_time.split()[:2]))
+
+    @staticmethod
+    def _bar_data(date, open_, high, low, close, volume):
+        bar = BarData()
+        bar.date = date
+        bar.open, bar.high, bar.low, bar.close = float(open_), float(high), float(low), float(close)
+        bar.volume = int(volume)
+        return bar
+
+    # EClient requests
+
+    def connect(self, host=None, port=None, clientId=None):
+        self.connected = True
+        self._send('nextValidId', self.next_order_id)
+
+    def disconnect(self):
+        self.connected = False
+
+    def isConnected(self):
+        return self.connected
+
+    def run(self):
+        while self.connected:
+            try:
+                message = self.messages.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            self._deliver(message)
+
+    def reqIds(self, numIds):
+        self._send('nextValidId', self.next_order_id)
+
+    def reqPositions(self):
+        with self.lock:
+            positions = [position for position in self.positions.values() if position[1]]
+        for contract, size, avg_cost in positions:
+            self._send('position', self.account, contract, size, avg_cost)
+        self._send('positionEnd')
+
+    def reqHistoricalData(self, reqId, contract, endDateTime, durationStr, barSizeSetting, whatToShow, useRTH,
+                          formatDate, keepUpToDate, chartOptions):
+        self.requests.append(('reqHistoricalData', reqId, contract.symbol, endDateTime, durationStr, keepUpToDate))
+        if barSizeSetting != '1 min':
+            self._send('error', reqId, 162, f"FakeGateway only serves 1 min bars, not {barSizeSetting}")
+            return
+        end = self.parse_end(endDateTime)
+        start = end - parse_duration(durationStr)
+        bars = self.bars_for(contract.symbol, start, end)
+        for date, row in bars.iterrows():
+            self._send('historicalData', reqId, self._bar_data(self._bar_date(date, formatDate), row['Open'],
+                                                               row['High'], row['Low'], row['Close'], row['Volume']))
+        self._send('historicalDataEnd', reqId, f"{start:%Y%m%d %H:%M:%S}", f"{end:%Y%m%d %H:%M:%S}")
+        if keepUpToDate:
+            self.subscriptions[reqId] = ('history', contract.symbol)
+            self.format_dates[reqId] = formatDate
+
+    def cancelHistoricalData(self, reqId):
+        self.subscriptions.pop(reqId, None)
+
+    def reqRealTimeBars(self, reqId, contract, barSize, whatToShow, useRTH, realTimeBarsOptions):
+        self.requests.append(('reqRealTimeBars', reqId, contract.symbol))
+        self.subscriptions[reqId] = ('realtime_bars', contract.symbol)
+
+    def cancelRealTimeBars(self, reqId):
+        self.subscriptions.pop(reqId, None)
+
+    def reqMktData(self, reqId, contract, genericTickList, snapshot, regulatorySnapshot, mktDataOptions):
+        self.requests.append(('reqMktData', reqId, contract.symbol))
+        self.subscriptions[reqId] = ('ticks', contract.symbol)
+
+    def cancelMktData(self, reqId):
+        self.subscriptions.pop(reqId, None)
+
+    def placeOrder(self, orderId, contract, order):
+        """
+        Takes MKT, LMT and STP orders. An order with a parentId waits (PreSubmitted) until its parent
+        fills, and the first child to fill cancels its siblings. transmit is not modelled, every order
+        works once placed. Marketable orders fill at once at the last simulated price, the rest are
+        matched against each following minute.
+        """
+        self.requests.append(('placeOrder', orderId, contract.symbol, order.action, order.orderType))
+        reaction = self._reaction_ns(contract.symbol)
+        with self.lock:
+            if reaction is not None:
+                self.reaction_latencies.append(reaction)
+            self.next_order_id = max(self.next_order_id, orderId + 1)
+            parent = self.orders.get(order.parentId) if order.parentId else None
+            waiting = parent is not None and parent['status'] != 'Filled'
+            entry = self.orders[orderId] = {'contract': contract, 'order': order, 'filled': 0.0,
+                                            'status': 'PreSubmitted' if waiting else 'Submitted'}
+            self._send('openOrder', orderId, contract, order, self._order_state(entry['status']))
+            self._send_status(orderId, entry)
+            if not waiting:
+                price = self._last_price(contract.symbol)
+                fill_price = self._fill_price(order, price, price, price, price)
+                if fill_price is not None:
+                    self._fill_all([(orderId, fill_price)], self.event_ns)
+
+    def cancelOrder(self, orderId, manualCancelOrderTime=""):
+        self.requests.append(('cancelOrder', orderId))
+        with self.lock:
+            entry = self.orders.get(orderId)
+            if entry is None or entry['status'] not in WORKING:
+                self._send('error', orderId, 10147, f"OrderId {orderId} that needs to be cancelled is not found.")
+                return
+            self._cancel(orderId, entry)
+            for child_id, child in self.orders.items():
+                if child['order'].parentId == orderId and child['status'] in WORKING:
+                    self._cancel(child_id, child)
+
+    def reqOpenOrders(self):
+        with self.lock:
+            for orderId, entry in self.orders.items():
+                if entry['status'] in WORKING:
+                    self._send('openOrder', orderId, entry['contract'], entry['order'],
+                               self._order_state(entry['status']))
+        self._send('openOrderEnd')
+
+    # Order matching, the callers hold self.lock
+
+    @staticmethod
+    def _order_state(status):
+        state = OrderState()
+        state.status = status
+        return state
+
+    def _send_status(self, orderId, entry, avg_price=0.0, at=None):
+        order = entry['order']
+        self._send('orderStatus', orderId, entry['status'], entry['filled'], order.totalQuantity - entry['filled'],
+                   avg_price, orderId, order.parentId, avg_price, 0, '', 0.0, at=at)
+
+    def _cancel(self, orderId, entry, at=None):
+        entry['status'] = 'Cancelled'
+        self._send_status(orderId, entry, at=at)
+
+    def _last_price(self, ticker):
+        if ticker not in self.last_prices:
+            bars = self.bars_for(ticker, self.now - pd.Timedelta(minutes=1), self.now)
+            self.last_prices[ticker] = float(bars['Close'].iloc[-1])
+        return self.last_prices[ticker]
+
+    @staticmethod
+    def _fill_price(order, open_, high, low, close):
+        # Price an order fills at within a bar, None when the bar never reaches it
+        buy = order.action == 'BUY'
+        if order.orderType == 'MKT':
+            return close
+        if order.orderType == 'LMT':
+            if buy and low <= order.lmtPrice:
+                return min(open_, order.lmtPrice)
+            if not buy and high >= order.lmtPrice:
+                return max(open_, order.lmtPrice)
+        elif order.orderType == 'STP':
+            if buy and high >= order.auxPrice:
+                return max(open_, order.auxPrice)
+            if not buy and low <= order.auxPrice:
+                return min(open_, order.auxPrice)
+        return None
+
+    def _fill_all(self, fills, at):
+        # Fills the orders, then releases the children of filled parents and cancels siblings of filled children
+        for orderId, price in fills:
+            entry = self.orders[orderId]
+            if entry['status'] != 'Submitted':
+                continue
+            self._fill(orderId, entry, price, at)
+            parentId = entry['order'].parentId
+            for child_id, child in self.orders.items():
+                if parentId and child['order'].parentId == parentId and child['status'] in WORKING:
+                    self._cancel(child_id, child, at)
+                elif child['order'].parentId == orderId and child['status'] == 'PreSubmitted':
+                    child['status'] = 'Submitted'
+                    self._send_status(child_id, child, at=at)
+
+    def _fill(self, orderId, entry, price, at):
+        contract, order = entry['contract'], entry['order']
+        quantity = float(order.totalQuantity)
+        signed = quantity if order.action == 'BUY' else -quantity
+        _, size, avg_cost = self.positions.get(contract.symbol, (contract, 0.0, 0.0))
+        new_size = size + signed
+        if new_size and size * new_size <= 0:
+            avg_cost = price
+        elif abs(new_size) > abs(size):
+            avg_cost = (avg_cost * abs(size) + price * quantity) / abs(new_size)
+        self.positions[contract.symbol] = (contract, new_size, avg_cost if new_size else 0.0)
+        entry['filled'] = quantity
+        entry['status'] = 'Filled'
+        self.fills += 1
+
+        execution = Execution()
+        execution.execId = f"fake.{orderId}"
+        execution.time = f"{self._from_epoch_ns(at):%Y%m%d %H:%M:%S} {self.timezone}"
+        execution.acctNumber = self.account
+        execution.exchange = contract.exchange
+        execution.side = 'BOT' if order.action == 'BUY' else 'SLD'
+        execution.shares = quantity
+        execution.price = price
+        execution.orderId = orderId
+        execution.cumQty = quantity
+        execution.avgPrice = price
+        self._send_status(orderId, entry, price, at=at)
+        self._send('execDetails', -1, contract, execution, at=at)
+        logger.info(f"FakeGateway filled order {orderId}: {order.action} {quantity} {contract.symbol} at {price}")
+
+    def _reaction_ns(self, ticker):
+        # Wall time from the last market data callback for ticker to an order for it
+        delivered = [self.last_market_data[reqId] for reqId, (_, symbol) in list(self.subscriptions.items())
+                     if symbol == ticker and reqId in self.last_market_data]
+        return monotonic_ns() - max(delivered) if delivered else None
+
+    # Market simulation
+
+    def _minute_events(self, date):
+        # (epoch ns, callback, args) of every subscription for the minute starting at date, sorted,
+        # and the minute's (open, high, low, close) per ticker for order matching
+        start_ns = self._epoch_ns(date)
+        events = []
+        prices = {}
+        for reqId, (kind, ticker) in list(self.subscriptions.items()):
+            bars = self.bars_for(ticker, date, date + pd.Timedelta(minutes=1))
+            if bars.empty:
+                continue
+            bar = bars.iloc[0]
+            ticks = self.ticks_for(ticker, start_ns, start_ns + MINUTE_NS) if kind == 'ticks' else None
+            if kind == 'history':
+                events += self._stream_history(reqId, date, start_ns, bar)
+            elif kind == 'realtime_bars':
+                events += self._stream_realtime_bars(reqId, start_ns, bar)
+            elif ticks is not None:
+                events += self._replay_ticks(reqId, ticks)
+                last = ticks.loc[ticks['tickType'] == LAST_PRICE, 'price']
+                if len(last):
+                    prices[ticker] = (last.iloc[0], last.max(), last.min(), last.iloc[-1])
+            else:
+                events += self._stream_ticks(reqId, ticker, start_ns, bar)
+            prices.setdefault(ticker, tuple(bar[PRICE_COLUMNS]))
+        with self.lock:
+            tickers = {entry['contract'].symbol for entry in self.orders.values() if entry['status'] == 'Submitted'}
+        for ticker in tickers.difference(prices):
+            bars = self.bars_for(ticker, date, date + pd.Timedelta(minutes=1))
+            if not bars.empty:
+                prices[ticker] = tuple(bars[PRICE_COLUMNS].iloc[0])
+        events.sort(key=lambda event: event[0])
+        return events, prices
+
+    def _run_minute(self, date, pace=None):
+        events, prices = self._minute_events(date)
+        for at, callback, args in events:
+            if pace:
+                pace(at)
+            self._send(callback, *args, at=at)
+        end_ns = self._epoch_ns(date) + MINUTE_NS - 1
+        if pace:
+            pace(end_ns)
+        self._send(self._close_bars, end_ns + 1, at=end_ns)
+        with self.lock:
+            for ticker, (open_, high, low, close) in prices.items():
+                self.last_prices[ticker] = float(close)
+                fills = []
+                for orderId, entry in self.orders.items():
+                    if entry['status'] == 'Submitted' and entry['contract'].symbol == ticker:
+                        price = self._fill_price(entry['order'], float(open_), float(high), float(low), float(close))
+                        if price is not None:
+                            fills.append((orderId, price))
+                self._fill_all(fills, end_ns)
+        self.now = date + pd.Timedelta(minutes=1)
+        return len(events)
+
+    def advance(self, minutes=1):
+        """
+        Moves the clock forward minute by minute, streaming each minute's bar to every subscription:
+        keepUpToDate gets the forming bar twice (half way and final) and the next bar's first update
+        closes it, realtime bars get twelve 5-second bars, market data gets the recorded ticks or
+        last/size/volume ticks made from the bar. Working orders are then matched against the minute.
+        Returns the number of callbacks queued.
+        """
+        queued = self.messages.qsize()
+        for _ in range(minutes):
+            self._run_minute(self.now)
+        return self.messages.qsize() - queued
+
+    def play(self, speed=1.0, minutes=None, stop_event=None):
+        """
+        Streams like advance(), paced against the wall clock: a simulated second takes 1/speed seconds,
+        so speed 60 plays an hour a minute. Runs for `minutes`, or to the end of the replayed data when
+        that is None (forever for synthetic data), until stop_event is set. Returns the minutes played.
+        """
+        wall_start = monotonic_ns()
+        sim_start = self._epoch_ns(self.now)
+        self.played_since = self.played_since or wall_start
+        # Timeouts the app computes from the simulated clock are waited out on the wall clock
+        self.wrapper.clock_speed = speed
+
+        def pace(at):
+            wait = wall_start + (at - sim_start) / speed - monotonic_ns()
+            if wait > 0:
+                sleep(wait / 1e9)
+
+        played = 0
+        while minutes is None or played < minutes:
+            if stop_event is not None and stop_event.is_set():
+                break
+            if minutes is None and self.data_end is not None and self.now >= self.data_end:
+                break
+            self._run_minute(self.now, pace)
+            played += 1
+        return played
+
+    def stats(self):
+        # Callbacks delivered per second of play and reaction latency, market data delivered to order placed
+        elapsed = (monotonic_ns() - self.played_since) / 1e9 if self.played_since else 0.0
+        with self.lock:
+            latencies = np.array(self.reaction_latencies, dtype=float) / NANOS_PER_MILLISECOND
+            stats = {
+                'delivered': self.delivered,
+                'orders': len(self.orders),
+                'fills': self.fills,
+                'elapsed_s': round(elapsed, 1),
+                'callbacks_per_s': round(self.delivered / elapsed, 1) if elapsed else 0.0,
+            }
+        if latencies.size:
+            stats.update({
+                'reaction_p50_ms': round(float(np.percentile(latencies, 50)), 1),
+                'reaction_p99_ms': round(float(np.percentile(latencies, 99)), 1),
+                'reaction_max_ms': round(float(latencies.max()), 1),
+            })
+        return stats
+
+    def _stream_history(self, reqId, date, start_ns, bar):
+        bar_date = self._bar_date(date, self.format_dates.get(reqId, 1))
+        half = self._bar_data(bar_date, bar['Open'], max(bar['Open'], bar['Close']), min(bar['Open'], bar['Close']),
+                              (bar['Open'] + bar['Close']) / 2, bar['Volume'] // 2)
+        final = self._bar_data(bar_date, bar['Open'], bar['High'], bar['Low'], bar['Close'], bar['Volume'])
+        return [(start_ns, 'historicalDataUpdate', (reqId, half)),
+                (start_ns + MINUTE_NS // 2, 'historicalDataUpdate', (reqId, final))]
+
+    def _stream_realtime_bars(self, reqId, start_ns, bar):
+        # IB sends each 5-second bar once it is over, stamped with its start
+        epoch = start_ns // 1_000_000_000
+        volumes = np.full(12, bar['Volume'] // 12)
+        volumes[-1] += bar['Volume'] - volumes.sum()
+        events = []
+        for i in range(12):
+            if i == 0:
+                prices = (float(bar['Open']), float(bar['High']), float(bar['Low']), float(bar['Close']))
+            else:
+                prices = (float(bar['Close']),) * 4
+            events.append((start_ns + (i + 1) * MINUTE_NS // 12 - 1, 'realtimeBar',
+                           (reqId, epoch + 5 * i, *prices, int(volumes[i]), prices[3], 1)))
+        return events
+
+    def _stream_ticks(self, reqId, ticker, start_ns, bar):
+        events = []
+        for i, price in enumerate((bar['Open'], bar['High'], bar['Low'], bar['Close'])):
+            at = start_ns + i * MINUTE_NS // 4
+            size = bar['Volume'] // 4
+            self.day_volume[ticker] = self.day_volume.get(ticker, 0) + size
+            events += [(at, 'tickPrice', (reqId, LAST_PRICE, float(price), TickAttrib())),
+                       (at, 'tickSize', (reqId, 5, size)),
+                       (at, 'tickSize', (reqId, 8, self.day_volume[ticker]))]
+        return events
+
+    @staticmethod
+    def _replay_ticks(reqId, ticks):
+        events = []
+        for ts, tick_type, price, size in zip(ticks['ts_ns'].tolist(), ticks['tickType'].tolist(),
+                                              ticks['price'].tolist(), ticks['size'].tolist()):
+            if tick_type in PRICE_TICK_TYPES:
+                events.append((ts, 'tickPrice', (reqId, tick_type, price, TickAttrib())))
+            else:
+                events.append((ts, 'tickSize', (reqId, tick_type, size)))
+        return events
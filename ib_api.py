@@ -1,8 +1,9 @@
+import os
 import queue
-
+import numpy as np
 import pandas as pd
 import pytz
-from time import sleep, time
+from time import sleep, time, time_ns
 from datetime import datetime
 from ibapi.client import EClient
 from ibapi.wrapper import EWrapper
@@ -10,8 +11,13 @@ from ibapi.contract import Contract
 from ibapi.order import Order
 import threading
 import api_helper
+from backfill import plan_backfill
 # from globals import stop_flag
+from bar_builder import BarBuilder
 from order_manager import OrderManager
+from strategy_events import DirtyTickers
+from tick_journal import TickJournal, TickJournalReader
+from write_behind import WriteBehindError
 import logging
 
 
@@ -37,18 +43,23 @@ ib_api_file_handler.setFormatter(formatter)
 # Add the handler to the IB API logger
 ib_api_logger.addHandler(ib_api_file_handler)
 
+STREAM_MODES = ('ticks', 'realtime_bars', 'keep_up_to_date')
+NAN = float('nan')
+
 
 class IBApi(EClient, EWrapper):
-    def __init__(self, data_processor, db):
+    def __init__(self, data_processor, db, write_queue=None, stream_mode=None, tick_journal=None):
         EClient.__init__(self, wrapper=self)
         self.data_download_complete = False
         self.nextValidOrderId = None
         self.data = []
-        self.real_time_data = {}
+        # Epoch ns stamped on ticks, FakeGateway swaps in its simulated clock and sets how fast it runs
+        self.clock = time_ns
+        self.clock_speed = 1.0
         self.lock = threading.Lock()
         self.ticker = None
         self.historical_data_downloaded = False
-        self.ohlcv_data = {}
+        self.bar_builder = BarBuilder(self.on_bar_closed).start_clock()
         self.data_processor = data_processor
         self.db = db
         self.order_manager = OrderManager(api_helper)
@@ -59,9 +70,29 @@ class IBApi(EClient, EWrapper):
         self.contracts = []
         self.current_reqId = 1
         self.reqId_info = {}
+        self.symbol_reqIds = {}
+        self.contract_reqIds = {}
+        self.conId_reqIds = {}
         self.open_orders = []
         self.open_positions = []
         self.positions_fetched = False
+        self.bar_buffers = {}
+        self.bar_buffer_size = 500
+        self.bar_buffer_max_age = 5.0
+        self.write_queue = write_queue
+        self.stream_mode = stream_mode or os.getenv('STOCKDATADB_STREAM_MODE', 'ticks')
+        if self.stream_mode not in STREAM_MODES:
+            raise ValueError(f"Unknown stream mode {self.stream_mode}, expected one of {STREAM_MODES}")
+        self.streaming_bars = {}
+        self.realtime_bar_seconds = 5
+        self.backfill = None
+        self.gap_fill_requests = {}
+        # Closed bars (and finished downloads) wake the strategy loop for their ticker, ticks only if asked to
+        self.strategy_events = DirtyTickers()
+        self.mark_dirty_on_ticks = False
+        # Every raw tick is appended to a per-day binary journal when a directory is configured
+        journal_dir = os.getenv('STOCKDATADB_TICK_JOURNAL')
+        self.tick_journal = tick_journal or (TickJournal(journal_dir).start() if journal_dir else None)
         self.reqPositions()
 
     def set_ticker(self, ticker):
@@ -69,6 +100,8 @@ class IBApi(EClient, EWrapper):
 
     def error(self, reqId, errorCode, errorString, advancedOrderRejectJson=""):
         ib_api_logger.error(f"Error: {reqId} {errorCode} {errorString} {advancedOrderRejectJson}")
+        if self.backfill:
+            self.backfill.on_error(reqId, errorCode, errorString)
         # print("Error: {} {} {} {}".format(reqId, errorCode, errorString, advancedOrderRejectJson))
 
     def nextValidId(self, orderId):
@@ -98,6 +131,7 @@ class IBApi(EClient, EWrapper):
 
     def openOrder(self, orderId, contract, order, orderState):
         print(f"Open Order - orderId: {orderId}, contract: {contract.symbol}, action: {order.action}")
+        self.index_conId(contract)
         self.open_orders.append({
             'orderId': orderId,
             'contract': contract,
@@ -106,50 +140,47 @@ class IBApi(EClient, EWrapper):
         })
 
     def execDetails(self, reqId, contract, execution):
+        self.index_conId(contract)
         print(
             f"Exec Details - reqId: {reqId}, symbol: {contract.symbol}, execId: {execution.execId}, orderId: {execution.orderId}, shares: {execution.shares}, lastLiquidity: {execution.lastLiquidity}")
 
     def historicalData(self, reqId, bar):
-        ib_api_logger.debug("Requesting data...")
-        ib_api_logger.debug(
-            f'Time: {bar.date}, Open: {bar.open}, High: {bar.high}, Low: {bar.low}, Close: {bar.close}, Volume: {bar.volume}')
-        print("Requesting data...")
-        print(
-            f'Time: {bar.date}, Open: {bar.open}, High: {bar.high}, Low: {bar.low}, Close: {bar.close}, Volume: {bar.volume}')
+        # Called once per bar on the message loop, so no per-bar logging or date parsing here
         try:
             # contract = next((entry['contract'] for entry in self.contracts if entry['reqId'] == reqId), None)
             if reqId in self.reqId_info:
                 contract_info = self.reqId_info[reqId]
                 contract = contract_info['contract']
                 data_type = contract_info['data_type']
-                gr_tz = pytz.timezone('Europe/Athens')
-                ny_tz = pytz.timezone('America/New_York')
-
-                if data_type == 'minute':
-                    date_parts = bar.date.split()
-
-                    if len(date_parts) == 3:
-                        date_str, time_str, tz_str = date_parts
-                        date = datetime.strptime(f'{date_str} {time_str}', '%Y%m%d %H:%M:%S')
-                        # print(f"Date with timezone: {date} (Timezone: {tz_str})")
-                        date = gr_tz.localize(date)
-                        date_ny = date.astimezone(ny_tz)
-
-                    elif len(date_parts) == 2:
-                        date_str, time_str = date_parts
-                        date = datetime.strptime(f'{date_str} {time_str}', '%Y%m%d %H:%M:%S')
-                        print(f"Date without timezone: {date}")
-                        date = gr_tz.localize(date)
-                        date_ny = date.astimezone(ny_tz)
-                    self.db.insert_data_to_minute_table('minute_data', contract.symbol, date_ny, bar.open, bar.high, bar.low,
-                                                    bar.close, bar.volume)
+
+                if data_type == 'minute' and bar.date.isdigit():
+                    # formatDate=2: epoch seconds, converted for the whole buffer at once when it is flushed
+                    self.buffer_epoch_bar(reqId, contract.symbol, bar)
+
+                elif data_type == 'minute':
+                    date_ny = self.minute_bar_date(bar.date)
+                    self.buffer_bar(reqId, data_type, {
+                        'ticker': contract.symbol,
+                        'date_time': date_ny,
+                        'open': bar.open,
+                        'high': bar.high,
+                        'low': bar.low,
+                        'close': bar.close,
+                        'volume': bar.volume
+                    })
 
                 elif data_type == 'daily':
-                    date_str = bar.date
-                    date = datetime.strptime(date_str, '%Y%m%d')
-                    date = ny_tz.localize(date).replace(tzinfo=None)
-                    self.db.insert_data_to_daily_table('daily_data', contract.symbol, date, bar.open, bar.high, bar.low,
-                                                       bar.close, bar.volume)
+                    # Daily bars are 'yyyymmdd' whatever the formatDate
+                    date = datetime.strptime(bar.date, '%Y%m%d')
+                    self.buffer_bar(reqId, data_type, {
+                        'ticker': contract.symbol,
+                        'date': date,
+                        'open': bar.open,
+                        'high': bar.high,
+                        'low': bar.low,
+                        'close': bar.close,
+                        'volume': bar.volume
+                    })
             else:
                 logger.error(f"No contract found for reqId: {reqId}")
                 print(f"No contract found for reqId: {reqId}")
@@ -158,6 +189,105 @@ class IBApi(EClient, EWrapper):
             logger.error(f"Error converting date: {e}")
             print(f"Error converting date: {e}")
 
+    @staticmethod
+    def minute_bar_date(bar_date):
+        # formatDate=2 bar dates are epoch seconds, formatDate=1 ones are in the TWS time zone (Athens),
+        # with or without the zone name appended
+        if bar_date.isdigit():
+            return pd.Timestamp(int(bar_date), unit='s', tz='UTC').tz_convert('America/New_York').to_pydatetime()
+        date_parts = bar_date.split()
+        if len(date_parts) not in (2, 3):
+            raise ValueError(f"Unexpected bar date: {bar_date}")
+        date = datetime.strptime(f'{date_parts[0]} {date_parts[1]}', '%Y%m%d %H:%M:%S')
+        return pytz.timezone('Europe/Athens').localize(date).astimezone(pytz.timezone('America/New_York'))
+
+    @staticmethod
+    def epoch_bar_rows(ticker, bars, timezone='America/New_York'):
+        """
+        minute_data rows for (epoch seconds, open, high, low, close, volume) tuples, with the dates of
+        all of them converted to naive exchange time in one vectorized step.
+        """
+        values = np.array(bars, dtype=float)
+        dates = pd.to_datetime(values[:, 0].astype(np.int64), unit='s', utc=True).tz_convert(timezone).tz_localize(None)
+        return [
+            {'ticker': ticker, 'date_time': date, 'open': open_, 'high': high, 'low': low, 'close': close,
+             'volume': volume}
+            for date, open_, high, low, close, volume in zip(dates.to_pydatetime(), *values[:, 1:].T.tolist())
+        ]
+
+    def historicalDataUpdate(self, reqId, bar):
+        # keepUpToDate sends the forming bar again on every change, a bar with a new date means the last one closed
+        contract_info = self.reqId_info.get(reqId)
+        if not contract_info:
+            logger.error(f"No contract found for reqId: {reqId}")
+            return
+        try:
+            date = self.minute_bar_date(bar.date).replace(tzinfo=None)
+        except ValueError as e:
+            logger.error(f"Error converting date: {e}")
+            print(f"Error converting date: {e}")
+            return
+
+        forming = self.streaming_bars.get(reqId)
+        self.streaming_bars[reqId] = {
+            'Date': pd.Timestamp(date),
+            'Open': bar.open,
+            'High': bar.high,
+            'Low': bar.low,
+            'Close': bar.close,
+            'Volume': float(bar.volume),
+            'Ticker': contract_info['contract'].symbol,
+        }
+        if forming is not None and forming['Date'] < self.streaming_bars[reqId]['Date']:
+            self.store_streamed_bar(forming)
+            self.on_bar_closed(forming)
+
+    def realtimeBar(self, reqId, time, open_, high, low, close, volume, wap, count):
+        contract_info = self.reqId_info.get(reqId)
+        if contract_info:
+            ticker = contract_info['contract'].symbol
+            self.bar_builder.add_bar(ticker, int(time) * 1_000_000_000, open_, high, low, close, float(volume),
+                                     self.realtime_bar_seconds)
+        else:
+            logger.warning(f"Contract not found for reqId: {reqId}")
+
+    def store_streamed_bar(self, bar):
+        # Closed streamed bars go to minute_data as they come, so the database stays current without re-downloads
+        row = {
+            'ticker': bar['Ticker'],
+            'date_time': bar['Date'].to_pydatetime(),
+            'open': bar['Open'],
+            'high': bar['High'],
+            'low': bar['Low'],
+            'close': bar['Close'],
+            'volume': bar['Volume'],
+        }
+        self.queue_rows('minute_data', [row])
+
+    def queue_rows(self, table_name, rows):
+        # Hands rows to the write-behind queue, returns False when they were written here instead
+        # (no queue, or one that stayed full or was closed, which costs the message loop a synchronous write)
+        if self.write_queue:
+            try:
+                return self.write_queue.submit_many(table_name, rows)
+            except WriteBehindError as e:
+                logger.warning(f"Writing {len(rows)} rows into {table_name} directly: {e}")
+        self.db.insert_bars(table_name, rows)
+        return False
+
+    def subscribe_real_time(self, contract, reqId):
+        """
+        Starts the live feed for a contract in the configured stream_mode: 'ticks' (reqMktData, bars built
+        from ticks), 'realtime_bars' (reqRealTimeBars, 5-second bars rolled into minutes) or
+        'keep_up_to_date', where the history request made by update_minute_data_for_symbol already streams.
+        """
+        if self.stream_mode == 'keep_up_to_date':
+            logger.info(f"{contract.symbol} streams through its keepUpToDate history request {reqId}")
+        elif self.stream_mode == 'realtime_bars':
+            self.reqRealTimeBars(reqId, contract, self.realtime_bar_seconds, "TRADES", False, [])
+        else:
+            self.reqMktData(reqId, contract, "", False, False, [])
+
     def insert_minute_data(self, ticker, date, bar):
         self.db.insert_data_to_minute_table(
             'minute_data', ticker, date, bar.open, bar.high, bar.low, bar.close, bar.volume
@@ -168,23 +298,148 @@ class IBApi(EClient, EWrapper):
             'daily_data', ticker, date, bar.open, bar.high, bar.low, bar.close, bar.volume
         )
 
+    def _bar_buffer(self, reqId, data_type):
+        buffer = self.bar_buffers.get(reqId)
+        if buffer is None:
+            buffer = self.bar_buffers[reqId] = {'data_type': data_type, 'rows': [], 'epoch_bars': [],
+                                                'ticker': None, 'started': time()}
+        return buffer
+
+    def _check_bar_buffer(self, reqId, buffer):
+        size = len(buffer['rows']) + len(buffer['epoch_bars'])
+        if size >= self.bar_buffer_size or time() - buffer['started'] >= self.bar_buffer_max_age:
+            self.flush_bar_buffer(reqId)
+
+    def buffer_bar(self, reqId, data_type, row):
+        buffer = self._bar_buffer(reqId, data_type)
+        buffer['rows'].append(row)
+        self._check_bar_buffer(reqId, buffer)
+
+    def buffer_epoch_bar(self, reqId, ticker, bar):
+        # Kept raw, epoch_bar_rows converts the dates when the buffer is flushed
+        buffer = self._bar_buffer(reqId, 'minute')
+        buffer['ticker'] = ticker
+        buffer['epoch_bars'].append((int(bar.date), bar.open, bar.high, bar.low, bar.close, bar.volume))
+        self._check_bar_buffer(reqId, buffer)
+
+    def flush_bar_buffer(self, reqId):
+        buffer = self.bar_buffers.pop(reqId, None)
+        if not buffer:
+            return 0
+        if buffer['epoch_bars']:
+            buffer['rows'].extend(self.epoch_bar_rows(buffer['ticker'], buffer['epoch_bars']))
+        if not buffer['rows']:
+            return 0
+
+        table_name = 'minute_data' if buffer['data_type'] == 'minute' else 'daily_data'
+        # Written by the write-behind threads when there are some, the message loop only pays for the enqueue
+        if self.queue_rows(table_name, buffer['rows']):
+            logger.info(f"Queued {len(buffer['rows'])} buffered bars for reqId {reqId}")
+        else:
+            logger.info(f"Flushed {len(buffer['rows'])} buffered bars for reqId {reqId}")
+        return len(buffer['rows'])
+
     def historicalDataEnd(self, reqId, start, end):
         ib_api_logger.info("Historical data download complete")
         print("Historical data download complete")
-        self.data_download_complete = True
+        self.flush_bar_buffer(reqId)
+        if self.write_queue:
+            contract_info = self.reqId_info.get(reqId)
+            ticker = contract_info['contract'].symbol if contract_info else None
+            self.write_queue.call_when_flushed(lambda: self.on_download_complete(reqId), ticker=ticker)
+        else:
+            self.on_download_complete(reqId)
         self.data_processor.data_ready_queue.put(self.data)
 
+    def on_download_complete(self, reqId):
+        # Called once the bars of reqId are in the database
+        stats = self.db.get_write_stats()
+        ib_api_logger.info(f"Download for reqId {reqId} stored. DB write throughput: {stats['rows_written']} rows, "
+                           f"{stats['rows_per_second']:.0f} rows/s")
+        if self.write_queue:
+            ib_api_logger.info(f"Write-behind queue metrics: {self.write_queue.get_metrics()}")
+        ticker = self.gap_fill_requests.pop(reqId, None)
+        if ticker and self.data_processor:
+            # The bar window only reads forward from its last bar, holes filled behind it need a reseed
+            self.data_processor.reset_bar_windows(ticker)
+        if self.backfill:
+            self.backfill.complete(reqId)
+        contract_info = self.reqId_info.get(reqId)
+        if contract_info:
+            self.strategy_events.mark(contract_info['contract'].symbol)
+        self.data_download_complete = True
+
+    @staticmethod
+    def contract_key(contract):
+        return contract.symbol, contract.secType, contract.exchange, contract.currency
+
+    def register_request(self, reqId, contract, data_type, primary=True):
+        """
+        Records reqId -> contract and, for a contract's first reqId, the symbol, contract and conId
+        indexes back to it, so lookups on the callback and order paths never scan.
+        """
+        self.reqId_info[reqId] = {
+            'contract': contract,
+            'data_type': data_type
+        }
+        if self.tick_journal:
+            self.tick_journal.set_symbol(reqId, contract.symbol)
+        if primary or contract.symbol not in self.symbol_reqIds:
+            self.symbol_reqIds[contract.symbol] = reqId
+            self.contract_reqIds[self.contract_key(contract)] = reqId
+            if contract.conId:
+                self.conId_reqIds[contract.conId] = reqId
+
+    def index_conId(self, contract):
+        # conIds are only known once IB sends a contract back (positions, orders, executions)
+        if contract.conId and contract.conId not in self.conId_reqIds:
+            reqId = self.symbol_reqIds.get(contract.symbol)
+            if reqId is not None:
+                self.conId_reqIds[contract.conId] = reqId
+
     def get_reqId_for_contract(self, contract):
-        for reqId, info in self.reqId_info.items():
-            if info['contract'] == contract:
-                logger.info(f"Found reqId {reqId} for contract {contract.symbol}")
-                # print(f"Found reqId {reqId} for contract {contract.symbol}")
-                return reqId
-        logger.warning(f"No reqId found for contract: {contract.symbol}")
-        # print(f"No reqId found for contract {contract.symbol}")
-        return None
-
-    def update_minute_data_for_symbol(self, contract):
+        reqId = self.conId_reqIds.get(contract.conId) if contract.conId else None
+        if reqId is None:
+            reqId = self.contract_reqIds.get(self.contract_key(contract))
+        if reqId is None:
+            logger.warning(f"No reqId found for contract: {contract.symbol}")
+            # print(f"No reqId found for contract {contract.symbol}")
+        return reqId
+
+    def get_reqId_for_symbol(self, symbol):
+        return self.symbol_reqIds.get(symbol)
+
+    def get_contract_for_reqId(self, reqId):
+        contract_info = self.reqId_info.get(reqId)
+        return contract_info['contract'] if contract_info else None
+
+    def get_contract_for_symbol(self, symbol):
+        return self.get_contract_for_reqId(self.symbol_reqIds.get(symbol))
+
+    def new_request_id(self, contract, data_type):
+        # Extra reqId for another request on an existing contract, callbacks resolve it like the first one
+        reqId = self.current_reqId
+        self.current_reqId += 1
+        self.register_request(reqId, contract, data_type, primary=False)
+        return reqId
+
+    def historical_request(self, reqId, contract, duration_str, end_date_time=""):
+        # keepUpToDate is only allowed on requests that end now
+        keep_up_to_date = self.stream_mode == 'keep_up_to_date' and not end_date_time
+        return dict(
+            reqId=reqId,  # Χρησιμοποιήστε ένα μοναδικό reqId για κάθε αίτημα
+            contract=contract,
+            endDateTime=end_date_time,  # Αφήστε το κενό για συνεχή λήψη δεδομένων
+            durationStr=duration_str,  # Μπορείτε να προσαρμόσετε τη διάρκεια ανάλογα με τις ανάγκες σας
+            barSizeSetting="1 min",  # Διάστημα ενός λεπτού
+            whatToShow="TRADES",  # Είδος δεδομένων
+            useRTH=0,
+            formatDate=2,  # Epoch seconds, converted per request instead of parsed per bar
+            keepUpToDate=keep_up_to_date,  # Συνεχής λήψη δεδομένων σε πραγματικό χρόνο
+            chartOptions=[]
+        )
+
+    def update_minute_data_for_symbol(self, contract, plan=None):
         reqId = self.get_reqId_for_contract(contract)
         # print(f"Processing historical data for reqId: {reqId}...")
 
@@ -198,28 +453,24 @@ class IBApi(EClient, EWrapper):
         logger.info(f"Contract found: {contract.symbol}, data_type: {data_type}")
         # print(f"Contract found: {contract.symbol}, data_type: {data_type}")
 
-        last_date = self.db.get_last_date_for_symbol(contract.symbol)
-        if last_date is None:
-            start_date = "20240826 09:13:00"
-        else:
-            ny_tz = pytz.timezone('America/New_York')
-            start_date = last_date.astimezone(ny_tz).strftime(
-                '%Y%m%d %H:%M:%S')
-
-        duration_str = "5 D"
-        logger.info(f"Requesting historical data for {contract.symbol}, from {start_date}")
-        self.reqHistoricalData(
-            reqId=reqId,  # Χρησιμοποιήστε ένα μοναδικό reqId για κάθε αίτημα
-            contract=contract,
-            endDateTime="",  # Αφήστε το κενό για συνεχή λήψη δεδομένων
-            durationStr=duration_str,  # Μπορείτε να προσαρμόσετε τη διάρκεια ανάλογα με τις ανάγκες σας
-            barSizeSetting="1 min",  # Διάστημα ενός λεπτού
-            whatToShow="TRADES",  # Είδος δεδομένων
-            useRTH=0,
-            formatDate=1,
-            keepUpToDate=False,  # Συνεχής λήψη δεδομένων σε πραγματικό χρόνο
-            chartOptions=[]
-        )
+        # Only what minute_data lacks is requested: the bars after the last one stored plus any holes.
+        # plan is the ticker's entry of backfill.plan_backfills when the caller planned every ticker at once
+        if plan is None:
+            plan = plan_backfill(self.db, contract.symbol)
+        if self.stream_mode == 'keep_up_to_date' and all(end for end, _ in plan):
+            plan.insert(0, ("", "60 S"))
+        for index, (end_date_time, duration_str) in enumerate(plan):
+            request_id = reqId if index == 0 else self.new_request_id(contract, data_type)
+            if end_date_time:
+                self.gap_fill_requests[request_id] = contract.symbol
+            logger.info(f"Requesting historical data for {contract.symbol}: {duration_str} ending "
+                        f"{end_date_time or 'now'} (reqId {request_id})")
+            params = self.historical_request(request_id, contract, duration_str, end_date_time)
+            if self.backfill:
+                # Sent by the backfill scheduler when pacing allows, completion is reported to it by reqId
+                self.backfill.submit(request_id, params)
+            else:
+                self.reqHistoricalData(**params)
 
         # self.reqMktData(
         #     4,
@@ -285,113 +536,80 @@ class IBApi(EClient, EWrapper):
 
     def tickPrice(self, reqId, tickType, price, attrib):
         # print(f"Tick Price for reqId {reqId}: {price}")
-        timestamp = datetime.now(pytz.timezone('America/New_York')).strftime('%Y-%m-%d %H:%M:%S')
-        # print(f'Tick Price. Ticker Id: {reqId}, tickType: {tickType}, Price: {price}, Timestamp: {timestamp}')
-        # logger.info(f'Tick Price. reqId: {reqId}, tickType: {tickType}, Price: {price}, Timestamp: {timestamp}')
+        # print(f'Tick Price. Ticker Id: {reqId}, tickType: {tickType}, Price: {price}')
+        # logger.info(f'Tick Price. reqId: {reqId}, tickType: {tickType}, Price: {price}')
+        ts = self.clock()
+        if self.tick_journal:
+            self.tick_journal.append(ts, reqId, tickType, price, 0.0)
 
         if tickType == 4:  # Last
-            with self.lock:
-                if reqId not in self.ohlcv_data:
-                    self.ohlcv_data[reqId] = {
-                        'timestamp': timestamp,
-                        'open': price,
-                        'high': price,
-                        'low': price,
-                        'close': price,
-                        'volume': 0,
-                    }
-                else:
-                    self.ohlcv_data[reqId]['close'] = price
-                    if price > self.ohlcv_data[reqId]['high']:
-                        self.ohlcv_data[reqId]['high'] = price
-                    if price < self.ohlcv_data[reqId]['low']:
-                        self.ohlcv_data[reqId]['low'] = price
-
-                contract_info = self.reqId_info.get(reqId)
-                if contract_info:
-                    contract = contract_info['contract']
-                    ticker = contract.symbol
-                    logger.info(f"Found contract {ticker} for reqId {reqId}")
-                    # print(f"Found contract {ticker} for reqId {reqId}")
-
-                    # Αποθήκευση των δεδομένων ως DataFrame
-                    if ticker not in self.real_time_data:
-                        self.real_time_data[ticker] = pd.DataFrame(
-                            columns=['Date', 'Open', 'High', 'Low', 'Close', 'Volume'])
-
-                    new_row = pd.DataFrame([{
-                        'Date': timestamp,
-                        'Open': self.ohlcv_data[reqId]['open'],
-                        'High': self.ohlcv_data[reqId]['high'],
-                        'Low': self.ohlcv_data[reqId]['low'],
-                        'Close': self.ohlcv_data[reqId]['close'],
-                        'Volume': float(self.ohlcv_data[reqId]['volume']),
-                        'Ticker': ticker
-                    }])
-
-                    self.real_time_data[ticker] = pd.concat([self.real_time_data[ticker], new_row], ignore_index=True)
-                    self.data_processor.data_ready_queue.put(self.real_time_data[ticker].iloc[-1])
-                    # self.data_processor.update_plot(contract=contract,
-                    #                                 interval_entry=self.data_processor.interval_entry,
-                    #                                 interval_exit=self.data_processor.interval_exit)
-
-
-                else:
-                    logger.warning(f"Contract not found for reqId: {reqId}")
-                    # print(f"Contract not found for reqId: {reqId}")
+            contract_info = self.reqId_info.get(reqId)
+            if contract_info:
+                self.on_last_price(contract_info['contract'].symbol, ts, price)
+            else:
+                logger.warning(f"Contract not found for reqId: {reqId}")
+                # print(f"Contract not found for reqId: {reqId}")
 
     def tickSize(self, reqId, tickType, size):
         # print(f"Tick Size for reqId {reqId}: {size}")
-        timestamp = datetime.now(pytz.timezone('America/New_York')).strftime('%Y-%m-%d %H:%M:%S')
-        # print(f'Tick Size. Ticker Id: {reqId}, tickType: {tickType}, Size: {size}, Timestamp: {timestamp}')
-        # logger.info(f'Tick Size. reqId: {reqId}, tickType: {tickType}, Size: {size}, Timestamp: {timestamp}')
+        # print(f'Tick Size. Ticker Id: {reqId}, tickType: {tickType}, Size: {size}')
+        # logger.info(f'Tick Size. reqId: {reqId}, tickType: {tickType}, Size: {size}')
+        ts = self.clock()
+        if self.tick_journal:
+            self.tick_journal.append(ts, reqId, tickType, NAN, float(size))
 
+        if tickType != 8:  # Only the cumulative day volume feeds the bars, last sizes stay in the journal
+            return
         contract_info = self.reqId_info.get(reqId)
         if contract_info:
-            contract = contract_info['contract']
-            ticker = contract.symbol
-            logger.info(f"Found contract {ticker} for reqId {reqId}")
-            # print(f"Found contract {ticker} for reqId {reqId}")
-
-            if tickType == 5:  # Volume
-                with self.lock:
-                    if reqId in self.ohlcv_data:
-                        self.ohlcv_data[reqId]['volume'] = size
-                    else:
-                        self.ohlcv_data[reqId] = {
-                            'timestamp': timestamp,
-                            'open': 0,
-                            'high': 0,
-                            'low': 0,
-                            'close': 0,
-                            'volume': size
-                        }
-
-                    if ticker not in self.real_time_data:
-                        self.real_time_data[ticker] = pd.DataFrame(
-                            columns=['Date', 'Open', 'High', 'Low', 'Close', 'Volume'])
-
-                    new_row = pd.DataFrame([{
-                        'Date': timestamp,
-                        'Open': self.ohlcv_data[reqId]['open'],
-                        'High': self.ohlcv_data[reqId]['high'],
-                        'Low': self.ohlcv_data[reqId]['low'],
-                        'Close': self.ohlcv_data[reqId]['close'],
-                        'Volume': float(self.ohlcv_data[reqId]['volume']),
-                        'Ticker': ticker
-                    }])
-
-                    self.real_time_data[ticker] = pd.concat([self.real_time_data[ticker], new_row], ignore_index=True)
-                    self.data_processor.data_ready_queue.put(self.real_time_data[ticker].iloc[-1])
-                    # logger.info(f"Appended real-time data size for {ticker}: {self.real_time_data[ticker].iloc[-1]}")
-                    # print(f"Appended real-time data size for {ticker}: {self.real_time_data[ticker].iloc[-1]}")
-                    # self.data_processor.update_plot(contract=contract,
-                    #                                 interval_entry=self.data_processor.interval_entry,
-                    #                                 interval_exit=self.data_processor.interval_exit)
+            self.on_volume(contract_info['contract'].symbol, ts, float(size))
         else:
             logger.warning(f"Contract not found for reqId: {reqId}")
             # print(f"Contract not found for reqId: {reqId}")
 
+    def on_last_price(self, ticker, ts, price):
+        # The bar builder emits one event per closed minute
+        self.bar_builder.add_price(ticker, ts, price)
+        if self.mark_dirty_on_ticks:
+            self.strategy_events.mark(ticker)
+
+    def on_volume(self, ticker, ts, cumulative):
+        # Cumulative day volume, bars take the change within their minute
+        self.bar_builder.add_volume(ticker, ts, cumulative)
+
+    def restore_ticks(self, day=None):
+        """
+        Replays the tick journal of `day` (today in exchange time by default) through the bar builder,
+        so a restart picks the day's bars back up. Only ticks of tickers registered in this session
+        are replayed. Returns how many were.
+        """
+        if not self.tick_journal:
+            return 0
+        day = pd.Timestamp(day) if day is not None else pd.Timestamp.now(tz='America/New_York').tz_localize(None)
+        reader = TickJournalReader.for_day(self.tick_journal.directory, day)
+        records = reader.records
+        restored = 0
+        for ts, ticker, tick_type, price, size in zip(records['ts_ns'].tolist(), reader.tickers(),
+                                                      records['tickType'].tolist(), records['price'].tolist(),
+                                                      records['size'].tolist()):
+            if ticker not in self.symbol_reqIds:
+                continue
+            if tick_type == 4:
+                self.on_last_price(ticker, ts, price)
+            elif tick_type == 8:
+                self.on_volume(ticker, ts, size)
+            else:
+                continue
+            restored += 1
+        logger.info(f"Restored {restored} of {len(reader)} journal ticks from {reader.path}")
+        return restored
+
+    def on_bar_closed(self, bar):
+        if self.stream_mode == 'realtime_bars':
+            self.store_streamed_bar(bar)
+        self.data_processor.data_ready_queue.put(bar)
+        self.strategy_events.mark(bar['Ticker'])
+
     def tickString(self, reqId, tickType, value):
         # Χρησιμοποίησε τον ib_api_logger για να κατευθύνεις τα tickString μηνύματα στο σωστό log file
         ib_api_logger.info(f"tickString received. reqId: {reqId}, tickType: {tickType}, value: {value}")
@@ -558,6 +776,7 @@ class IBApi(EClient, EWrapper):
     def position(self, account, contract, position, avgCost):
         """Αυτή η μέθοδος καλείται ασύγχρονα όταν λαμβάνεις μια θέση."""
         print(f"Received position: {contract.symbol}, {position} shares")
+        self.index_conId(contract)
         self.open_positions.append({
             'contract': contract,
             'position': position,
@@ -591,10 +810,7 @@ class IBApi(EClient, EWrapper):
             reqId = self.current_reqId
             self.current_reqId += 1
 
-        self.reqId_info[reqId] = {
-            'contract': contract,
-            'data_type': data_type
-        }
+        self.register_request(reqId, contract, data_type)
 
         logger.info(
             f"Created contract for symbol: {symbol}, secType: {sec_type}, exchange: {exchange}, currency: {currency}")
@@ -604,50 +820,81 @@ class IBApi(EClient, EWrapper):
     # def reset_reqId(self, start_value=1):
     #     self.current_reqId = start_value
 
+    def dirty_contracts(self, timeout=None):
+        """
+        Blocks until new data marked tickers dirty and returns them as [(contract, marked_at)], [] when
+        timeout seconds passed first and None once close_connection stopped the events.
+        """
+        dirty = self.strategy_events.wait(timeout)
+        if dirty is None:
+            return None
+        dirty_contracts = []
+        for ticker, marked_at in dirty.items():
+            contract = self.get_contract_for_symbol(ticker)
+            if contract:
+                dirty_contracts.append((contract, marked_at))
+            else:
+                logger.warning(f"No contract for dirty ticker {ticker}")
+        return dirty_contracts
+
+    def mark_all_dirty(self, contracts):
+        # Everything is computed once on start, after that only on new data
+        for contract_dict in contracts:
+            if contract_dict['contract']:
+                self.strategy_events.mark(contract_dict['contract'].symbol)
+            else:
+                logger.warning(f"Contract for reqId {contract_dict['reqId']} is not set.")
+
     def main_thread_function(self, interval_entry, interval_exit):
+        self.mark_all_dirty(self.contracts)
         while True:
-            if not self.data_processor.data_ready_queue.empty():
-                _ = self.data_processor.data_ready_queue.get()
-
-                for contract_dict in self.contracts:
-                    contract = contract_dict['contract']
-                    if contract:
-                        self.data_processor.update_plot(interval_entry=interval_entry,interval_exit=interval_exit, contract=contract)
-                    else:
-                        logger.warning(f"Contract for reqId {contract_dict['reqId']} is not set.")
-                        # print(f"Contract for reqId {contract_dict['reqId']} is not set.")
+            dirty = self.dirty_contracts()
+            if dirty is None:
+                break
+            for contract, marked_at in dirty:
+                self.data_processor.update_plot(interval_entry=interval_entry, interval_exit=interval_exit,
+                                                contract=contract)
+                self.strategy_events.done(contract.symbol, marked_at)
 
     def order_main_thread_function(self, data_processor, interval_entry, interval_exit, contracts, order_manager, decision_queue,
                                decision_flag):
         logger.info(f"Received contracts: {contracts}")
 
         # print(f"Received contracts: {contracts}")
+        self.mark_all_dirty(contracts)
         while True:
             logger.debug("Running order main thread function")
-            now = datetime.now(pytz.timezone('America/New_York'))
+            now = pd.Timestamp(self.clock(), tz='UTC').tz_convert('America/New_York').to_pydatetime()
             closing_time = now.replace(hour=15, minute=55, second=0, microsecond=0)
 
             if now >= closing_time:
                 logging.info("Market is closing soon. Closing open positions and cancelling unfilled orders.")
                 order_manager.close_open_positions_and_cancel_orders()
+
+            # Sleeps until a ticker has new data, waking at the closing time (and each minute after it) regardless
+            timeout = ((closing_time - now).total_seconds() if now < closing_time else 60) / self.clock_speed
+            dirty = self.dirty_contracts(timeout=timeout)
+            if dirty is None:
+                logger.info("Strategy events stopped, order main thread exiting")
+                break
             # print("Running order main thread function")
             combined_data_dict = {}
-            for contract_dict in contracts:
-                contract = contract_dict['contract']
-                if contract:
-                    symbol = contract.symbol
-                    df_entry, df_exit = data_processor.update_plot(interval_entry=interval_entry,
-                                                                   interval_exit=interval_exit, contract=contract)
-                    # if df_entry.empty or df_exit.empty:
-                    #     logger.warning(f"Entry or Exit data for {symbol} is empty.")
-                    #     # print(f"Warning: Entry or Exit data for {symbol} is empty.")
-                    # else:
-                    #     logger.info(f"Data for {symbol} looks valid with {len(df_entry)} entry records and {len(df_exit)} exit records.")
-                    #     # print(
-                    #     #     f"Data for {symbol} looks valid with {len(df_entry)} entry records and {len(df_exit)} exit records.")
-                    combined_data_dict[symbol] = {'entry': df_entry, 'exit': df_exit}
-                else:
-                    print(f"Contract for reqId {contract_dict['reqId']} is not set.")
+            for contract, marked_at in dirty:
+                symbol = contract.symbol
+                result = data_processor.update_plot(interval_entry=interval_entry, interval_exit=interval_exit,
+                                                    contract=contract)
+                if result is None:
+                    self.strategy_events.done(symbol, marked_at)
+                    continue
+                df_entry, df_exit = result
+                # if df_entry.empty or df_exit.empty:
+                #     logger.warning(f"Entry or Exit data for {symbol} is empty.")
+                #     # print(f"Warning: Entry or Exit data for {symbol} is empty.")
+                # else:
+                #     logger.info(f"Data for {symbol} looks valid with {len(df_entry)} entry records and {len(df_exit)} exit records.")
+                #     # print(
+                #     #     f"Data for {symbol} looks valid with {len(df_entry)} entry records and {len(df_exit)} exit records.")
+                combined_data_dict[symbol] = {'entry': df_entry, 'exit': df_exit, 'marked_at': marked_at}
 
             if combined_data_dict:
                 print("Checking comb data dict")
@@ -668,6 +915,7 @@ class IBApi(EClient, EWrapper):
                         logger.error(f"Error: Invalid data type for {symbol}. Entry: {type(data['entry'])}, Exit: {type(data['exit'])}")
                         # print(
                         #     f"Error: Invalid data type for {symbol}. Entry: {type(data['entry'])}, Exit: {type(data['exit'])}")
+                    self.strategy_events.done(symbol, data['marked_at'])
                 logger.warning("No data to process signals.")
                 # print("No data to process signals.")
 
@@ -683,4 +931,12 @@ class IBApi(EClient, EWrapper):
     def close_connection(self):
         logger.info("Closing connection to IB API")
         self.disconnect() #Closes conn with IB API
+        self.bar_builder.stop_clock()
+        self.strategy_events.stop()
+        if self.tick_journal:
+            self.tick_journal.close()
+        for reqId in list(self.bar_buffers):
+            self.flush_bar_buffer(reqId)
+        if self.write_queue:
+            self.write_queue.close()
         self.db.db_close_connection()
@@ -6,11 +6,13 @@ import time
 # import schedule
 import api_helper
 
+from backfill import BackfillScheduler, plan_backfills
 from globals import decision_queue
 from ib_api import IBApi
 from data_processing import DataProcessor
 from database import Database
 from order_manager import OrderManager
+from write_behind import WriteBehindQueue
 import logging
 
 
@@ -133,7 +135,8 @@ def run_order_script():
     stop_flag = threading.Event()
     decision_flag = threading.Event()
     db = Database()
-    app = IBApi(data_processor=None, db=db)
+    write_queue = WriteBehindQueue(db).start()
+    app = IBApi(data_processor=None, db=db, write_queue=write_queue)
     data_processor = DataProcessor(db, app)
     app.data_processor = data_processor
     order_manager = OrderManager(api_helper)
@@ -176,6 +179,10 @@ def run_order_script():
         logger.error("No tickers found for today's date.")
         return
 
+    # What minute_data lacks for the whole universe, from one last-date query and one coverage query
+    plans = plan_backfills(db, [ticker_entry[0] for ticker_entry in tickers])
+    app.backfill = BackfillScheduler(app)
+
     for ticker_entry in tickers:
         symbol = ticker_entry[0]
         print(f"Ticker entry: {ticker_entry}")
@@ -227,16 +234,13 @@ def run_order_script():
             logger.debug(f"{idx}: reqId={contract_entry['reqId']}, contract={contract_entry['contract']}")
 
         order_manager.initialize_contract(symbol)
-        app.data_download_complete = False
-        logger.info(f"Starting data download for {symbol}")
-        app.update_minute_data_for_symbol(contract)
+        logger.info(f"Queueing data download for {symbol}")
+        app.update_minute_data_for_symbol(contract, plans.get(symbol))
 
-        while not app.data_download_complete:
-            # print("Waiting for data download to complete...")
-            logger.debug("Waiting for data download to complete...")
-            time.sleep(5)
-        print(f"Data download for {symbol} is complete.")
-    logger.info("All tickers processed.")
+    # The downloads run several at a time within IB's pacing limits, each one tracked by its reqId
+    progress = app.backfill.run()
+    app.backfill = None
+    logger.info(f"All tickers processed: {progress}")
     print("All tickers processed.")
 
     # add_another = input("Do you want to add another contract? (yes/no): ").strip().lower()
@@ -279,6 +283,9 @@ def run_order_script():
     # print(f"Length of contracts: {len(app.contracts)}")
 
     # print("Requesting real time data")
+    # After a restart today's journaled ticks rebuild the 1-minute bars before the live feed resumes
+    app.restore_ticks()
+
     logger.info("Requesting real-time data for all contracts...")
     for contract_dict in app.contracts:
         contract = contract_dict['contract']
@@ -292,14 +299,7 @@ def run_order_script():
         if req_id_for_rt is not None:
             logger.info(f"Requesting real-time data for {contract.symbol} with req_id: {req_id_for_rt}")
             print(f"Requesting real-time data for {contract.symbol} with req_id: {req_id_for_rt}")
-            app.reqMktData(
-                req_id_for_rt,
-                contract,
-                "",
-                False,
-                False,
-                []
-            )
+            app.subscribe_real_time(contract, req_id_for_rt)
         else:
             logger.error(f"Failed to obtain request ID for the contract {contract.symbol}")
             print(f"Failed to obtain request ID for the contract {contract.symbol}")
@@ -331,6 +331,7 @@ def run_order_script():
 
             logger.debug(f"Decision thread status: {decision_thread.is_alive()}")
             logger.debug(f"Main thread status: {main_thread.is_alive()}")
+            logger.info(f"Strategy latency: {app.strategy_events.latency_stats()}")
             print(f"Decision thread status: {decision_thread.is_alive()}")
             print(f"Main thread status: {main_thread.is_alive()}")
     except KeyboardInterrupt:
@@ -27,6 +27,8 @@ class OrderManager:
         self.active_positions = []
         self.lock = threading.Lock()
         self.api_helper = api_helper
+        # Naive exchange-time datetime source, FakeGateway sets its simulated clock; None is the wall clock
+        self.clock = None
 
     def set_order_outside_rth(self):
         while True:
@@ -312,7 +314,7 @@ class OrderManager:
                 logger.info(f"Handling decision: {signal}")
                 print(f"Handling decision: {signal}")
 
-                contract = next((c['contract'] for c in app.contracts if c['contract'].symbol == contract_symbol), None)
+                contract = app.get_contract_for_symbol(contract_symbol)
                 if contract is None:
                     logger.error(f"Contract not found for symbol: {contract_symbol}")
                     print(f"Contract not found for symbol: {contract_symbol}")
@@ -460,7 +462,7 @@ class OrderManager:
 
         # Set up timezone for Eastern Time (New York)
         est = pytz.timezone('America/New_York')
-        now = datetime.now(est)
+        now = est.localize(self.clock()) if self.clock else datetime.now(est)
 
         # Market open time (9:30 AM) and market close time (4:00 PM)
         market_open_time_naive = datetime(now.year, now.month, now.day, 9, 30)
@@ -479,7 +481,9 @@ class OrderManager:
             wait_minutes = wait_seconds / 60
             logging.info(f"Waiting for {wait_minutes:.2f} minutes until 10 minutes after market open...")
             print(f"Waiting for {wait_minutes:.2f} minutes until 10 minutes after market open...")
-            sleep(wait_seconds)
+            if not self.clock:
+                # Simulated time does not pass while this thread sleeps
+                sleep(wait_seconds)
             return False
 
         # elif now >= closing_time_est:
@@ -0,0 +1,295 @@
+import argparse
+import os
+from datetime import date, datetime
+from sqlalchemy import text
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.FileHandler("ib_api.log")]
+)
+
+BAR_TABLES = {
+    'minute_data': 'date_time',
+    'daily_data': 'date',
+}
+PARTITIONED_TABLES = {'minute_data'}
+MONTHS_AHEAD = 3
+
+MYSQL_TICKER = "VARCHAR(16) CHARACTER SET ascii COLLATE ascii_bin NOT NULL"
+
+
+def month_start(day, months=0):
+    month = day.year * 12 + day.month - 1 + months
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def partition_start():
+    # Bars older than this month share one partition, set it to the oldest month that is queried often
+    value = os.getenv('STOCKDATADB_PARTITION_START')
+    if value:
+        return month_start(date.fromisoformat(value))
+    return month_start(date.today(), -24)
+
+
+def _partition_name(month):
+    return f"p{month:%Y%m}"
+
+
+def partition_clause(date_col, first_month, last_month):
+    partitions = [f"PARTITION p_old VALUES LESS THAN ('{first_month:%Y-%m-%d}')"]
+    month = first_month
+    while month <= last_month:
+        partitions.append(f"PARTITION {_partition_name(month)} VALUES LESS THAN ('{month_start(month, 1):%Y-%m-%d}')")
+        month = month_start(month, 1)
+    partitions.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+    return f"PARTITION BY RANGE COLUMNS({date_col}) (\n    " + ",\n    ".join(partitions) + "\n)"
+
+
+def bar_table_ddl(dialect, table_name, date_col, created_name=None):
+    """
+    Bars are clustered on (ticker, date) so a ticker's range is one contiguous primary key scan.
+    MySQL stores prices as DECIMAL(12,4) and volume as BIGINT, and minute_data is range partitioned
+    by month so date filters only open the partitions they cover.
+    """
+    name = created_name or table_name
+    date_type = 'DATETIME' if date_col == 'date_time' else 'DATE'
+    if dialect == 'sqlite':
+        return f"""
+            CREATE TABLE IF NOT EXISTS {name} (
+                ticker VARCHAR(16) NOT NULL,
+                {date_col} {date_type} NOT NULL,
+                open FLOAT, high FLOAT, low FLOAT, close FLOAT, volume INTEGER,
+                PRIMARY KEY (ticker, {date_col})
+            ) WITHOUT ROWID
+        """
+
+    ddl = f"""
+        CREATE TABLE IF NOT EXISTS {name} (
+            ticker {MYSQL_TICKER},
+            {date_col} {date_type} NOT NULL,
+            open DECIMAL(12, 4),
+            high DECIMAL(12, 4),
+            low DECIMAL(12, 4),
+            close DECIMAL(12, 4),
+            volume BIGINT,
+            PRIMARY KEY (ticker, {date_col})
+        ) ENGINE=InnoDB
+    """
+    if table_name in PARTITIONED_TABLES:
+        first = partition_start()
+        ddl += partition_clause(date_col, first, month_start(date.today(), MONTHS_AHEAD))
+    return ddl
+
+
+def table_ddl(dialect):
+    if dialect == 'sqlite':
+        statements = [
+            "CREATE TABLE IF NOT EXISTS companies (ticker VARCHAR(16) PRIMARY KEY)",
+            """
+            CREATE TABLE IF NOT EXISTS daily_tickers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ticker VARCHAR(16) NOT NULL,
+                date DATE NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS ix_daily_tickers_date ON daily_tickers (date)",
+        ]
+    else:
+        statements = [
+            f"CREATE TABLE IF NOT EXISTS companies (ticker {MYSQL_TICKER}, PRIMARY KEY (ticker)) ENGINE=InnoDB",
+            f"""
+            CREATE TABLE IF NOT EXISTS daily_tickers (
+                id INT UNSIGNED NOT NULL AUTO_INCREMENT,
+                ticker {MYSQL_TICKER},
+                date DATE NOT NULL,
+                PRIMARY KEY (id),
+                KEY ix_daily_tickers_date (date)
+            ) ENGINE=InnoDB
+            """,
+        ]
+    return statements + [bar_table_ddl(dialect, table_name, date_col) for table_name, date_col in BAR_TABLES.items()]
+
+
+def create_tables(engine):
+    # CREATE IF NOT EXISTS only, tables created with an older layout are left to migrate_table
+    with engine.begin() as connection:
+        for statement in table_ddl(engine.dialect.name):
+            connection.execute(text(statement))
+    if engine.dialect.name == 'mysql':
+        ensure_partitions(engine)
+    logger.info(f"Schema checked on {engine.dialect.name}")
+
+
+def list_partitions(connection, table_name):
+    result = connection.execute(text("""
+        SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """), {'table_name': table_name})
+    return [(row[0], row[1]) for row in result]
+
+
+def ensure_partitions(engine, table_name='minute_data', months_ahead=MONTHS_AHEAD):
+    """
+    Splits the MAXVALUE partition so monthly partitions exist up to months_ahead from today.
+    Run it from a scheduled job (`python schema.py` does it); returns the partitions added.
+    """
+    if engine.dialect.name != 'mysql':
+        return []
+    date_col = BAR_TABLES[table_name]
+    with engine.begin() as connection:
+        partitions = list_partitions(connection, table_name)
+        names = [name for name, _ in partitions]
+        if 'pmax' not in names:
+            logger.warning(f"{table_name} is not range partitioned, run migrate_table() to partition it")
+            return []
+        monthly = sorted(name for name in names if name not in ('p_old', 'pmax'))
+        if monthly:
+            last = datetime.strptime(monthly[-1][1:], '%Y%m').date()
+            month = month_start(last, 1)
+        else:
+            month = partition_start()
+        target = month_start(date.today(), months_ahead)
+
+        added = []
+        while month <= target:
+            added.append(f"PARTITION {_partition_name(month)} VALUES LESS THAN ('{month_start(month, 1):%Y-%m-%d}')")
+            month = month_start(month, 1)
+        if added:
+            connection.execute(text(f"""
+                ALTER TABLE {table_name} REORGANIZE PARTITION pmax INTO (
+                    {', '.join(added)}, PARTITION pmax VALUES LESS THAN (MAXVALUE)
+                )
+            """))
+            logger.info(f"Added {len(added)} monthly partitions to {table_name} ({date_col})")
+    return added
+
+
+def drop_partitions_before(engine, table_name, cutoff):
+    # Drops the monthly partitions (and p_old) below cutoff that hold no rows any more, MySQL only
+    if engine.dialect.name != 'mysql':
+        return []
+    cutoff = cutoff.strftime('%Y-%m-%d')
+    with engine.begin() as connection:
+        expired = [name for name, bound in list_partitions(connection, table_name)
+                   if bound != 'MAXVALUE' and bound.strip("'")[:10] <= cutoff]
+        expired = [name for name in expired if connection.execute(
+            text(f"SELECT 1 FROM {table_name} PARTITION ({name}) LIMIT 1")).first() is None]
+        if expired:
+            connection.execute(text(f"ALTER TABLE {table_name} DROP PARTITION {', '.join(expired)}"))
+            logger.info(f"Dropped partitions {expired} from {table_name}")
+    return expired
+
+
+def migrate_table(engine, table_name):
+    """
+    Rebuilds a bar table created with the old id-keyed layout into the managed layout: copies the
+    bars ticker by ticker (first row wins on duplicates), then swaps the tables, leaving the old
+    one as <table>_old. MySQL only.
+    """
+    if engine.dialect.name != 'mysql':
+        raise ValueError("migrate_table only supports MySQL")
+    date_col = BAR_TABLES[table_name]
+    new_name = f"{table_name}_new"
+    columns = f"ticker, {date_col}, open, high, low, close, volume"
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP TABLE IF EXISTS {new_name}"))
+        connection.execute(text(bar_table_ddl('mysql', table_name, date_col, created_name=new_name)))
+        tickers = [row[0] for row in connection.execute(text(f"SELECT DISTINCT ticker FROM {table_name}"))]
+
+    copied = 0
+    for ticker in tickers:
+        with engine.begin() as connection:
+            result = connection.execute(text(f"""
+                INSERT IGNORE INTO {new_name} ({columns})
+                SELECT {columns} FROM {table_name} WHERE ticker = :ticker ORDER BY {date_col}
+            """), {'ticker': ticker})
+            copied += result.rowcount
+        logger.info(f"Copied {ticker} into {new_name}, {copied} rows so far")
+
+    with engine.begin() as connection:
+        connection.execute(text(f"RENAME TABLE {table_name} TO {table_name}_old, {new_name} TO {table_name}"))
+    logger.info(f"Migrated {table_name}: {copied} rows for {len(tickers)} tickers, old table kept as {table_name}_old")
+    print(f"Migrated {table_name}: {copied} rows for {len(tickers)} tickers, old table kept as {table_name}_old")
+    return copied
+
+
+def explain(connection, stmt, params):
+    # Compiled against the live dialect so the plan is for the exact SQL Database sends
+    dialect = connection.dialect
+    state = stmt.compile(dialect=dialect).construct_expanded_state(params)
+    values = state.positional_parameters if dialect.positional else state.parameters
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect.name == 'sqlite' else 'EXPLAIN '
+    return [dict(row) for row in connection.exec_driver_sql(prefix + state.statement, values).mappings()]
+
+
+def plan_warnings(dialect_name, plan, ranged=False, partition_count=0):
+    warnings = []
+    for step in plan:
+        if dialect_name == 'sqlite':
+            detail = step.get('detail', '')
+            if detail.startswith('SCAN ') and 'CONSTANT ROW' not in detail:
+                warnings.append(f"full scan: {detail}")
+            continue
+
+        table_name = step.get('table')
+        access = (step.get('type') or '').upper()
+        if access in ('ALL', 'INDEX'):
+            warnings.append(f"full {'table' if access == 'ALL' else 'index'} scan on {table_name} "
+                            f"(~{step.get('rows')} rows, key={step.get('key')})")
+        partitions = step.get('partitions')
+        if ranged and partition_count > 1 and partitions and len(partitions.split(',')) >= partition_count:
+            warnings.append(f"no partition pruning on {table_name}, all {partition_count} partitions read")
+    return warnings
+
+
+def check_query_plans(db, ticker=None):
+    """
+    EXPLAINs the hot queries Database issues (see Database.hot_queries) and logs a warning for each
+    full scan or unpruned partitioned read. Returns {query name: [warnings]}.
+    """
+    dialect_name = db.engine.dialect.name
+    report = {}
+    with db.engine.connect() as connection:
+        partition_count = len(list_partitions(connection, 'minute_data')) if dialect_name == 'mysql' else 0
+        for name, (stmt, params, ranged) in db.hot_queries(ticker).items():
+            try:
+                plan = explain(connection, stmt, params)
+            except Exception as e:
+                logger.error(f"Could not EXPLAIN {name}: {e}")
+                report[name] = [f"EXPLAIN failed: {e}"]
+                continue
+            report[name] = plan_warnings(dialect_name, plan, ranged, partition_count)
+            for warning in report[name]:
+                logger.warning(f"Query plan check, {name}: {warning}")
+                print(f"Query plan check, {name}: {warning}")
+    if not any(report.values()):
+        logger.info(f"Query plan check passed for {len(report)} queries")
+    return report
+
+
+if __name__ == "__main__":
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Create the tables and add the upcoming monthly partitions of the "
+                                                 "configured database. Run on deploy and monthly.")
+    parser.add_argument('--migrate-table', choices=list(BAR_TABLES),
+                        help="Rebuild a bar table created with the old id-keyed layout (MySQL only)")
+    parser.add_argument('--unique-keys', action='store_true', help="Add the unique bar keys upsert mode needs")
+    parser.add_argument('--check-plans', action='store_true', help="EXPLAIN the hot queries afterwards")
+    args = parser.parse_args()
+
+    database = Database()
+    try:
+        if args.migrate_table:
+            migrate_table(database.engine, args.migrate_table)
+        database.create_schema()
+        if args.unique_keys:
+            database.ensure_unique_keys()
+        if args.check_plans:
+            database.check_query_plans()
+    finally:
+        database.db_close_connection()
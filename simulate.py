@@ -0,0 +1,131 @@
+import argparse
+import os
+import tempfile
+import threading
+
+import pandas as pd
+
+import api_helper
+from archive import BarArchive
+from backfill import BackfillScheduler
+from data_processing import DataProcessor
+from database import Database
+from fake_gateway import FakeGateway
+from globals import decision_queue
+from tick_journal import TickJournalReader
+from ib_api import IBApi
+from order_manager import OrderManager
+from storage_backends import SQLiteBackend
+from write_behind import WriteBehindQueue
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.FileHandler("ib_api.log")]
+)
+logger.handlers = [h for h in logger.handlers if not isinstance(h, logging.StreamHandler)]
+
+
+def load_gateway(db, tickers, start, lookback_days, synthetic=False, journal_dir=None):
+    # The stored bars from lookback_days before start on, so history requests are answered from them too,
+    # and the journaled ticks of start's day
+    ticks = TickJournalReader.for_day(journal_dir, pd.Timestamp(start).normalize()).to_frame() if journal_dir else None
+    if synthetic:
+        return FakeGateway(ticks=ticks, now=start)
+    first = pd.Timestamp(start) - pd.Timedelta(days=lookback_days)
+    frames = [db.fetch_data_from_db('minute_data', f"{first:%Y-%m-%d %H:%M:%S}",
+                                    f"{pd.Timestamp.now():%Y-%m-%d %H:%M:%S}", ticker=ticker) for ticker in tickers]
+    frames = [frame for frame in frames if frame is not None and not frame.empty]
+    bars = pd.concat(frames, ignore_index=True) if frames else None
+    return FakeGateway(bars=bars, ticks=ticks, now=start)
+
+
+def scratch_database(path=None):
+    # A migrated SQLite file for the bars the simulation writes, a new one in a temp directory by default
+    directory = os.path.dirname(os.path.abspath(path)) if path else tempfile.mkdtemp(prefix='simulate-')
+    db = Database(backend=SQLiteBackend(path or os.path.join(directory, 'simulate.sqlite')),
+                  archive=BarArchive(root=os.path.join(directory, 'simulate_archive')))
+    db.create_schema()
+    logger.info(f"Simulation writes to {db.backend.path}")
+    print(f"Simulation writes to {db.backend.path}")
+    return db
+
+
+def run_simulation(tickers, start, minutes=None, speed=60.0, history_days=2, synthetic=False, stream_mode=None,
+                   interval_entry='5min', interval_exit='1min', journal_dir=None, db=None, source_db=None):
+    """
+    Runs IBApi, DataProcessor and OrderManager as run_order_script wires them, against a FakeGateway
+    replaying minute_data from source_db (the configured database by default) or a synthetic walk,
+    and the tick journal in journal_dir if given, from `start` at `speed` times real time. Everything
+    the app writes goes to db, a scratch SQLite database unless one is passed, never the source.
+    """
+    db = db or scratch_database()
+    if not synthetic:
+        source_db = source_db or Database()
+    gateway = load_gateway(source_db, tickers, start, history_days + 1, synthetic, journal_dir)
+    write_queue = WriteBehindQueue(db).start()
+    app = IBApi(data_processor=None, db=db, write_queue=write_queue, stream_mode=stream_mode)
+    data_processor = DataProcessor(db, app)
+    app.data_processor = data_processor
+    order_manager = OrderManager(api_helper)
+    data_processor.order_manager = order_manager
+    gateway.attach(app)
+    app.connect()
+    threading.Thread(target=app.run, name="fake-gateway-reader", daemon=True).start()
+
+    app.backfill = BackfillScheduler(app)
+    for symbol in tickers:
+        contract = app.create_contract(symbol, "STK", "SMART", "USD", "minute")
+        req_id = app.get_reqId_for_contract(contract)
+        app.contracts.append({'reqId': req_id, 'contract': contract})
+        order_manager.initialize_contract(symbol)
+        app.backfill.submit(req_id, app.historical_request(req_id, contract, f"{history_days} D"))
+    progress = app.backfill.run()
+    app.backfill = None
+    logger.info(f"Simulation history loaded: {progress}")
+
+    for contract_dict in app.contracts:
+        app.subscribe_real_time(contract_dict['contract'], contract_dict['reqId'])
+
+    decision_flag = threading.Event()
+    main_thread = threading.Thread(target=app.order_main_thread_function, args=(
+        data_processor, interval_entry, interval_exit, app.contracts, order_manager, decision_queue, decision_flag))
+    main_thread.start()
+    threading.Thread(target=order_manager.handle_decision, args=(app, decision_queue, decision_flag),
+                     daemon=True).start()
+
+    try:
+        played = gateway.play(speed=speed, minutes=minutes)
+        logger.info(f"Simulation played {played} minutes from {start}")
+    except KeyboardInterrupt:
+        logger.warning("Simulation interrupted by user")
+    finally:
+        app.close_connection()
+        main_thread.join()
+
+    strategy_stats = app.strategy_events.latency_stats()
+    stats = dict(gateway.stats(), **{f"strategy_{key}": value for key, value in strategy_stats.items()})
+    logger.info(f"Simulation stats: {stats}")
+    print(f"Simulation stats: {stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the trading app against a fake gateway replaying stored bars")
+    parser.add_argument('tickers', nargs='+')
+    parser.add_argument('--start', required=True, help="Exchange time to start replaying from, e.g. '2024-08-27 09:30'")
+    parser.add_argument('--minutes', type=int, default=None, help="Minutes to play, default to the end of the data")
+    parser.add_argument('--speed', type=float, default=60.0, help="Times real time, 1 to 1000")
+    parser.add_argument('--history-days', type=int, default=2, help="Days of bars downloaded before start")
+    parser.add_argument('--synthetic', action='store_true', help="Replay a random walk instead of minute_data")
+    parser.add_argument('--stream-mode', default=None, choices=['ticks', 'realtime_bars', 'keep_up_to_date'])
+    parser.add_argument('--journal', default=None, help="Tick journal directory to replay market data ticks from")
+    parser.add_argument('--database', default=None,
+                        help="SQLite file the simulation writes to, a new temp file by default. The configured "
+                             "STOCKDATADB_* database is only read, for the bars replayed")
+    args = parser.parse_args()
+
+    run_simulation(args.tickers, args.start, args.minutes, args.speed, args.history_days, args.synthetic,
+                   args.stream_mode, journal_dir=args.journal, db=scratch_database(args.database))
@@ -0,0 +1,236 @@
+import os
+import tempfile
+from datetime import date, datetime
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import DBAPIError
+import logging
+
+import schema
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.FileHandler("ib_api.log")]
+)
+
+VALUE_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+
+class StorageBackend:
+    """
+    Everything Database needs that differs between database servers: how to connect, how to
+    upsert, how to migrate to unique bar keys and how to create the schema.
+    """
+    name = None
+
+    def create_engine(self, pool_size, max_overflow, pool_recycle):
+        raise NotImplementedError
+
+    def upsert_statement(self, table_name, date_col, on_conflict):
+        raise NotImplementedError
+
+    def add_unique_key(self, connection, table_name, date_col, key_name):
+        # Removes duplicate bars (keeping the oldest) and adds the key, returns the rows removed
+        raise NotImplementedError
+
+    def create_schema(self, engine):
+        raise NotImplementedError
+
+    def bulk_load(self, connection, table_name, date_col, bars, on_conflict):
+        # bars: DataFrame with ticker, <date_col> (datetime64) and the value columns, returns the rows sent
+        frame = bars.assign(**{date_col: self._format_dates(bars[date_col], date_col)})
+        connection.execute(self.upsert_statement(table_name, date_col, on_conflict), frame.to_dict('records'))
+        return len(frame)
+
+    def delete_range(self, connection, table_name, date_col, ticker, start, end):
+        # One ticker's rows with start <= date < end, in the caller's transaction; returns the rows deleted
+        result = connection.execute(text(f"""
+            DELETE FROM {table_name} WHERE ticker = :ticker AND {date_col} >= :start AND {date_col} < :end
+        """), {'ticker': ticker, 'start': start, 'end': end})
+        return result.rowcount
+
+    @staticmethod
+    def _format_dates(dates, date_col):
+        return dates.dt.strftime('%Y-%m-%d' if date_col == 'date' else '%Y-%m-%d %H:%M:%S')
+
+    @staticmethod
+    def _columns(date_col):
+        columns = ['ticker', date_col] + VALUE_COLUMNS
+        return ', '.join(columns), ', '.join(f":{col}" for col in columns)
+
+
+class MySQLBackend(StorageBackend):
+    name = 'mysql'
+
+    def __init__(self, user=None, password=None, host=None, database=None):
+        self.user = user or os.getenv('STOCKDATADB_UN')
+        self.password = password or os.getenv('STOCKDATADB_PASS')
+        # self.host = "100.64.0.21"
+        self.host = host or os.getenv('STOCKDATADB_HOST', 'localhost')
+        self.database = database or os.getenv('STOCKDATADB_NAME', 'stockdatadb')
+        # Cleared after the server refuses LOAD DATA LOCAL INFILE once (local_infile=OFF)
+        self.local_infile = os.getenv('STOCKDATADB_LOCAL_INFILE', '1') == '1'
+
+    def create_engine(self, pool_size, max_overflow, pool_recycle):
+        connection_string = f"mysql+mysqlconnector://{self.user}:{self.password}@{self.host}/{self.database}"
+        return create_engine(
+            connection_string,
+            connect_args={'connect_timeout': 28800, 'allow_local_infile': self.local_infile},
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_pre_ping=True,
+            pool_recycle=pool_recycle
+        )
+
+    def upsert_statement(self, table_name, date_col, on_conflict):
+        column_list, values_list = self._columns(date_col)
+        if on_conflict == 'ignore':
+            return text(f"INSERT IGNORE INTO {table_name} ({column_list}) VALUES ({values_list})")
+        updates = ', '.join(f"{col} = VALUES({col})" for col in VALUE_COLUMNS)
+        return text(f"INSERT INTO {table_name} ({column_list}) VALUES ({values_list}) "
+                    f"ON DUPLICATE KEY UPDATE {updates}")
+
+    def add_unique_key(self, connection, table_name, date_col, key_name):
+        result = connection.execute(text(f"""
+            DELETE t1 FROM {table_name} t1
+            JOIN {table_name} t2
+              ON t1.ticker = t2.ticker AND t1.{date_col} = t2.{date_col} AND t1.id > t2.id
+        """))
+        connection.execute(text(f"ALTER TABLE {table_name} ADD UNIQUE KEY {key_name} (ticker, {date_col})"))
+        return result.rowcount
+
+    def bulk_load(self, connection, table_name, date_col, bars, on_conflict):
+        if self.local_infile:
+            try:
+                return self._load_data_infile(connection, table_name, date_col, bars, on_conflict)
+            except DBAPIError as e:
+                logger.warning(f"LOAD DATA LOCAL INFILE failed ({e.orig}), falling back to batched INSERTs")
+                print(f"LOAD DATA LOCAL INFILE failed ({e.orig}), falling back to batched INSERTs")
+                self.local_infile = False
+        # mysql-connector rewrites the executemany into multi-row INSERT statements
+        return super().bulk_load(connection, table_name, date_col, bars, on_conflict)
+
+    def _load_data_infile(self, connection, table_name, date_col, bars, on_conflict):
+        # mysql-connector only loads LOCAL INFILE from a path, so the CSV goes through a temp file.
+        # REPLACE deletes and re-inserts a colliding bar, which is the 'update' policy for bar rows.
+        frame = bars.assign(**{date_col: self._format_dates(bars[date_col], date_col)})
+        handle = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, newline='')
+        try:
+            with handle:
+                frame.to_csv(handle, header=False, index=False, na_rep='\\N', lineterminator='\n')
+            keyword = 'IGNORE' if on_conflict == 'ignore' else 'REPLACE'
+            column_list, _ = self._columns(date_col)
+            path = handle.name.replace('\\', '/')
+            connection.execute(text(f"""
+                LOAD DATA LOCAL INFILE '{path}' {keyword} INTO TABLE {table_name}
+                FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' LINES TERMINATED BY '\\n'
+                ({column_list})
+            """))
+            return len(frame)
+        finally:
+            os.remove(handle.name)
+
+    def create_schema(self, engine):
+        # Creates missing tables with the managed layout and adds upcoming monthly partitions,
+        # existing tables are left as they are (see schema.migrate_table)
+        schema.create_tables(engine)
+
+
+class SQLiteBackend(StorageBackend):
+    name = 'sqlite'
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('STOCKDATADB_PATH', 'stockdatadb.sqlite')
+
+    def create_engine(self, pool_size, max_overflow, pool_recycle):
+        engine = create_engine(
+            f"sqlite:///{self.path}",
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_pre_ping=True,
+            pool_recycle=pool_recycle
+        )
+
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            # WAL lets the strategy thread read while the writer threads commit
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute("PRAGMA busy_timeout=5000")
+            cursor.close()
+
+        @event.listens_for(engine, "before_cursor_execute", retval=True)
+        def bind_dates(connection, cursor, statement, parameters, context, executemany):
+            if executemany:
+                return statement, [self._bind_dates(params) for params in parameters]
+            return statement, self._bind_dates(parameters)
+
+        return engine
+
+    @staticmethod
+    def _sqlite_date(value):
+        # Dates are stored the way MySQL prints them, so string comparisons in SQLite order correctly
+        if isinstance(value, datetime):
+            return value.replace(tzinfo=None).isoformat(' ')
+        if isinstance(value, date):
+            return value.isoformat()
+        return value
+
+    def _bind_dates(self, params):
+        # Only this engine's statements, the sqlite3 module's adapters stay as they are for everyone else
+        if isinstance(params, dict):
+            return {key: self._sqlite_date(value) for key, value in params.items()}
+        return tuple(self._sqlite_date(value) for value in params) if params else params
+
+    def upsert_statement(self, table_name, date_col, on_conflict):
+        column_list, values_list = self._columns(date_col)
+        if on_conflict == 'ignore':
+            return text(f"INSERT OR IGNORE INTO {table_name} ({column_list}) VALUES ({values_list})")
+        updates = ', '.join(f"{col} = excluded.{col}" for col in VALUE_COLUMNS)
+        return text(f"INSERT INTO {table_name} ({column_list}) VALUES ({values_list}) "
+                    f"ON CONFLICT(ticker, {date_col}) DO UPDATE SET {updates}")
+
+    def add_unique_key(self, connection, table_name, date_col, key_name):
+        result = connection.execute(text(f"""
+            DELETE FROM {table_name} WHERE rowid NOT IN (
+                SELECT MIN(rowid) FROM {table_name} GROUP BY ticker, {date_col}
+            )
+        """))
+        connection.execute(text(f"CREATE UNIQUE INDEX {key_name} ON {table_name} (ticker, {date_col})"))
+        return result.rowcount
+
+    def bulk_load(self, connection, table_name, date_col, bars, on_conflict):
+        # Straight to the sqlite3 cursor with positional tuples, skipping per-row dict binding
+        column_list, _ = self._columns(date_col)
+        placeholders = ', '.join('?' for _ in column_list.split(', '))
+        if on_conflict == 'ignore':
+            sql = f"INSERT OR IGNORE INTO {table_name} ({column_list}) VALUES ({placeholders})"
+        else:
+            sql = f"INSERT OR REPLACE INTO {table_name} ({column_list}) VALUES ({placeholders})"
+        dates = self._format_dates(bars[date_col], date_col)
+        values = [bars[col].astype(float).tolist() for col in VALUE_COLUMNS]
+        cursor = connection.connection.driver_connection.cursor()
+        try:
+            cursor.executemany(sql, zip(bars['ticker'].tolist(), dates.tolist(), *values))
+        finally:
+            cursor.close()
+        return len(bars)
+
+    def create_schema(self, engine):
+        schema.create_tables(engine)
+        logger.info(f"SQLite schema ready at {self.path}")
+
+
+BACKENDS = {
+    MySQLBackend.name: MySQLBackend,
+    SQLiteBackend.name: SQLiteBackend,
+}
+
+
+def get_backend(name=None, **kwargs):
+    name = name or os.getenv('STOCKDATADB_BACKEND', 'mysql')
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown storage backend {name}, expected one of {list(BACKENDS)}")
+    return BACKENDS[name](**kwargs)
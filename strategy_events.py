@@ -0,0 +1,78 @@
+import threading
+from collections import deque
+from time import time_ns
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.FileHandler("ib_api.log")]
+)
+logger.handlers = [h for h in logger.handlers if not isinstance(h, logging.StreamHandler)]
+
+NANOS_PER_MILLISECOND = 1_000_000
+
+
+class DirtyTickers:
+    """
+    Tickers with new data the strategy has not looked at yet. Bar closes (and ticks, if wanted) call
+    mark(); the strategy loop blocks in wait() until something is marked and then recomputes just
+    those tickers. A ticker marked again before it was recomputed is only recomputed once, and
+    latency is measured from its first unhandled mark to done().
+    """
+
+    def __init__(self, latency_samples=1000):
+        self.condition = threading.Condition()
+        self.dirty = {}
+        self.stopped = False
+        self.marks = 0
+        self.recomputes = 0
+        self.latencies = deque(maxlen=latency_samples)
+
+    def mark(self, ticker):
+        with self.condition:
+            self.marks += 1
+            if ticker not in self.dirty:
+                self.dirty[ticker] = time_ns()
+                self.condition.notify_all()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until a ticker is marked, stop() is called or timeout seconds pass. Returns the marked
+        tickers as {ticker: time marked in ns} and clears them, {} on timeout and None once stopped.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.dirty or self.stopped, timeout)
+            if self.stopped:
+                return None
+            dirty, self.dirty = self.dirty, {}
+            return dirty
+
+    def done(self, ticker, marked_at):
+        latency = time_ns() - marked_at
+        with self.condition:
+            self.recomputes += 1
+            self.latencies.append(latency)
+        logger.debug(f"Recomputed {ticker} {latency / NANOS_PER_MILLISECOND:.1f} ms after its data arrived")
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def latency_stats(self):
+        # Milliseconds from a ticker's mark to the end of its recompute, over the recent samples
+        with self.condition:
+            samples = np.array(self.latencies, dtype=float) / NANOS_PER_MILLISECOND
+            marks, recomputes = self.marks, self.recomputes
+        stats = {'marks': marks, 'recomputes': recomputes}
+        if samples.size:
+            stats.update({
+                'mean_ms': round(float(samples.mean()), 1),
+                'p50_ms': round(float(np.percentile(samples, 50)), 1),
+                'p99_ms': round(float(np.percentile(samples, 99)), 1),
+                'max_ms': round(float(samples.max()), 1),
+            })
+        return stats
@@ -0,0 +1,41 @@
+import os
+import sys
+import tempfile
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# order_manager imports keyboard for its Esc handler, which needs a desktop session the tests never have
+try:
+    import keyboard  # noqa: F401
+except ImportError:
+    sys.modules['keyboard'] = types.ModuleType('keyboard')
+
+# api_helper builds a Database at import, keep it on a scratch SQLite file
+_scratch = tempfile.mkdtemp(prefix='stockdatadb-tests-')
+os.environ['STOCKDATADB_BACKEND'] = 'sqlite'
+os.environ['STOCKDATADB_PATH'] = os.path.join(_scratch, 'helper.sqlite')
+os.environ['STOCKDATADB_ARCHIVE'] = os.path.join(_scratch, 'helper_archive')
+os.environ.pop('STOCKDATADB_TICK_JOURNAL', None)
+
+from archive import BarArchive  # noqa: E402
+from database import Database  # noqa: E402
+from storage_backends import SQLiteBackend  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(backend=SQLiteBackend(str(tmp_path / 'bars.sqlite')),
+                        archive=BarArchive(root=str(tmp_path / 'archive'), file_format='npz'))
+    database.create_schema()
+    yield database
+    database.db_close_connection()
+
+
+@pytest.fixture
+def ib_api():
+    import api_helper  # noqa: F401, ib_api and api_helper import each other
+    import ib_api
+    return ib_api
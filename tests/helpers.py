@@ -0,0 +1,25 @@
+import types
+
+import pandas as pd
+
+NY = 'America/New_York'
+
+
+def bar_rows(ticker, dates, close=100.0):
+    return [{'ticker': ticker, 'date_time': date.strftime('%Y-%m-%d %H:%M:%S'), 'open': close, 'high': close + 1,
+             'low': close - 1, 'close': close, 'volume': 10.0} for date in dates]
+
+
+def epoch_ns(date):
+    return pd.Timestamp(date, tz=NY).value
+
+
+def recording_app(ib_api, db, tickers, **kwargs):
+    # IBApi with the bar clock stopped and closed bars collected in a list instead of a DataProcessor
+    app = ib_api.IBApi(None, db, **kwargs)
+    app.bar_builder.stop_clock()
+    bars = []
+    app.data_processor = types.SimpleNamespace(data_ready_queue=types.SimpleNamespace(put=bars.append))
+    for ticker in tickers:
+        app.get_reqId_for_contract(app.create_contract(ticker, 'STK', 'SMART', 'USD', 'minute'))
+    return app, bars
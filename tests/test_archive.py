@@ -0,0 +1,31 @@
+from datetime import datetime
+
+import pandas as pd
+
+import archive
+from helpers import bar_rows
+
+
+def test_archive_keeps_rows_loaded_behind_the_cutoff(db):
+    old = pd.date_range('2024-01-10 10:00', periods=20, freq='1min')
+    recent = pd.date_range(datetime.now().replace(second=0, microsecond=0), periods=5, freq='1min')
+    db.insert_bars('minute_data', bar_rows('AAPL', old) + bar_rows('AAPL', recent))
+    assert archive.archive_old_bars(db, days=30) == 20
+
+    # Loaded later, e.g. by the bulk loader, into a month before the cutoff and one before that
+    strays = pd.date_range('2023-06-01 10:00', periods=3, freq='1min').append(
+        pd.date_range('2024-01-10 12:00', periods=2, freq='1min'))
+    db.insert_bars('minute_data', bar_rows('AAPL', strays))
+    assert archive.archive_old_bars(db, days=30) == 5
+
+    cutoff = db.archive.cutoff
+    assert db.count_rows('minute_data', '1970-01-01 00:00:00', f"{cutoff - pd.Timedelta(seconds=1)}") == 0
+    stitched = db.fetch_data_from_db('minute_data', '2023-01-01 00:00:00', '2100-01-01 00:00:00', ticker='AAPL')
+    assert sorted(pd.to_datetime(stitched['Date'])) == sorted(old.append(strays).append(recent))
+
+
+def test_archived_range_is_kept_when_its_rows_changed(db):
+    dates = pd.date_range('2024-01-10 10:00', periods=5, freq='1min')
+    db.insert_bars('minute_data', bar_rows('AAPL', dates))
+    assert db.delete_archived_range('minute_data', 'AAPL', '2024-01-01 00:00:00', '2024-02-01 00:00:00', 4) == 0
+    assert db.count_rows('minute_data', '2024-01-01 00:00:00', '2024-02-01 00:00:00') == 5
@@ -0,0 +1,45 @@
+import types
+
+import numpy as np
+import pandas as pd
+
+from backfill import BackfillScheduler, missing_ranges, plan_backfills, session_minutes
+from helpers import bar_rows
+
+
+def test_backfill_never_sends_more_than_60_requests_in_10_minutes():
+    scheduler = BackfillScheduler(app=None, max_in_flight=1000)
+    for reqId in range(300):
+        contract = types.SimpleNamespace(symbol=f"T{reqId}", secType='STK')
+        scheduler.submit(reqId, {'contract': contract, 'endDateTime': '', 'durationStr': '1 D',
+                                 'barSizeSetting': '1 min', 'whatToShow': 'TRADES', 'useRTH': 0})
+    sent = []
+    for second in range(1800):
+        jobs, _ = scheduler._next_jobs(1000.0 + second)
+        for job in jobs:
+            scheduler.in_flight.pop(job['reqId'])
+            sent.append(1000.0 + second)
+    sent = np.array(sent)
+    assert len(sent) == 180
+    assert max(((sent >= start) & (sent < start + 600)).sum() for start in sent) == 60
+
+
+def test_missing_ranges_merges_and_drops_short_runs():
+    expected = pd.date_range('2024-08-27 09:30', periods=60, freq='1min')
+    stored = expected.delete([5, 6, 20, 21, 22, 24, 25, 26, 50])
+    assert missing_ranges(stored, expected, min_minutes=3) == [
+        (expected[20], expected[22]), (expected[24], expected[26])]
+    assert missing_ranges(stored, expected, min_minutes=2, merge_minutes=2) == [
+        (expected[5], expected[6]), (expected[20], expected[26])]
+
+
+def test_plan_backfills_requests_tail_and_holes(db):
+    now = pd.Timestamp('2024-08-30 14:07')
+    minutes = session_minutes(now - pd.Timedelta(days=6), now - pd.Timedelta(minutes=20))
+    with_hole = minutes[(minutes < '2024-08-27 11:00') | (minutes >= '2024-08-27 11:10')]
+    db.insert_bars('minute_data', bar_rows('AAPL', with_hole) + bar_rows('MSFT', minutes))
+
+    plans = plan_backfills(db, ['AAPL', 'MSFT', 'NONE'], now=now)
+    assert plans['AAPL'] == [('', '1200 S'), ('20240827 11:10:00 US/Eastern', '600 S')]
+    assert plans['MSFT'] == [('', '1200 S')]
+    assert plans['NONE'] == [('', '5 D')]
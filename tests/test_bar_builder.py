@@ -0,0 +1,37 @@
+import pandas as pd
+
+from bar_builder import BarBuilder, NANOS_PER_SECOND
+from helpers import epoch_ns
+
+START = epoch_ns('2024-08-27 10:00')
+
+
+def test_bar_builder_takes_volume_deltas():
+    bars = []
+    builder = BarBuilder(bars.append)
+    builder.add_volume('AAPL', START, 1000.0)  # baseline only
+    builder.add_price('AAPL', START + NANOS_PER_SECOND, 10.0)
+    builder.add_volume('AAPL', START + 2 * NANOS_PER_SECOND, 1300.0)
+    builder.add_price('AAPL', START + 3 * NANOS_PER_SECOND, 12.0)
+    builder.add_volume('AAPL', START + 61 * NANOS_PER_SECOND, 1350.0)  # opens the next minute, closing the first
+    builder.add_volume('AAPL', START + 62 * NANOS_PER_SECOND, 40.0)  # IB restarted its day count
+    builder.close_due(START + 120 * NANOS_PER_SECOND + builder.grace)
+
+    assert [(bar['Open'], bar['High'], bar['Close'], bar['Volume']) for bar in bars] == [
+        (10.0, 12.0, 12.0, 300.0), (12.0, 12.0, 12.0, 90.0)]
+    assert bars[0]['Date'] == pd.Timestamp('2024-08-27 10:00')
+
+
+def test_bars_close_once_on_the_clock_and_late_ticks_roll_forward():
+    bars = []
+    builder = BarBuilder(bars.append)
+    builder.add_price('AAPL', START + 5 * NANOS_PER_SECOND, 10.0)
+    builder.add_price('MSFT', START + 6 * NANOS_PER_SECOND, 20.0)
+    assert builder.close_due(START + 60 * NANOS_PER_SECOND + builder.grace - 1) == 0
+    assert builder.close_due(START + 60 * NANOS_PER_SECOND + builder.grace) == 2
+    assert builder.close_due(START + 120 * NANOS_PER_SECOND + builder.grace) == 0
+
+    # A tick stamped inside the closed minute counts towards the next one
+    builder.add_price('AAPL', START + 59 * NANOS_PER_SECOND, 11.0)
+    assert builder.current_bar('AAPL')['start'] == START + 60 * NANOS_PER_SECOND
+    assert sorted(bar['Ticker'] for bar in bars) == ['AAPL', 'MSFT']
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+from bar_rollups import RollupStore
+
+
+def minute_bars(start, periods, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 100 + rng.standard_normal(periods).cumsum()
+    return pd.DataFrame({'Open': close - 0.1, 'High': close + 0.5, 'Low': close - 0.5, 'Close': close,
+                         'Volume': rng.integers(1, 100, periods).astype(float)},
+                        index=pd.date_range(start, periods=periods, freq='1min', name='Date'))
+
+
+def resampled(bars, interval):
+    expected = bars.resample(interval).agg({'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last',
+                                            'Volume': 'sum'}).dropna()
+    return expected.set_axis(expected.index.as_unit('ns'))
+
+
+def test_rollups_match_resampling_with_late_and_corrected_bars():
+    bars = minute_bars('2024-08-27 09:30', 150)
+    store = RollupStore(intervals=['5min', '1h'])
+    late = bars.index[[3, 70]]
+    store.add_frame('AAPL', bars.drop(late))
+    store.to_frame('AAPL', '5min')
+    store.add_frame('AAPL', bars.loc[late])
+    # A corrected bar replaces the one with the same date
+    bars.iloc[100] = [90.0, 120.0, 80.0, 95.0, 1000.0]
+    store.add_frame('AAPL', bars.iloc[[100]])
+
+    for interval in ['1min', '5min', '1h', '15min']:
+        frame = store.to_frame('AAPL', interval).set_index('Date')
+        pd.testing.assert_frame_equal(frame[['Open', 'High', 'Low', 'Close', 'Volume']], resampled(bars, interval),
+                                      check_freq=False, check_names=False)
+    assert (store.to_frame('AAPL', '1h')['Ticker'] == 'AAPL').all()
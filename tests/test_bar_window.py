@@ -0,0 +1,24 @@
+import pandas as pd
+
+from bar_window import BarWindow
+from helpers import bar_rows
+
+
+def test_bar_window_reads_only_new_bars_and_trims(db, monkeypatch):
+    dates = pd.date_range('2024-08-20 10:00', periods=3, freq='1D').append(
+        pd.date_range('2024-08-27 10:00', periods=3, freq='1min'))
+    db.insert_bars('minute_data', bar_rows('AAPL', dates[:5]))
+    window = BarWindow(db, 'AAPL', lookback_days=7)
+    assert len(window.refresh(pd.Timestamp('2024-08-27 10:05').to_pydatetime())) == 4
+    assert list(window.frame.index) == list(dates[1:5])
+
+    db.insert_bars('minute_data', bar_rows('AAPL', dates[5:]))
+    reads = []
+    fetch = db.fetch_data_from_db
+    monkeypatch.setattr(db, 'fetch_data_from_db',
+                        lambda *args, **kwargs: reads.append(kwargs) or fetch(*args, **kwargs))
+    new_rows = window.refresh(pd.Timestamp('2024-08-28 10:30').to_pydatetime())
+    assert list(new_rows.index) == [dates[5]]
+    assert reads[0]['newer_than'] == dates[4]
+    # Trimmed to the last 7 days
+    assert list(window.frame.index) == list(dates[2:])
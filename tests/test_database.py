@@ -0,0 +1,143 @@
+import threading
+
+import pandas as pd
+import pytest
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import OperationalError
+
+import database
+
+from archive import BarArchive
+from database import Database
+from helpers import bar_rows
+from storage_backends import SQLiteBackend
+
+
+def closes(db, ticker='AAPL'):
+    frame = db.fetch_data_from_db('minute_data', '2024-08-27 00:00:00', '2024-08-27 23:59:59', ticker=ticker)
+    return frame.sort_values('Date')['Close'].tolist()
+
+
+@pytest.mark.parametrize('on_conflict, expected', [('update', [101.0, 101.0, 101.0]),
+                                                   ('ignore', [100.0, 100.0, 101.0])])
+def test_upsert_writes_each_bar_once(tmp_path, on_conflict, expected):
+    db = Database(backend=SQLiteBackend(str(tmp_path / 'bars.sqlite')), archive=BarArchive(root=str(tmp_path)),
+                  write_mode='upsert', on_conflict=on_conflict)
+    db.create_schema()
+    db.ensure_unique_keys()
+    dates = pd.date_range('2024-08-27 09:30', periods=3, freq='1min')
+    assert db.insert_bars('minute_data', bar_rows('AAPL', dates[:2])) == 2
+    db.insert_bars('minute_data', bar_rows('AAPL', dates, close=101.0))
+    assert closes(db) == expected
+    db.db_close_connection()
+
+
+def test_known_tickers_skip_the_companies_check(db):
+    statements = []
+    event.listen(db.engine, 'before_cursor_execute',
+                 lambda connection, cursor, statement, *args: statements.append(statement))
+    dates = pd.date_range('2024-08-27 09:30', periods=3, freq='1min')
+    db.insert_bars('minute_data', bar_rows('AAPL', dates[:1]))
+    snapshot = db.known_tickers
+    assert 'AAPL' in snapshot
+
+    statements.clear()
+    db.insert_bars('minute_data', bar_rows('AAPL', dates[1:2]) + bar_rows('MSFT', dates[1:2]))
+    assert sum('FROM companies WHERE' in statement for statement in statements) == 1
+    # Added by replacing the set, a reference taken earlier never changes under its reader
+    assert 'MSFT' in db.known_tickers and 'MSFT' not in snapshot
+
+    db.invalidate_ticker_cache()
+    statements.clear()
+    db.insert_bars('minute_data', bar_rows('MSFT', dates[2:]))
+    assert [statement for statement in statements if 'companies' in statement] == ['SELECT ticker FROM companies']
+
+
+def test_each_thread_gets_its_own_session(db):
+    sessions = []
+    workers = [threading.Thread(target=lambda: sessions.append((db.session, db.session))) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert all(first is second for first, second in sessions)
+    assert len({id(first) for first, _ in sessions} | {id(db.session)}) == 4
+
+
+def test_fetch_binds_parameters_and_reuses_statements(db, monkeypatch):
+    dates = pd.date_range('2024-08-27 09:30', periods=2, freq='1min')
+    db.insert_bars('minute_data', bar_rows("O'NEIL", dates) + bar_rows('AAPL', dates))
+    assert closes(db, "O'NEIL") == [100.0, 100.0]
+
+    inspected = []
+    get_columns = db.fetch_table_columns
+    monkeypatch.setattr(db, 'fetch_table_columns', lambda name: inspected.append(name) or get_columns(name))
+    statements = set(db.fetch_statements.values())
+    assert closes(db, 'AAPL') == [100.0, 100.0]
+    assert set(db.fetch_statements.values()) == statements
+    assert inspected == []
+
+
+def test_last_dates_come_from_one_query_and_follow_inserts(db):
+    dates = pd.date_range('2024-08-27 09:30', periods=3, freq='1min')
+    db.insert_bars('minute_data', bar_rows('AAPL', dates[:2]) + bar_rows('MSFT', dates[:1]))
+    statements = []
+    event.listen(db.engine, 'before_cursor_execute',
+                 lambda connection, cursor, statement, *args: statements.append(statement))
+    assert db.get_last_dates_for_symbols(['AAPL', 'MSFT', 'NONE']) == {
+        'AAPL': dates[1].to_pydatetime(), 'MSFT': dates[0].to_pydatetime(), 'NONE': None}
+    assert len(statements) == 1
+
+    db.insert_bars('minute_data', bar_rows('AAPL', dates[2:]) + bar_rows('NONE', dates[:1]))
+    statements.clear()
+    assert db.get_last_dates_for_symbols(['AAPL', 'NONE']) == {'AAPL': dates[2], 'NONE': dates[0]}
+    assert statements == []
+
+
+def test_chunked_reads_page_through_every_row_once(db):
+    dates = pd.date_range('2024-08-26 15:55', periods=10, freq='1min').append(
+        pd.date_range('2024-08-27 09:30', periods=7, freq='1min'))
+    db.insert_bars('minute_data', bar_rows('AAPL', dates) + bar_rows('MSFT', dates[:4]) + bar_rows('TSLA', dates))
+    args = ('minute_data', '2024-08-01 00:00:00', '2024-08-31 00:00:00')
+
+    chunks = list(db.iter_data_from_db(*args, tickers=['AAPL', 'MSFT'], chunksize=3, group_by=None))
+    assert [len(chunk) for chunk in chunks] == [3, 3, 3, 3, 3, 3, 3]
+    rows = pd.concat(chunks)
+    assert list(zip(rows['Ticker'], rows['Date'])) == [('AAPL', date) for date in dates] + [
+        ('MSFT', date) for date in dates[:4]]
+
+    days = [(ticker, day, len(chunk)) for ticker, day, chunk in db.iter_data_from_db(*args, chunksize=4)]
+    assert [(ticker, str(day), count) for ticker, day, count in days] == [
+        ('AAPL', '2024-08-26', 10), ('AAPL', '2024-08-27', 7), ('MSFT', '2024-08-26', 4),
+        ('TSLA', '2024-08-26', 10), ('TSLA', '2024-08-27', 7)]
+    ticker, arrays = next(db.iter_data_from_db(*args, ticker='MSFT', group_by='ticker', as_numpy=True))
+    assert ticker == 'MSFT' and arrays['Close'].tolist() == [100.0] * 4
+
+
+def test_bulk_load_tracks_last_dates_of_committed_chunks(db, monkeypatch):
+    inspections = []
+    monkeypatch.setattr(database, 'inspect', lambda engine: inspections.append(engine) or inspect(engine))
+    db.ensure_unique_keys()
+    dates = pd.date_range('2024-08-27 09:30', periods=5, freq='1min')
+    frame = pd.DataFrame({'Ticker': ['AAPL'] * 5 + ['MSFT'] * 5, 'DateTime': dates.append(dates).astype(str),
+                          'Open': 1.0, 'High': 2.0, 'Low': 0.5, 'Close': 1.5, 'Volume': 10})
+    assert db.get_last_dates_for_symbols(['AAPL', 'MSFT']) == {'AAPL': None, 'MSFT': None}
+
+    bulk_load = db.backend.bulk_load
+    calls = []
+
+    def fail_third_chunk(*args):
+        calls.append(args)
+        if len(calls) == 3:
+            raise OperationalError('INSERT', {}, Exception('disk I/O error'))
+        return bulk_load(*args)
+
+    monkeypatch.setattr(db.backend, 'bulk_load', fail_third_chunk)
+    assert db.insert_data_to_db(frame, 'minute_data', chunksize=4) == 8
+    assert db.get_last_dates_for_symbols(['AAPL', 'MSFT']) == {'AAPL': dates[4], 'MSFT': dates[2]}
+
+    monkeypatch.setattr(db.backend, 'bulk_load', bulk_load)
+    assert db.insert_data_to_db(frame.iloc[8:], 'minute_data') == 2
+    assert db.get_last_dates_for_symbols(['AAPL', 'MSFT']) == {'AAPL': dates[4], 'MSFT': dates[4]}
+    # One inspection per bar table, by ensure_unique_keys, none by the loads
+    assert len(inspections) == 2
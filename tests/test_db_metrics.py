@@ -0,0 +1,28 @@
+import pandas as pd
+
+from db_metrics import LatencyHistogram, classify
+from helpers import bar_rows
+
+
+def test_histogram_percentiles_stay_within_a_bucket():
+    histogram = LatencyHistogram()
+    for ms in range(1, 101):
+        histogram.record(ms / 1000, rows=2)
+    histogram.record(0.5, error=True)
+    summary = histogram.summary()
+    assert (summary['count'], summary['errors'], summary['rows'], summary['max_ms']) == (101, 1, 200, 500.0)
+    assert 50 <= summary['p50_ms'] <= 50 * 1.25
+    assert 99 <= summary['p99_ms'] <= 100 * 1.25
+
+
+def test_statements_are_filed_under_the_database_method(db):
+    dates = pd.date_range('2024-08-27 09:30', periods=3, freq='1min')
+    db.insert_bars('minute_data', bar_rows('AAPL', dates))
+    db.fetch_data_from_db('minute_data', '2024-08-27 00:00:00', '2024-08-27 23:59:59', ticker='AAPL')
+    metrics = db.get_query_metrics()
+    assert metrics['db.insert_bars']['count'] == 1
+    assert metrics['insert_bars: INSERT minute_data']['rows'] == 3
+    assert metrics['insert_bars: COMMIT']['count'] == 1
+    assert metrics['db.fetch_data_from_db']['rows'] == 3
+    assert metrics['fetch_data_from_db: SELECT minute_data']['count'] == 1
+    assert classify("CREATE TABLE IF NOT EXISTS minute_data (ticker ...)") == 'CREATE minute_data'
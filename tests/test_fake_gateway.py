@@ -0,0 +1,66 @@
+import types
+
+import pandas as pd
+import pytest
+
+from fake_gateway import FakeGateway
+from helpers import bar_rows, epoch_ns, recording_app
+
+
+class Recorder:
+    # Just enough of an EWrapper to take FakeGateway's callbacks
+    def __init__(self):
+        self.calls = []
+
+    def nextValidId(self, orderId):
+        self.calls.append(('nextValidId', orderId))
+
+    def historicalData(self, reqId, bar):
+        self.calls.append(('historicalData', reqId, bar.date, bar.close))
+
+    def historicalDataEnd(self, reqId, start, end):
+        self.calls.append(('historicalDataEnd', reqId))
+
+
+def test_fake_gateway_answers_history_from_sqlite(db):
+    dates = pd.date_range('2024-08-27 09:30', periods=30, freq='1min')
+    db.insert_bars('minute_data', bar_rows('AAPL', dates))
+    gateway = FakeGateway.from_database(db, ['AAPL'], '2024-08-27 00:00:00', '2024-08-27 23:59:59',
+                                        now='2024-08-27 10:00')
+    app = gateway.attach(Recorder())
+    app.connect()
+    contract = types.SimpleNamespace(symbol='AAPL', secType='STK')
+    app.reqHistoricalData(1, contract, '', '1800 S', '1 min', 'TRADES', 0, 2, False, [])
+    gateway.process_pending()
+
+    bars = [call for call in app.calls if call[0] == 'historicalData']
+    assert [int(call[2]) for call in bars] == [epoch_ns(date) // 10 ** 9 for date in dates]
+    assert app.calls[-1] == ('historicalDataEnd', 1)
+
+
+# keepUpToDate closes a bar on the next one's first update, built bars close on the simulated bar clock
+@pytest.mark.parametrize('stream_mode, closed_bars', [('keep_up_to_date', 3), ('realtime_bars', 4)])
+def test_streamed_bars_close_once_and_are_stored(ib_api, db, stream_mode, closed_bars):
+    dates = pd.date_range('2024-08-27 10:00', periods=4, freq='1min')
+    source = pd.DataFrame({'Date': dates, 'Ticker': 'AAPL', 'Open': [10.0, 11.0, 12.0, 13.0],
+                           'High': [10.5, 11.5, 12.5, 13.5], 'Low': [9.5, 10.5, 11.5, 12.5],
+                           'Close': [10.2, 11.2, 12.2, 13.2], 'Volume': [120.0, 240.0, 360.0, 480.0]})
+    gateway = FakeGateway(bars=source, now='2024-08-27 10:00')
+    app, bars = recording_app(ib_api, db, ['AAPL'], stream_mode=stream_mode)
+    gateway.attach(app)
+    app.connect()
+    gateway.process_pending()
+    reqId, info = next(iter(app.reqId_info.items()))
+    if stream_mode == 'keep_up_to_date':
+        app.reqHistoricalData(reqId, info['contract'], '', '60 S', '1 min', 'TRADES', 0, 2, True, [])
+    app.subscribe_real_time(info['contract'], reqId)
+    gateway.advance(4)
+    gateway.process_pending()
+
+    closed = [bar for bar in bars if isinstance(bar, dict)]
+    assert [bar['Date'] for bar in closed] == list(dates[:closed_bars])
+    assert [bar['Close'] for bar in closed] == [10.2, 11.2, 12.2, 13.2][:closed_bars]
+    assert [bar['Volume'] for bar in closed] == [120.0, 240.0, 360.0, 480.0][:closed_bars]
+    # keepUpToDate also loads the minute before 10:00 from its history request
+    stored = db.fetch_data_from_db('minute_data', '2024-08-27 10:00:00', '2024-08-27 23:59:59', ticker='AAPL')
+    assert sorted(pd.to_datetime(stored['Date'])) == list(dates[:closed_bars])
@@ -0,0 +1,69 @@
+from datetime import datetime
+
+import pandas as pd
+from ibapi.contract import Contract
+
+from fake_gateway import FakeGateway
+from helpers import epoch_ns, recording_app
+from write_behind import WriteBehindQueue
+
+
+def epoch_bar(date, close):
+    return FakeGateway._bar_data(str(epoch_ns(date) // 10 ** 9), close, close + 1, close - 1, close, 10)
+
+
+def test_historical_bars_are_written_in_batches(ib_api, db, monkeypatch):
+    batches = []
+    insert_bars = db.insert_bars
+    monkeypatch.setattr(db, 'insert_bars', lambda table, rows: batches.append(len(rows)) or insert_bars(table, rows))
+    app, _ = recording_app(ib_api, db, ['AAPL'])
+    app.bar_buffer_size = 3
+    reqId = app.get_reqId_for_symbol('AAPL')
+    dates = pd.date_range('2024-08-27 09:30', periods=7, freq='1min')
+    for i, date in enumerate(dates):
+        app.historicalData(reqId, epoch_bar(date, 100.0 + i))
+    assert batches == [3, 3]
+    app.historicalDataEnd(reqId, '', '')
+
+    assert batches == [3, 3, 1]
+    stored = db.fetch_data_from_db('minute_data', '2024-08-27 00:00:00', '2024-08-27 23:59:59', ticker='AAPL')
+    assert sorted(pd.to_datetime(stored['Date'])) == list(dates)
+
+
+def test_bars_the_write_queue_refuses_are_written_directly(ib_api, db):
+    write_queue = WriteBehindQueue(db).start()
+    write_queue.close()
+    app, _ = recording_app(ib_api, db, ['AAPL'], write_queue=write_queue)
+    reqId = app.get_reqId_for_symbol('AAPL')
+    app.historicalData(reqId, epoch_bar(pd.Timestamp('2024-08-27 09:30'), 100.0))
+    app.historicalDataEnd(reqId, '', '')
+    assert app.data_download_complete
+    assert write_queue.get_metrics()['rows_rejected'] == 1
+    assert len(db.fetch_data_from_db('minute_data', '2024-08-27 00:00:00', '2024-08-27 23:59:59')) == 1
+
+
+def test_reqIds_resolve_by_contract_symbol_and_conId(ib_api, db):
+    app, _ = recording_app(ib_api, db, ['AAPL', 'MSFT'])
+    aapl = app.get_reqId_for_symbol('AAPL')
+    contract = app.get_contract_for_symbol('AAPL')
+    extra = app.new_request_id(contract, 'minute')
+    assert app.get_contract_for_reqId(extra) is contract
+    # The first reqId stays the contract's, however many requests it has
+    assert app.get_reqId_for_contract(contract) == aapl
+
+    # IB sends contracts back as new objects with the conId filled in and the primary exchange
+    returned = Contract()
+    returned.symbol, returned.secType, returned.currency, returned.conId = 'AAPL', 'STK', 'USD', 265598
+    returned.exchange = 'NASDAQ'
+    assert app.get_reqId_for_contract(returned) is None
+    app.index_conId(returned)
+    assert app.get_reqId_for_contract(returned) == aapl
+    assert app.get_reqId_for_symbol('MSFT') == app.get_reqId_for_contract(app.get_contract_for_symbol('MSFT'))
+
+
+def test_epoch_bar_rows_are_exchange_time(ib_api):
+    rows = ib_api.IBApi.epoch_bar_rows('AAPL', [(epoch_ns('2024-08-27 09:30') // 10 ** 9, 1, 2, 0.5, 1.5, 10)])
+    assert rows == [{'ticker': 'AAPL', 'date_time': datetime(2024, 8, 27, 9, 30), 'open': 1.0, 'high': 2.0,
+                     'low': 0.5, 'close': 1.5, 'volume': 10.0}]
+    # formatDate=1 dates are in the TWS time zone
+    assert ib_api.IBApi.minute_bar_date('20240827 16:30:00 Europe/Athens').replace(tzinfo=None) == rows[0]['date_time']
@@ -0,0 +1,30 @@
+from datetime import date
+
+from sqlalchemy import inspect
+
+import schema
+from archive import BarArchive
+from database import Database
+from storage_backends import SQLiteBackend
+
+
+def test_tables_are_only_created_by_the_migration(tmp_path):
+    db = Database(backend=SQLiteBackend(str(tmp_path / 'bars.sqlite')), archive=BarArchive(root=str(tmp_path)))
+    assert inspect(db.engine).get_table_names() == []
+    db.create_schema()
+    db.create_schema()
+    assert sorted(inspect(db.engine).get_table_names()) == ['companies', 'daily_data', 'daily_tickers', 'minute_data']
+    assert db.has_unique_key('minute_data', 'date_time')
+    db.db_close_connection()
+
+
+def test_hot_queries_use_the_bar_keys(db):
+    assert db.check_query_plans() == {name: [] for name in db.hot_queries()}
+
+
+def test_partition_clause_has_one_partition_per_month():
+    clause = schema.partition_clause('date_time', date(2024, 11, 1), date(2025, 1, 1))
+    assert "PARTITION p_old VALUES LESS THAN ('2024-11-01')" in clause
+    assert "PARTITION p202412 VALUES LESS THAN ('2025-01-01')" in clause
+    assert "PARTITION p202501 VALUES LESS THAN ('2025-02-01')" in clause
+    assert clause.rstrip().endswith("PARTITION pmax VALUES LESS THAN (MAXVALUE)\n)")
@@ -0,0 +1,21 @@
+from sqlalchemy import inspect
+
+import api_helper
+import simulate
+
+
+def test_simulation_writes_only_to_its_own_database(db):
+    stats = simulate.run_simulation(['AAPL'], '2024-08-27 10:00', minutes=3, speed=1000, history_days=1,
+                                    synthetic=True, stream_mode='realtime_bars', db=db)
+    assert stats['delivered'] > 0
+    stored = db.fetch_data_from_db('minute_data', '2024-08-27 10:00:00', '2024-08-27 10:03:00', ticker='AAPL')
+    assert len(stored) == 3
+    # The configured database (a scratch file in the tests) was never written, not even migrated
+    assert inspect(api_helper.ApiHelper.db.engine).get_table_names() == []
+
+
+def test_scratch_database_is_migrated(tmp_path):
+    db = simulate.scratch_database(str(tmp_path / 'simulate.sqlite'))
+    assert 'minute_data' in inspect(db.engine).get_table_names()
+    assert db.archive.root == str(tmp_path / 'simulate_archive')
+    db.db_close_connection()
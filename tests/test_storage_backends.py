@@ -0,0 +1,25 @@
+import sqlite3
+from datetime import date, datetime, timezone
+
+import pandas as pd
+from sqlalchemy import text
+
+import storage_backends
+from helpers import bar_rows
+
+
+def test_sqlite_backend_stores_dates_as_mysql_prints_them(db):
+    aware = datetime(2024, 8, 27, 13, 30, tzinfo=timezone.utc)
+    row = bar_rows('AAPL', [aware])[0]
+    db.insert_bars('minute_data', [dict(row, date_time=aware)])
+    del row['date_time']
+    db.insert_bars('daily_data', [dict(row, date=date(2024, 8, 27))])
+    with db.engine.connect() as connection:
+        assert connection.execute(text("SELECT date_time FROM minute_data")).scalar() == '2024-08-27 13:30:00'
+        assert connection.execute(text("SELECT date FROM daily_data")).scalar() == '2024-08-27'
+        found = connection.execute(text("SELECT COUNT(*) FROM minute_data WHERE date_time BETWEEN :start AND :end"),
+                                   {'start': datetime(2024, 8, 27, 13), 'end': pd.Timestamp('2024-08-27 14:00')})
+        assert found.scalar() == 1
+    # Set on the backend's engine only, nothing else using sqlite3 in the process is affected
+    adapters = [sqlite3.adapters.get((kind, sqlite3.PrepareProtocol)) for kind in (datetime, date)]
+    assert all(adapter is None or adapter.__module__ != storage_backends.__name__ for adapter in adapters)
@@ -0,0 +1,31 @@
+import threading
+
+from strategy_events import DirtyTickers
+
+
+def test_marks_are_coalesced_until_the_strategy_picks_them_up():
+    events = DirtyTickers()
+    assert events.wait(timeout=0.01) == {}
+    events.mark('AAPL')
+    first = dict(events.dirty)
+    events.mark('AAPL')
+    events.mark('MSFT')
+    dirty = events.wait()
+    assert list(dirty) == ['AAPL', 'MSFT'] and dirty['AAPL'] == first['AAPL']
+    for ticker, marked_at in dirty.items():
+        events.done(ticker, marked_at)
+    stats = events.latency_stats()
+    assert (stats['marks'], stats['recomputes']) == (3, 2)
+
+
+def test_wait_wakes_on_mark_and_on_stop():
+    events = DirtyTickers()
+    woken = []
+    waiter = threading.Thread(target=lambda: woken.extend([events.wait(timeout=5), events.wait(timeout=5)]))
+    waiter.start()
+    events.mark('AAPL')
+    while events.dirty:
+        pass
+    events.stop()
+    waiter.join(5)
+    assert list(woken[0]) == ['AAPL'] and woken[1] is None
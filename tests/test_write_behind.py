@@ -0,0 +1,60 @@
+import threading
+
+import pandas as pd
+import pytest
+
+from helpers import bar_rows
+from write_behind import WriteBehindError, WriteBehindQueue
+
+DATES = pd.date_range('2024-08-27 09:30', periods=6, freq='1min')
+
+
+def stored(db):
+    frame = db.fetch_data_from_db('minute_data', '2024-08-27 00:00:00', '2024-08-27 23:59:59')
+    return len(frame)
+
+
+def test_full_queue_raises_and_never_holds_back_barriers(db, monkeypatch):
+    release = threading.Event()
+    insert_bars = db.insert_bars
+    monkeypatch.setattr(db, 'insert_bars', lambda *args, **kwargs: release.wait() and insert_bars(*args, **kwargs))
+    write_queue = WriteBehindQueue(db, maxsize=4, num_writers=2, put_timeout=0.05, retry_delay=0).start()
+    write_queue.submit_many('minute_data', bar_rows('AAPL', DATES[:2]) + bar_rows('MSFT', DATES[:2]))
+    with pytest.raises(WriteBehindError):
+        write_queue.submit_many('minute_data', bar_rows('AAPL', DATES[2:3]))
+
+    flushed = threading.Event()
+    write_queue.call_when_flushed(flushed.set)
+    release.set()
+    assert flushed.wait(5)
+    assert stored(db) == 4
+    write_queue.submit_many('minute_data', bar_rows('AAPL', DATES[2:]))
+    write_queue.close()
+    metrics = write_queue.get_metrics()
+    assert (metrics['rows_committed'], metrics['rows_rejected'], metrics['rows_dropped']) == (8, 1, 0)
+    assert metrics['blocked_puts'] == 1
+    with pytest.raises(WriteBehindError):
+        write_queue.submit('minute_data', bar_rows('AAPL', DATES[:1])[0])
+
+
+def test_failed_commits_are_retried_then_dropped(db, monkeypatch):
+    failures = {'AAPL': 2, 'MSFT': 10}
+    insert_bars = db.insert_bars
+
+    def flaky_insert(table_name, rows, raise_errors=False):
+        ticker = rows[0]['ticker']
+        if failures[ticker]:
+            failures[ticker] -= 1
+            raise RuntimeError(f"{ticker} is locked")
+        return insert_bars(table_name, rows, raise_errors)
+
+    monkeypatch.setattr(db, 'insert_bars', flaky_insert)
+    write_queue = WriteBehindQueue(db, num_writers=1, commit_attempts=3, retry_delay=0).start()
+    write_queue.submit_many('minute_data', bar_rows('AAPL', DATES[:3]))
+    write_queue.flush()
+    write_queue.submit_many('minute_data', bar_rows('MSFT', DATES[:2]))
+    write_queue.flush()
+    write_queue.close()
+    metrics = write_queue.get_metrics()
+    assert (metrics['rows_committed'], metrics['rows_dropped'], metrics['commit_errors']) == (3, 2, 5)
+    assert stored(db) == 3
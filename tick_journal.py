@@ -0,0 +1,278 @@
+import json
+import os
+import queue
+import struct
+import threading
+import numpy as np
+import pandas as pd
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.FileHandler("ib_api.log")]
+)
+logger.handlers = [h for h in logger.handlers if not isinstance(h, logging.StreamHandler)]
+
+# One little-endian 32-byte record per tick: ts_ns, reqId, tickType, price, size
+RECORD_STRUCT = struct.Struct('<qiidd')
+RECORD_SIZE = RECORD_STRUCT.size
+RECORD_DTYPE = np.dtype([('ts_ns', '<i8'), ('reqId', '<i4'), ('tickType', '<i4'), ('price', '<f8'), ('size', '<f8')])
+INDEX_DTYPE = np.dtype([('ts_ns', '<i8'), ('record', '<i8')])
+_STOP = object()
+
+
+def journal_path(directory, day, suffix='bin'):
+    return os.path.join(directory, f"ticks_{day:%Y%m%d}.{suffix}")
+
+
+class SymbolMap:
+    """
+    The .symbols entries of one day: reqId stands for `symbol` from record number `record` on,
+    until a later entry for the same reqId.
+    """
+
+    def __init__(self, entries=()):
+        self.entries = {}
+        for record, reqId, symbol in sorted(entries, key=lambda entry: entry[0]):
+            records, symbols = self.entries.setdefault(reqId, ([], []))
+            records.append(record)
+            symbols.append(symbol)
+
+    def latest(self):
+        return {reqId: symbols[-1] for reqId, (_, symbols) in self.entries.items()}
+
+    def tickers(self, reqIds, record_numbers):
+        # Ticker of each record, None where its reqId had no entry yet
+        reqIds = np.asarray(reqIds)
+        tickers = np.full(len(reqIds), None, dtype=object)
+        for reqId, (records, symbols) in self.entries.items():
+            rows = np.flatnonzero(reqIds == reqId)
+            if rows.size:
+                which = np.searchsorted(records, np.asarray(record_numbers)[rows], side='right') - 1
+                known = which >= 0
+                tickers[rows[known]] = np.array(symbols, dtype=object)[which[known]]
+        return tickers
+
+
+def read_symbols(path):
+    entries = []
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line torn by a crash mid-write
+                    continue
+                entries.append((int(entry['record']), int(entry['reqId']), entry['symbol']))
+    return SymbolMap(entries)
+
+
+class TickJournal:
+    """
+    Append-only tick tape, one file of fixed-width records per trading day (exchange time) in
+    `directory`. append() only packs the record into an in-memory buffer; full buffers, and every
+    flush_interval seconds whatever has been buffered, are handed to a writer thread that appends
+    them to the day's file, adds every index_every-th record's (ts_ns, record number) to the day's
+    sparse .idx file and appends to its .symbols file which ticker each reqId stands for from which
+    record on (reqIds are reassigned after a restart, earlier entries stay). A crash loses at most
+    the last flush_interval seconds of ticks.
+    """
+
+    def __init__(self, directory, buffer_records=4096, flush_interval=1.0, index_every=1024,
+                 timezone='America/New_York'):
+        self.directory = directory
+        self.buffer_records = buffer_records
+        self.flush_interval = flush_interval
+        self.index_every = index_every
+        self.timezone = timezone
+        self.lock = threading.Lock()
+        self.buffer = bytearray(buffer_records * RECORD_SIZE)
+        self.count = 0
+        self.day = None
+        self.day_start = 0
+        self.day_end = 0
+        self.symbols = {}
+        # Mapping in force when the current buffer was started, and (record in buffer, reqId, ticker) changes since
+        self.buffer_symbols = {}
+        self.symbol_changes = []
+        self.pending = queue.SimpleQueue()
+        self.thread = None
+        self.files = {}
+        self.records_written = 0
+        self.buffers_written = 0
+        self.written_symbols = None
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._writer_loop, name="tick-journal", daemon=True)
+        self.thread.start()
+        return self
+
+    def set_symbol(self, reqId, symbol):
+        with self.lock:
+            if self.symbols.get(reqId) != symbol:
+                self.symbols[reqId] = symbol
+                self.symbol_changes.append((self.count, reqId, symbol))
+
+    def append(self, ts_ns, reqId, tickType, price, size):
+        with self.lock:
+            if not self.day_start <= ts_ns < self.day_end:
+                self._roll(ts_ns)
+            RECORD_STRUCT.pack_into(self.buffer, self.count * RECORD_SIZE, ts_ns, reqId, tickType, price, size)
+            self.count += 1
+            if self.count == self.buffer_records:
+                self._hand_off()
+
+    def _roll(self, ts_ns):
+        # Caller holds the lock; ticks of a new day start a new file
+        self._hand_off()
+        day = pd.Timestamp(ts_ns, tz='UTC').tz_convert(self.timezone).normalize()
+        self.day = day.tz_localize(None)
+        self.day_start = day.value
+        self.day_end = (day + pd.DateOffset(days=1)).value
+
+    def _hand_off(self):
+        # Caller holds the lock; the writer takes the filled buffer and appends go to a fresh one
+        if self.count:
+            self.pending.put((self.day, self.buffer, self.count, self.buffer_symbols, self.symbol_changes))
+            self.buffer = bytearray(self.buffer_records * RECORD_SIZE)
+            self.count = 0
+            self.buffer_symbols = dict(self.symbols)
+            self.symbol_changes = []
+
+    def flush(self):
+        with self.lock:
+            self._hand_off()
+
+    def _writer_loop(self):
+        while True:
+            try:
+                item = self.pending.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self.flush()
+                continue
+            if item is _STOP:
+                break
+            try:
+                self._write(*item)
+            except Exception as e:
+                logger.error(f"Error writing tick journal: {e}")
+                print(f"Error writing tick journal: {e}")
+
+    def _open(self, day):
+        if day not in self.files:
+            for old_day in list(self.files):
+                self.files.pop(old_day)[0].close()
+            path = journal_path(self.directory, day)
+            data = open(path, 'ab')
+            whole = data.tell() // RECORD_SIZE
+            if data.tell() % RECORD_SIZE:
+                # A torn record from a crash mid-write is dropped
+                data.truncate(whole * RECORD_SIZE)
+                data.seek(whole * RECORD_SIZE)
+            self.files[day] = (data, open(journal_path(self.directory, day, 'idx'), 'ab'), whole)
+            self.written_symbols = read_symbols(journal_path(self.directory, day, 'symbols')).latest()
+        return self.files[day]
+
+    def _write_symbols(self, day, position, buffer_symbols, changes):
+        # Only mappings that differ from the one in force at the end of the file are appended
+        entries = [(0, reqId, symbol) for reqId, symbol in buffer_symbols.items()] + changes
+        lines = []
+        for offset, reqId, symbol in entries:
+            if self.written_symbols.get(reqId) != symbol:
+                self.written_symbols[reqId] = symbol
+                lines.append(json.dumps({'record': position + offset, 'reqId': reqId, 'symbol': symbol}) + '\n')
+        if lines:
+            with open(journal_path(self.directory, day, 'symbols'), 'a') as f:
+                f.writelines(lines)
+
+    def _write(self, day, buffer, count, buffer_symbols, changes):
+        data, index, position = self._open(day)
+        self._write_symbols(day, position, buffer_symbols, changes)
+        records = np.frombuffer(buffer, dtype=RECORD_DTYPE, count=count)
+        marks = np.arange((-position) % self.index_every, count, self.index_every)
+        if marks.size:
+            entries = np.empty(marks.size, dtype=INDEX_DTYPE)
+            entries['ts_ns'] = records['ts_ns'][marks]
+            entries['record'] = position + marks
+            index.write(entries.tobytes())
+            index.flush()
+        data.write(memoryview(buffer)[:count * RECORD_SIZE])
+        data.flush()
+        self.files[day] = (data, index, position + count)
+        self.records_written += count
+        self.buffers_written += 1
+
+    def close(self):
+        self.flush()
+        if self.thread:
+            self.pending.put(_STOP)
+            self.thread.join()
+        else:
+            while not self.pending.empty():
+                self._write(*self.pending.get())
+        for data, index, _ in self.files.values():
+            data.close()
+            index.close()
+        self.files = {}
+        logger.info(f"Tick journal closed, {self.records_written} ticks in {self.buffers_written} writes")
+
+
+class TickJournalReader:
+    """
+    Memory-mapped view of one day's journal file; records are read in place, never loaded whole.
+    Seeks by time through the sparse index and then a binary search within one index block, which
+    assumes the records are in time order, as they are written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        n = os.path.getsize(path) // RECORD_SIZE if os.path.exists(path) else 0
+        self.records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', shape=(n,)) if n else np.empty(0, RECORD_DTYPE)
+        index_path = path[:-len('bin')] + 'idx'
+        index = np.fromfile(index_path, dtype=INDEX_DTYPE) if os.path.exists(index_path) else np.empty(0, INDEX_DTYPE)
+        self.index = index[index['record'] < n]
+        self.symbols = read_symbols(path[:-len('bin')] + 'symbols')
+
+    @classmethod
+    def for_day(cls, directory, day):
+        return cls(journal_path(directory, pd.Timestamp(day)))
+
+    def __len__(self):
+        return len(self.records)
+
+    def seek(self, ts_ns):
+        # Number of the first record at or after ts_ns
+        block = np.searchsorted(self.index['ts_ns'], ts_ns, side='right') - 1
+        start = int(self.index['record'][block]) if block >= 0 else 0
+        end = int(self.index['record'][block + 1]) + 1 if block + 1 < len(self.index) else len(self.records)
+        return start + int(np.searchsorted(self.records['ts_ns'][start:end], ts_ns))
+
+    def _range(self, start_ns, end_ns):
+        first = self.seek(start_ns) if start_ns is not None else 0
+        last = self.seek(end_ns) if end_ns is not None else len(self.records)
+        return first, last
+
+    def between(self, start_ns=None, end_ns=None):
+        # Records with start_ns <= ts_ns < end_ns, a view into the mapped file
+        first, last = self._range(start_ns, end_ns)
+        return self.records[first:last]
+
+    def tickers(self, start_ns=None, end_ns=None):
+        # Ticker of each record between() returns, as the reqId stood for when the record was written
+        first, last = self._range(start_ns, end_ns)
+        return self.symbols.tickers(self.records['reqId'][first:last], np.arange(first, last))
+
+    def to_frame(self, start_ns=None, end_ns=None):
+        # Ticks as the DataFrame FakeGateway replays, reqIds resolved to tickers through the symbols file
+        records = self.between(start_ns, end_ns)
+        frame = pd.DataFrame({name: np.asarray(records[name]) for name in RECORD_DTYPE.names})
+        frame['ticker'] = self.tickers(start_ns, end_ns)
+        missing = frame['ticker'].isna()
+        if missing.any():
+            logger.warning(f"{int(missing.sum())} journal ticks in {self.path} have no known ticker")
+            frame = frame[~missing]
+        return frame
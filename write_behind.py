@@ -0,0 +1,259 @@
+import queue
+import threading
+from collections import deque
+from time import perf_counter, sleep
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.FileHandler("ib_api.log")]
+)
+logger.handlers = [h for h in logger.handlers if not isinstance(h, logging.StreamHandler)]
+
+_STOP = object()
+
+
+class WriteBehindError(RuntimeError):
+    # Rows the queue would not take: it is closed, or stayed full for put_timeout. Nothing was queued.
+    pass
+
+
+class _Barrier:
+    def __init__(self, callback, parties):
+        self.callback = callback
+        self.remaining = parties
+        self.lock = threading.Lock()
+
+    def arrive(self):
+        with self.lock:
+            self.remaining -= 1
+            done = self.remaining == 0
+        if done:
+            self.callback()
+
+
+class WriteBehindQueue:
+    """
+    Takes database writes off the IB message loop. Callbacks submit rows and writer threads commit
+    them in batches through Database.insert_bars. Rows are sharded by ticker, so the writes of one
+    ticker are always committed in the order they were submitted. A failed batch is retried in place
+    (holding back the rows behind it) up to commit_attempts times with doubling delays, then dropped
+    and counted in rows_dropped.
+
+    At most maxsize rows wait for the writers. A submit that does not fit waits once, for up to
+    put_timeout seconds (forever when it is None), and then raises WriteBehindError instead of
+    dropping its rows. Flush barriers are never held back or dropped.
+    """
+
+    def __init__(self, db, maxsize=50000, num_writers=2, batch_size=2000, flush_interval=0.5, put_timeout=5.0,
+                 latency_samples=1000, commit_attempts=5, retry_delay=0.5):
+        self.db = db
+        self.commit_attempts = commit_attempts
+        self.retry_delay = retry_delay
+        self.num_writers = num_writers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_pending_rows = maxsize
+        self.pending_rows = 0
+        self.capacity = threading.Condition()
+        self.queues = [queue.Queue() for _ in range(num_writers)]
+        self.threads = []
+        self.closed = False
+        self.metrics_lock = threading.Lock()
+        self.commit_latencies = deque(maxlen=latency_samples)
+        self.rows_submitted = 0
+        self.rows_committed = 0
+        self.batches_committed = 0
+        self.commit_errors = 0
+        self.commit_retries = 0
+        self.rows_dropped = 0
+        self.rows_rejected = 0
+        self.blocked_puts = 0
+        self.blocked_seconds = 0.0
+
+    def start(self):
+        for i, shard in enumerate(self.queues):
+            thread = threading.Thread(target=self._writer_loop, args=(shard,), name=f"db-writer-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"Write-behind queue started with {self.num_writers} writer threads")
+        return self
+
+    def _shard(self, ticker):
+        return self.queues[hash(ticker) % self.num_writers]
+
+    def submit(self, table_name, row):
+        return self.submit_many(table_name, [row])
+
+    def submit_many(self, table_name, rows):
+        if self.closed:
+            self._reject(len(rows), f"Write-behind queue is closed, {len(rows)} rows for {table_name} not queued")
+
+        by_ticker = {}
+        for row in rows:
+            by_ticker.setdefault(row['ticker'], []).append(row)
+
+        self._reserve(table_name, len(rows))
+        for ticker, ticker_rows in by_ticker.items():
+            self._shard(ticker).put((table_name, ticker_rows))
+        return True
+
+    def call_when_flushed(self, callback, ticker=None):
+        # The callback runs on a writer thread once every row submitted before it (for that ticker,
+        # or for all tickers when ticker is None) has been committed
+        if self.closed:
+            # close() has already waited for the writers, whatever was submitted is written or was refused
+            callback()
+            return
+        shards = [self._shard(ticker)] if ticker is not None else self.queues
+        barrier = _Barrier(callback, len(shards))
+        for shard in shards:
+            shard.put(barrier)
+
+    def _reserve(self, table_name, rows):
+        # Backpressure: one wait for the whole submit, whatever the number of shards it spans.
+        # A submit larger than maxsize still goes through once nothing else is waiting.
+        with self.capacity:
+            if self.pending_rows and self.pending_rows + rows > self.max_pending_rows:
+                start = perf_counter()
+                room = self.capacity.wait_for(
+                    lambda: not self.pending_rows or self.pending_rows + rows <= self.max_pending_rows,
+                    timeout=self.put_timeout)
+                with self.metrics_lock:
+                    self.blocked_puts += 1
+                    self.blocked_seconds += perf_counter() - start
+                if not room:
+                    self._reject(rows, f"Write-behind queue full for {self.put_timeout}s, "
+                                       f"{rows} rows for {table_name} not queued")
+            self.pending_rows += rows
+        with self.metrics_lock:
+            self.rows_submitted += rows
+
+    def _release(self, rows):
+        if rows:
+            with self.capacity:
+                self.pending_rows -= rows
+                self.capacity.notify_all()
+
+    def _reject(self, rows, message):
+        with self.metrics_lock:
+            self.rows_rejected += rows
+        logger.error(message)
+        print(message)
+        raise WriteBehindError(message)
+
+    def _writer_loop(self, shard):
+        while True:
+            try:
+                item = shard.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch = {}
+            batch_rows = 0
+            items = 0
+            stop = False
+            while True:
+                items += 1
+                if item is _STOP:
+                    stop = True
+                elif isinstance(item, _Barrier):
+                    # Everything queued ahead of the barrier has to be committed before it fires
+                    self._commit(batch)
+                    self._release(batch_rows)
+                    batch, batch_rows = {}, 0
+                    item.arrive()
+                else:
+                    table_name, rows = item
+                    batch.setdefault(table_name, []).extend(rows)
+                    batch_rows += len(rows)
+
+                if stop or batch_rows >= self.batch_size:
+                    break
+                try:
+                    item = shard.get_nowait()
+                except queue.Empty:
+                    break
+
+            self._commit(batch)
+            self._release(batch_rows)
+            # Marked done only after the commit, so flush() really waits for the rows to be written
+            for _ in range(items):
+                shard.task_done()
+            if stop:
+                return
+
+    def _commit(self, batch):
+        for table_name, rows in batch.items():
+            for attempt in range(1, self.commit_attempts + 1):
+                if self._commit_rows(table_name, rows, attempt):
+                    break
+                if attempt < self.commit_attempts:
+                    with self.metrics_lock:
+                        self.commit_retries += 1
+                    sleep(self.retry_delay * 2 ** (attempt - 1))
+            else:
+                with self.metrics_lock:
+                    self.rows_dropped += len(rows)
+                logger.error(f"Dropped {len(rows)} rows for {table_name} after {self.commit_attempts} failed commits")
+                print(f"Dropped {len(rows)} rows for {table_name} after {self.commit_attempts} failed commits")
+
+    def _commit_rows(self, table_name, rows, attempt):
+        start = perf_counter()
+        try:
+            written = self.db.insert_bars(table_name, rows, raise_errors=True)
+        except Exception as e:
+            with self.metrics_lock:
+                self.commit_errors += 1
+            logger.error(f"Write-behind commit of {len(rows)} rows into {table_name} failed (attempt {attempt}): {e}")
+            print(f"Write-behind commit of {len(rows)} rows into {table_name} failed (attempt {attempt}): {e}")
+            return False
+        latency = perf_counter() - start
+        with self.metrics_lock:
+            self.commit_latencies.append(latency)
+            self.batches_committed += 1
+            self.rows_committed += written
+        logger.debug(f"Committed {written}/{len(rows)} rows into {table_name} in {latency * 1000:.1f} ms")
+        return True
+
+    def queue_depth(self):
+        return sum(shard.qsize() for shard in self.queues)
+
+    def flush(self):
+        for shard in self.queues:
+            shard.join()
+
+    def close(self, timeout=30.0):
+        if self.closed:
+            return
+        self.closed = True
+        for shard in self.queues:
+            shard.put(_STOP)
+        for thread in self.threads:
+            thread.join(timeout)
+        logger.info(f"Write-behind queue closed: {self.get_metrics()}")
+        print(f"Write-behind queue closed: {self.get_metrics()}")
+
+    def get_metrics(self):
+        with self.metrics_lock:
+            latencies = sorted(self.commit_latencies)
+            metrics = {
+                'queue_depth': self.queue_depth(),
+                'rows_submitted': self.rows_submitted,
+                'rows_committed': self.rows_committed,
+                'batches_committed': self.batches_committed,
+                'commit_errors': self.commit_errors,
+                'commit_retries': self.commit_retries,
+                'rows_dropped': self.rows_dropped,
+                'rows_rejected': self.rows_rejected,
+                'blocked_puts': self.blocked_puts,
+                'blocked_seconds': round(self.blocked_seconds, 3),
+            }
+        if latencies:
+            metrics['commit_latency_p50_ms'] = round(latencies[len(latencies) // 2] * 1000, 2)
+            metrics['commit_latency_p99_ms'] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2)
+            metrics['commit_latency_max_ms'] = round(latencies[-1] * 1000, 2)
+        return metrics